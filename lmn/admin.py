@@ -2,9 +2,10 @@ from django.contrib import admin
 
 # Register your models here.
 
-from .models import Venue, Artist, Note, Show
+from .models import Venue, Artist, Note, Show, PendingPhotoDeletion
 
 admin.site.register(Venue)
 admin.site.register(Artist)
 admin.site.register(Note)
 admin.site.register(Show)
+admin.site.register(PendingPhotoDeletion)
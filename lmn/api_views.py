@@ -1,39 +1,31 @@
-import requests
-from .models import Artist, Venue, Show
 from django.http import HttpResponse, HttpResponseServerError
-import os
 import logging
-from urllib import parse
-from django.core.exceptions import ObjectDoesNotExist
-from django.db import IntegrityError
-
-key = os.environ.get('TICKETMASTER_KEY')
-baseUrl = 'https://app.ticketmaster.com/discovery/v2/'
+from .ticketmaster.crawler import Crawler
+from .ticketmaster.ingest import SyncReport, ingest_artists, ingest_venues, ingest_shows
+from .ticketmaster.markets import markets, event_query, venue_query
 
 unavailable_message = 'There was a problem. Try again later.'
 
+
 def get_events():
-    designted_market_area = '336' # https://developer.ticketmaster.com/products-and-docs/apis/discovery-api/v2/#supported-dma
-    query = {'classificationName': 'music', 'dmaId': designted_market_area}
-    # Help of parsing url from https://www.youtube.com/watch?v=LosIGgon_KM
-    url = '{}events.json?{}&apikey={}'.format(baseUrl, parse.urlencode(query), key)
-    response = requests.get(url.strip())
-    response.raise_for_status()
-    return response.json()
+    # One list of events per page, streamed as pages arrive
+    crawler = Crawler()
+    for market in markets():
+        yield from crawler.items('events', event_query(market))
+
+
+def get_venues():
+    crawler = Crawler()
+    for market in markets():
+        yield from crawler.items('venues', venue_query(market))
+
 
 def get_artist(request):
     try:
-        data = get_events()
-        events = data['_embedded']['events']
-
-        for event in events:
-            # attractions are artists
-            attractions = event['_embedded']['attractions']
-            for attraction in attractions:
-                try:
-                    Artist(name=attraction['name']).save()
-                except IntegrityError as e:
-                    logging.error(f'Error: {e}')
+        report = SyncReport()
+        for events in get_events():
+            ingest_artists(events, report)
+        logging.info(f'Artist sync\n{report}')
 
         return HttpResponse('ok')
 
@@ -45,21 +37,10 @@ def get_artist(request):
 def get_venue(request):
 
     try:
-        query = {'classificationName': 'music', 'stateCode': 'MN'}
-        url = '{}venues.json?{}&apikey={}'.format(baseUrl, parse.urlencode(query), key)
-        response = requests.get(url.strip())
-        response.raise_for_status()
-        data = response.json()
-        results = data['_embedded']['venues']
-        
-        for result in results:
-            try:
-                venue_name = result['name']
-                venue_city = result['city']['name']
-                venue_state = result['state']['stateCode']
-                Venue(name=venue_name, city=venue_city, state=venue_state).save()
-            except IntegrityError as e:
-                logging.error(f'Error: {e}')
+        report = SyncReport()
+        for venues in get_venues():
+            ingest_venues(venues, report)
+        logging.info(f'Venue sync\n{report}')
 
         return HttpResponse('ok')
 
@@ -72,20 +53,10 @@ def get_venue(request):
 def get_show(request):
 
     try:
-        data = get_events()
-        events = data['_embedded']['events']
-
-        for event in events:
-            try:
-                # todo: there is a many to many relationship that needs to be fixed.
-                # a show can have many artists and an artist cna have many shows.
-                artist_name = event['_embedded']['attractions'][0]['name']
-                venue_name = event['_embedded']['venues'][0]['name']
-                show_date_time = event['dates']['start']['dateTime']
-                artists = Show(show_date=show_date_time, artist=Artist.objects.get(name=artist_name), venue=Venue.objects.get(name=venue_name))
-                artists.save()
-            except IntegrityError as e:
-                logging.error(f'Error: {e}')
+        report = SyncReport()
+        for events in get_events():
+            ingest_shows(events, report)
+        logging.info(f'Show sync\n{report}')
         return HttpResponse('ok')
 
     except Exception as e:
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class LmnConfig(AppConfig):
     name = 'lmn'
+
+    def ready(self):
+        from . import signals  # connects the receivers
@@ -0,0 +1,121 @@
+"""
+Ingestion throughput: events per second, queries issued and peak memory.
+
+    python -m lmn.benchmarks.ingest_throughput [--events 1000 10000 100000] [--recording DIR]
+
+Each size is ingested twice in a fresh process against a scratch test
+database (the development database is never touched): once into empty tables
+(insert) and again with the same events (resync, which should write nothing).
+Synthetic events are fed to ingestion page by page, as the crawler hands them
+over, which skips HTTP. With --recording the pages saved by record_ticketmaster
+are replayed end to end instead: served by the stub, crawled, parsed and
+ingested.
+
+Peak memory is the growth of the child's peak RSS (Linux, getrusage). It's a
+high-water mark, so the resync column only shows growth beyond the insert pass.
+With SQLite the scratch database lives in memory, so it includes the rows written.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from lmn.benchmarks.parse_memory import synthetic_event
+
+
+PAGE_SIZE = 200
+
+
+def synthetic_pages(count):
+    """ Lists of synthetic events, a page at a time, so the whole set is never in memory. """
+    for start in range(0, count, PAGE_SIZE):
+        yield [synthetic_event(n) for n in range(start, min(count, start + PAGE_SIZE))]
+
+
+def recorded_pages(directory):
+    from lmn.ticketmaster.crawler import Crawler
+    from lmn.ticketmaster.fakes import StubTicketmaster
+    from lmn.ticketmaster.recording import load
+
+    with StubTicketmaster(load(directory)) as stub:
+        crawler = Crawler(base_url=stub.base_url, api_key='replay', per_second=1000, cache=False)
+        for items in crawler.items('events', {}):
+            yield list(items)
+
+
+class QueryCounter:
+    """ Counts queries without keeping their SQL, which would inflate the memory being measured. """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def measure(pages):
+    """ Ingest every page, returning (events, seconds, queries, peak RSS growth in KiB). """
+    from django.db import connection
+    from lmn.ticketmaster.ingest import SyncReport, ingest_events
+
+    report = SyncReport()
+    queries = QueryCounter()
+    events = 0
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with connection.execute_wrapper(queries):
+        start = time.monotonic()
+        for page in pages:
+            events += len(page)
+            ingest_events(page, report)
+        seconds = time.monotonic() - start
+    return events, seconds, queries.count, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_rss
+
+
+def run(count, recording):
+    """ Insert then resync `count` synthetic events, or the recording. Run in a child process. """
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lmnop_project.settings')
+    django.setup()
+    from django.db import connection
+
+    database_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, serialize=False)
+    try:
+        results = {}
+        for mode in ('insert', 'resync'):
+            pages = recorded_pages(recording) if recording else synthetic_pages(count)
+            results[mode] = measure(pages)
+        print(json.dumps(results))
+    finally:
+        connection.creation.destroy_test_db(database_name, verbosity=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--events', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--recording', help='Replay a directory saved by the record_ticketmaster command')
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        run(args.child, args.recording)
+        return
+
+    sizes = [0] if args.recording else args.events
+    print(f'{"events":>8}  {"mode":<8}{"events/s":>10}{"queries":>10}{"peak RSS growth":>18}')
+    for size in sizes:
+        command = [sys.executable, '-m', 'lmn.benchmarks.ingest_throughput', '--child', str(size)]
+        if args.recording:
+            command += ['--recording', args.recording]
+        results = json.loads(subprocess.run(command, check=True, capture_output=True, text=True).stdout)
+        for mode, (events, seconds, queries, rss_kb) in results.items():
+            print(f'{events:>8}  {mode:<8}{events / seconds:>10.0f}{queries:>10}{rss_kb / 1024:>14.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
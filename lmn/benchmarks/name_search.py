@@ -0,0 +1,131 @@
+"""
+Artist name search latency: icontains versus trigram similarity.
+
+    python -m lmn.benchmarks.name_search [--artists 10000 100000 1000000] [--queries 50]
+
+Each size runs in a fresh process against a scratch test database (the
+development database is never touched), filled with synthetic band names made
+of a few words. Every query is run both ways: a name with one letter dropped,
+the typo users make, and a single word, the substring case icontains handles.
+icontains finds nothing for the typos, which is the point of similar(); the
+found column counts the typos whose first page of results has the right name.
+
+On Postgres both are answered by the trigram GIN index (ILIKE '%word%' can use
+it too). Elsewhere similar() builds an in-memory trigram index on first use,
+timed separately as "index build", and icontains scans the table.
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+
+WORDS = '''
+    amber angry arctic atomic autumn black blue broken bright burning cannon captain cellar chrome cold copper cosmic
+    crimson crystal dark dead delta desert diamond dream drifting dusty echo electric empty ember faded fallen fire
+    flying forest frozen ghost glass gold golden gravity green grey harbor heavy hollow honey hungry iron ivory jade
+    jungle kings last lazy lonely lost lucky lunar magic marble medicine metal midnight mirror modern moon neon night
+    north ocean orange paper pink plastic polar purple quiet radio rainbow raven rebel red river rocket royal rusty
+    sacred saint salt savage scarlet secret shadow silent silver sister smoke solar sonic southern static steel stone
+    storm strange sugar summer sun swamp sweet thunder tiger twin velvet violet wild winter wolf wooden yellow young
+'''.split()
+SUFFIXES = '''
+    band boys brothers club collective crew daughters experience family gang girls kids machine orchestra parade
+    project revival riders society sound sisters squad sweethearts trio union
+'''.split()
+
+
+def synthetic_name(n):
+    """ A distinct name for every n up to len(WORDS) ** 3, about 1.9 million. """
+    first, rest = n % len(WORDS), n // len(WORDS)
+    second, rest = rest % len(WORDS), rest // len(WORDS)
+    third = rest % len(WORDS)
+    return f'{WORDS[first]} {WORDS[second]} {WORDS[third]} {SUFFIXES[n % len(SUFFIXES)]}'.title()
+
+
+def misspell(name, rng):
+    position = rng.randrange(1, len(name))
+    return name[:position] + name[position + 1:]
+
+
+def fill(count, batch_size=5000):
+    from lmn.models import Artist
+    for start in range(0, count, batch_size):
+        Artist.objects.bulk_create([Artist(name=synthetic_name(n)) for n in range(start, min(count, start + batch_size))])
+
+
+def timed(function):
+    start = time.monotonic()
+    result = function()
+    return result, (time.monotonic() - start) * 1000
+
+
+def run(count, queries):
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lmnop_project.settings')
+    django.setup()
+    from django.db import connection
+    from lmn.models import Artist
+    from lmn.search import similar, trigram_index
+
+    database_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, serialize=False)
+    try:
+        fill(count)
+        index_ms = 0
+        if connection.vendor != 'postgresql':
+            index, index_ms = timed(lambda: trigram_index(Artist.objects.all()))
+
+        rng = random.Random(count)
+        wanted = [synthetic_name(rng.randrange(count)) for n in range(queries)]
+        cases = {
+            'typo': [(misspell(name, rng), name) for name in wanted],
+            'word': [(name.split()[1], name) for name in wanted],
+        }
+        results = {'index_ms': index_ms}
+        for case, pairs in cases.items():
+            for method, lookup in (('icontains', lambda text: Artist.objects.filter(name__icontains=text).order_by('name')),
+                                   ('similar', lambda text: similar(Artist.objects.all(), text))):
+                times = []
+                found = 0
+                for text, name in pairs:
+                    # a page of results, as the artist list shows
+                    names, ms = timed(lambda: [artist.name for artist in lookup(text)[:25]])
+                    times.append(ms)
+                    found += name in names
+                results[f'{case} {method}'] = (statistics.median(times), max(times), found if case == 'typo' else None, len(pairs))
+        print(json.dumps(results))
+    finally:
+        connection.creation.destroy_test_db(database_name, verbosity=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--artists', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        run(args.child, args.queries)
+        return
+
+    print(f'{"artists":>8}  {"query":<16}{"median ms":>10}{"max ms":>10}{"found":>10}')
+    for size in args.artists:
+        command = [sys.executable, '-m', 'lmn.benchmarks.name_search', '--child', str(size), '--queries', str(args.queries)]
+        results = json.loads(subprocess.run(command, check=True, capture_output=True, text=True).stdout)
+        index_ms = results.pop('index_ms')
+        if index_ms:
+            print(f'{size:>8}  {"index build":<16}{index_ms:>10.1f}')
+        for query, (median, slowest, found, total) in results.items():
+            found = f'{found}/{total}' if found is not None else ''
+            print(f'{size:>8}  {query:<16}{median:>10.1f}{slowest:>10.1f}{found:>10}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Peak memory of parsing one Discovery API events page, whole versus streamed.
+
+    python -m lmn.benchmarks.parse_memory [--events 200]
+
+Writes a synthetic page shaped like real Discovery API events (images, sales,
+classifications, embedded venue and attractions) to a temporary file, then
+parses it in a fresh process per mode so each peak RSS is measured from the
+same starting point. Each event is normalized as ingestion would, and
+discarded.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+
+def synthetic_event(n):
+    image = {'ratio': '16_9', 'url': f'https://s1.ticketm.net/dam/a/{n:06d}/image_TABLET_LANDSCAPE_LARGE_16_9.jpg',
+             'width': 2048, 'height': 1152, 'fallback': False}
+    venue = {
+        'name': f'Venue {n % 40}', 'type': 'venue', 'id': f'KovZpZA{n % 40:04d}', 'locale': 'en-us',
+        'postalCode': '55403', 'timezone': 'America/Chicago',
+        'city': {'name': 'Minneapolis'}, 'state': {'name': 'Minnesota', 'stateCode': 'MN'},
+        'country': {'name': 'United States Of America', 'countryCode': 'US'},
+        'address': {'line1': '701 N 1st Ave'}, 'location': {'longitude': '-93.276', 'latitude': '44.979'},
+        'markets': [{'name': 'Minneapolis / St. Paul', 'id': '29'}], 'dmas': [{'id': 336}],
+        'upcomingEvents': {'_total': 120, 'ticketmaster': 120},
+        '_links': {'self': {'href': f'/discovery/v2/venues/KovZpZA{n % 40:04d}?locale=en-us'}},
+    }
+    attraction = {
+        'name': f'Band {n}', 'type': 'attraction', 'id': f'K8vZ91{n:06d}', 'locale': 'en-us',
+        'url': f'https://www.ticketmaster.com/band-{n}-tickets/artist/{n}',
+        'images': [dict(image, ratio=ratio) for ratio in ('16_9', '3_2', '4_3')] * 3,
+        'classifications': [{'primary': True, 'segment': {'id': 'KZFzniwnSyZfZ7v7nJ', 'name': 'Music'},
+                             'genre': {'id': 'KnvZfZ7vAeA', 'name': 'Rock'},
+                             'subGenre': {'id': 'KZazBEonSMnZfZ7v6F1', 'name': 'Pop'}}],
+        'upcomingEvents': {'_total': 12, 'ticketmaster': 12},
+        '_links': {'self': {'href': f'/discovery/v2/attractions/K8vZ91{n:06d}?locale=en-us'}},
+    }
+    return {
+        'name': f'Band {n} Live', 'type': 'event', 'id': f'vvG1zZ{n:08d}', 'test': False, 'locale': 'en-us',
+        'url': f'https://www.ticketmaster.com/event/{n:016X}',
+        'images': [image] * 10,
+        'sales': {'public': {'startDateTime': '2020-10-01T15:00:00Z', 'startTBD': False, 'endDateTime': '2021-03-01T02:00:00Z'}},
+        'dates': {'start': {'localDate': '2021-02-28', 'localTime': '20:00:00', 'dateTime': '2021-03-01T02:00:00Z'},
+                  'timezone': 'America/Chicago', 'status': {'code': 'onsale'}, 'spanMultipleDays': False},
+        'classifications': attraction['classifications'],
+        'priceRanges': [{'type': 'standard', 'currency': 'USD', 'min': 25.0, 'max': 75.0}],
+        'pleaseNote': 'All ages. Doors open one hour before the show. ' * 3,
+        '_links': {'self': {'href': f'/discovery/v2/events/vvG1zZ{n:08d}?locale=en-us'}},
+        '_embedded': {'venues': [venue], 'attractions': [attraction]},
+    }
+
+
+def synthetic_page(count):
+    return {
+        '_embedded': {'events': [synthetic_event(n) for n in range(count)]},
+        '_links': {'self': {'href': '/discovery/v2/events.json?page=0&size={}'.format(count)}},
+        'page': {'size': count, 'totalElements': count, 'totalPages': 1, 'number': 0},
+    }
+
+
+def parse(mode, path):
+    """ Parse the page at `path` and normalize every event. Run in a child process. """
+    from lmn.ticketmaster.normalize import normalize_events
+    from lmn.ticketmaster.stream import Page, StreamingPage
+
+    def chunks():
+        with open(path, 'rb') as page_file:
+            while True:
+                chunk = page_file.read(64 * 1024)
+                if not chunk:
+                    return
+                yield chunk
+
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    if mode == 'whole':
+        # What the crawler did before: the whole body in memory, then the whole page as Python objects
+        body = b''.join(chunks())
+        page = Page(json.loads(body), 'events')
+    else:
+        page = StreamingPage(chunks(), 'events')
+    artists, shows = normalize_events(page.items)
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'shows': len(shows), 'traced_peak': traced_peak, 'rss_growth_kb': peak_rss - start_rss}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        parse(*args.child)
+        return
+
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as page_file:
+        page_file.write(json.dumps(synthetic_page(args.events)).encode())
+    try:
+        size = os.path.getsize(page_file.name)
+        print(f'{args.events} events, {size / 1024:.0f} KiB page')
+        print(f'{"mode":<8}{"peak RSS growth":>18}{"peak Python heap":>20}')
+        for mode in ('whole', 'stream'):
+            output = subprocess.run([sys.executable, '-m', 'lmn.benchmarks.parse_memory', '--child', mode, page_file.name],
+                                    check=True, capture_output=True, text=True).stdout
+            result = json.loads(output)
+            print(f'{mode:<8}{result["rss_growth_kb"] / 1024:>15.1f} MiB{result["traced_peak"] / 1024 / 1024:>17.1f} MiB')
+    finally:
+        os.remove(page_file.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Versioned cache keys.
+
+Instead of tracking down and deleting every cached entry that was built from
+some data, each entry's key includes a version number for that data. When the
+data changes its version is bumped, so old entries are never read again and
+simply expire. Signal handlers in lmn/signals.py do the bumping, and the
+Ticketmaster ingest, whose bulk writes send no signals.
+
+Versions are named for what they cover: 'notes' for every note, 'show:12'
+for one show and its notes, 'venue:3' for the shows at a venue, 'user:5' for
+one user's notes, and a table name ('lmn_venue') for the whole table.
+
+cached_page caches whole responses of a view under versioned keys. Versions
+live in the cache itself, so this works the same with any backend: local
+memory or files on a single server, memcached or redis shared by several.
+"""
+
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+def _version_key(name):
+    return f'version:{name}'
+
+
+def get_version(name):
+    version = cache.get(_version_key(name))
+    if version is None:
+        # Start from the clock, not 1, so a version that was evicted can't come back and match old entries
+        cache.add(_version_key(name), int(time.time() * 1000), timeout=None)
+        version = cache.get(_version_key(name))
+    return version
+
+
+def bump_version(name):
+    try:
+        cache.incr(_version_key(name))
+    except ValueError:
+        # Not in the cache, so there's nothing to make stale, and the next read starts a new version
+        pass
+
+
+def bump_versions(names):
+    for name in names:
+        bump_version(name)
+
+
+def bump_now_and_on_commit(names):
+    # Now, so the rest of this transaction doesn't read a page cached before the write. Again after commit,
+    # since until then other requests still see the old rows and may have cached them under the new version.
+    names = list(names)
+    bump_versions(names)
+    transaction.on_commit(lambda: bump_versions(names))
+
+
+def versioned_key(name, *parts, depends_on=()):
+    """ A cache key for `name` and `parts`, which changes whenever any of the data named in `depends_on` does. """
+    versions = [f'{dependency}.{get_version(dependency)}' for dependency in depends_on]
+    return ':'.join([name, *versions, *(str(part) for part in parts)])
+
+
+def cached_page(depends_on, timeout=None):
+    """
+    Cache a view's responses, keyed by URL (with query string) and who is asking, until any of the versions
+    `depends_on(request, **view_kwargs)` returns is bumped or PAGE_CACHE_SECONDS pass.
+    Only plain 200 GET responses are kept. A page with a CSRF token or a cookie is specific to one
+    browser's session, so it's never cached.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or not settings.PAGE_CACHE_SECONDS:
+                return view(request, *args, **kwargs)
+
+            viewer = f'user{request.user.pk}' if request.user.is_authenticated else 'anonymous'
+            path = hashlib.sha1(request.get_full_path().encode()).hexdigest()  # short and safe for memcached
+            key = versioned_key(f'page:{view.__name__}', viewer, path, depends_on=depends_on(request, *args, **kwargs))
+            response = cache.get(key)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code == 200 and not response.streaming and not response.cookies \
+                        and not request.META.get('CSRF_COOKIE_USED'):
+                    cache.set(key, response, settings.PAGE_CACHE_SECONDS if timeout is None else timeout)
+            return response
+        return wrapper
+    return decorator
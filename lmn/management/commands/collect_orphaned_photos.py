@@ -0,0 +1,68 @@
+import datetime
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from lmn.models import Note
+from lmn.photo_gc import format_bytes, referenced_photos, still_referenced, stored_files
+from lmn.photos import original_name
+from lmn.ratelimit import RateLimiter
+
+
+class Command(BaseCommand):
+    help = 'Delete photo files in storage that no note refers to, once they\'re older than a grace period.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=24,
+                            help='Leave files modified more recently than this, which may be uploads whose note isn\'t saved yet')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be deleted without deleting it')
+        parser.add_argument('--deletes-per-second', type=float, default=10, help='At most this many storage deletes a second, 0 for no limit')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Notes read, and orphans checked and deleted, at a time')
+
+    def handle(self, *args, **options):
+        # Anything uploaded after this is too new to judge, so reading the notes first can't miss a new note's photo
+        cutoff = timezone.now() - datetime.timedelta(hours=options['grace_hours'])
+        referenced = referenced_photos(options['chunk_size'])
+        self.limiter = RateLimiter(options['deletes_per_second'])
+        self.dry_run = options['dry_run']
+        self.verbosity = options['verbosity']
+        self.totals = {'deleted': 0, 'bytes': 0, 'failed': 0}
+
+        scanned = recent = 0
+        orphans = []
+        for stored in stored_files(default_storage, Note._meta.get_field('photo').upload_to):
+            scanned += 1
+            if stored.modified > cutoff:
+                recent += 1
+            elif original_name(stored.name) not in referenced:
+                orphans.append(stored)
+                if len(orphans) >= options['chunk_size']:
+                    self.delete(orphans)
+                    orphans = []
+        self.delete(orphans)
+
+        verb = 'Would delete' if self.dry_run else 'Deleted'
+        self.stdout.write(f'Scanned {scanned} files, {recent} too recent to check. {verb} {self.totals["deleted"]} orphaned photos, '
+                          f'{format_bytes(self.totals["bytes"])} reclaimed, {self.totals["failed"]} failed')
+
+    def delete(self, orphans):
+        if not orphans:
+            return
+        in_use = still_referenced({original_name(stored.name) for stored in orphans})
+        for stored in orphans:
+            if original_name(stored.name) in in_use:
+                continue
+            if not self.dry_run:
+                self.limiter.wait()
+                try:
+                    default_storage.delete(stored.name)
+                except Exception as e:
+                    self.totals['failed'] += 1
+                    self.stderr.write(f'Couldn\'t delete {stored.name}: {e}')
+                    continue
+            if self.verbosity > 1:
+                self.stdout.write(stored.name)
+            self.totals['deleted'] += 1
+            self.totals['bytes'] += stored.size or 0
+
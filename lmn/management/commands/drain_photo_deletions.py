@@ -0,0 +1,74 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from lmn.models import PendingPhotoDeletion
+
+
+def claim(batch_size):
+    """
+    The next `batch_size` due deletions, pushed back by PHOTO_DELETION_LEASE_SECONDS so no other worker takes
+    them meanwhile. A worker that dies mid-batch leaves its rows to be claimed again once the lease runs out.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(PendingPhotoDeletion.objects.select_for_update(skip_locked=True)
+                     .filter(next_attempt__lte=now).order_by('next_attempt', 'pk')[:batch_size])
+        PendingPhotoDeletion.objects.filter(pk__in=[pending.pk for pending in batch]).update(
+            next_attempt=now + datetime.timedelta(seconds=settings.PHOTO_DELETION_LEASE_SECONDS))
+    return batch
+
+
+def retry_delay(attempts):
+    """ Seconds to wait before trying again after `attempts` failures: doubling each time, up to a day. """
+    return min(settings.PHOTO_DELETION_RETRY_SECONDS * 2 ** (attempts - 1), 24 * 60 * 60)
+
+
+def drain_batch(batch_size):
+    """ Delete a batch of queued photos from storage. Returns (deleted, failed). """
+    batch = claim(batch_size)
+    deleted = []
+    failed = []
+    for pending in batch:
+        # No exists() first: storages treat deleting a missing file as done, and it would be a second remote call
+        try:
+            default_storage.delete(pending.name)
+            deleted.append(pending.pk)
+        except Exception as e:
+            pending.attempts += 1
+            pending.next_attempt = timezone.now() + datetime.timedelta(seconds=retry_delay(pending.attempts))
+            pending.last_error = f'{type(e).__name__}: {e}'
+            failed.append(pending)
+
+    PendingPhotoDeletion.objects.filter(pk__in=deleted).delete()
+    PendingPhotoDeletion.objects.bulk_update(failed, ['attempts', 'next_attempt', 'last_error'])
+    return len(deleted), len(failed)
+
+
+class Command(BaseCommand):
+    help = 'Delete queued photo files (PendingPhotoDeletion) from storage, a batch at a time, retrying failures later.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Photos claimed from the queue at a time')
+        parser.add_argument('--forever', action='store_true', help='Keep running, checking the queue again when it\'s empty')
+        parser.add_argument('--sleep', type=float, default=10, help='Seconds to wait between checks of an empty queue, with --forever')
+
+    def handle(self, *args, **options):
+        deleted = failed = 0
+        while True:
+            batch_deleted, batch_failed = drain_batch(options['batch_size'])
+            deleted += batch_deleted
+            failed += batch_failed
+            if batch_deleted or batch_failed:
+                continue
+            if not options['forever']:
+                break
+            time.sleep(options['sleep'])
+
+        waiting = PendingPhotoDeletion.objects.count()
+        self.stdout.write(f'Deleted {deleted} photos, {failed} failed attempts, {waiting} still queued')
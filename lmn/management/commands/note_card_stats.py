@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from lmn import note_cards
+
+
+class Command(BaseCommand):
+    help = 'Show how often note cards were served from the cache (see lmn/note_cards.py).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Start counting again from zero')
+
+    def handle(self, *args, **options):
+        stats = note_cards.stats()
+        total = stats['hits'] + stats['misses']
+        hit_rate = f'{100 * stats["hits"] / total:.1f}%' if total else 'n/a'
+        self.stdout.write(f'{stats["hits"]} hits, {stats["misses"]} misses, hit rate {hit_rate}')
+        if options['reset']:
+            note_cards.reset_stats()
+            self.stdout.write('Counts reset')
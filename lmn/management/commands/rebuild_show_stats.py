@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+
+from lmn.caching import bump_version
+from lmn.models import Note, Show, ShowStats
+
+
+def count_notes(show_pks):
+    """ Fresh, unsaved ShowStats for the shows in `show_pks` that have notes, counted from the notes. """
+    counts = (Note.objects.filter(show_id__in=show_pks).values('show_id')
+              .annotate(note_count=Count('pk'), rating_total=Sum('rating'), last_note_date=Max('posted_date'),
+                        **{f'rating_{stars}': Count('pk', filter=Q(rating=stars)) for stars in range(1, 6)}))
+    return [ShowStats(**row) for row in counts]
+
+
+class Command(BaseCommand):
+    help = 'Recount every show\'s note totals (ShowStats) from the notes, a batch of shows at a time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Shows per batch, each rebuilt in its own transaction')
+
+    def handle(self, *args, **options):
+        last_pk = 0
+        shows = 0
+        with_notes = 0
+        while True:
+            # Walk the shows by primary key, so each batch is an index range rather than an ever deeper OFFSET
+            show_pks = list(Show.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:options['batch_size']])
+            if not show_pks:
+                break
+            with transaction.atomic():
+                stats = count_notes(show_pks)
+                ShowStats.objects.filter(show_id__in=show_pks).delete()
+                ShowStats.objects.bulk_create(stats)
+            last_pk = show_pks[-1]
+            shows += len(show_pks)
+            with_notes += len(stats)
+
+        # Stats for shows that no longer exist go with their show, so there's nothing else to clean up.
+        # Best shows is ranked from the stats and cached under the notes version.
+        bump_version('notes')
+        self.stdout.write(f'Rebuilt stats for {shows} shows, {with_notes} with notes')
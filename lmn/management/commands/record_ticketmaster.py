@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from lmn.ticketmaster.markets import markets, event_query, venue_query
+from lmn.ticketmaster.recording import record
+
+
+class Command(BaseCommand):
+    help = 'Save Ticketmaster venue and event pages for one market to a directory, for replaying in tests and benchmarks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--market', help='Market name, the first configured market if not given')
+        parser.add_argument('--only', choices=['venues', 'events'], help='Record just venues, or just events')
+
+    def handle(self, *args, **options):
+        configured = [market for market in markets() if options['market'] in (None, market['name'])]
+        if not configured:
+            raise CommandError(f'No market named {options["market"]}')
+        market = configured[0]
+
+        if options['only'] in (None, 'venues'):
+            count = record(options['directory'], 'venues', venue_query(market))
+            self.stdout.write(f'venues: {count} recorded')
+        if options['only'] in (None, 'events'):
+            count = record(options['directory'], 'events', event_query(market))
+            self.stdout.write(f'events: {count} recorded')
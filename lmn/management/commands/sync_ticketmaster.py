@@ -0,0 +1,52 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from lmn.ticketmaster.client import default_client
+from lmn.ticketmaster.ingest import SyncReport
+from lmn.ticketmaster.markets import markets, event_query, venue_query
+from lmn.ticketmaster.sync import sync_resource, sync_markets, checkpoint_name, ingest_event_page, ingest_venue_page
+
+
+class Command(BaseCommand):
+    help = 'Fetch venues, artists and shows from Ticketmaster. Resumes an interrupted run, and only writes rows that changed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', choices=['venues', 'events'], help='Sync just venues, or just events (artists and shows)')
+        parser.add_argument('--full', action='store_true', help='Ignore checkpoints and fetch everything again')
+        parser.add_argument('--market', action='append', help='Sync just this market (by name), can be repeated')
+        parser.add_argument('--processes', type=int, help='Worker processes for crawling several markets at once, 1 to crawl them here in turn')
+
+    def handle(self, *args, **options):
+        report = SyncReport()
+        start = time.monotonic()
+        selected = [market for market in markets() if not options['market'] or market['name'] in options['market']]
+
+        # Several markets are crawled in worker processes, unless asked to go one at a time
+        sharded = len(selected) > 1 and options['processes'] != 1 and not options['only']
+        if sharded:
+            sync_markets(selected, report, full=options['full'], processes=options['processes'])
+        else:
+            for market in selected:
+                # A market that fails is reported, like sync_markets does, and the next one is still synced
+                try:
+                    self.sync_market(market, options, report)
+                except Exception as e:
+                    logging.exception(f'Sync of market {market["name"]} failed')
+                    report.fail(market['name'], e)
+
+        report.time('total', time.monotonic() - start)
+        self.stdout.write(str(report))
+        self.stdout.write(f'failed markets: {len(report.failures)} of {len(selected)}')
+        if not sharded:
+            self.stdout.write(f'ticketmaster requests: {default_client().metrics}')
+
+    def sync_market(self, market, options, report):
+        # Venues first, so shows on the event pages can find their venue
+        if options['only'] in (None, 'venues'):
+            sync_resource(checkpoint_name('venues', market), 'venues', venue_query(market), ingest_venue_page,
+                          report, full=options['full'])
+        if options['only'] in (None, 'events'):
+            sync_resource(checkpoint_name('events', market), 'events', event_query(market), ingest_event_page,
+                          report, full=options['full'])
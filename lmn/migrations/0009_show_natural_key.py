@@ -0,0 +1,45 @@
+# Generated by Django 3.1.2 on 2026-10-18 20:35
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_shows(apps, schema_editor):
+    """ Keep the oldest show for each (artist, venue, show_date), move the notes from the others onto it, and delete the others. """
+    Show = apps.get_model('lmn', 'Show')
+    Note = apps.get_model('lmn', 'Note')
+
+    duplicated = (Show.objects.values('artist', 'venue', 'show_date')
+                  .annotate(keep=Min('pk'), copies=Count('pk'))
+                  .filter(copies__gt=1))
+
+    for key in duplicated.iterator():
+        duplicates = (Show.objects.filter(artist=key['artist'], venue=key['venue'], show_date=key['show_date'])
+                      .exclude(pk=key['keep']))
+        Note.objects.filter(show__in=duplicates).update(show=key['keep'])
+        duplicates.delete()
+
+    # Postgres checks the deferred foreign keys at commit, and until then refuses the ALTER TABLE lmn_show
+    # that adds the constraint below ("pending trigger events"). Check them now instead.
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lmn', '0008_synccheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='show',
+            name='ticketmaster_id',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+        migrations.RunPython(remove_duplicate_shows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='show',
+            constraint=models.UniqueConstraint(fields=('artist', 'venue', 'show_date'), name='unique_show'),
+        ),
+    ]
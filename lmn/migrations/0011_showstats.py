@@ -0,0 +1,40 @@
+# Generated by Django 3.1.2 on 2026-10-18 20:49
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+import django.db.models.deletion
+
+
+def count_existing_notes(apps, schema_editor):
+    """ Stats for every show that already has notes. The rebuild_show_stats command does the same in batches. """
+    Note = apps.get_model('lmn', 'Note')
+    ShowStats = apps.get_model('lmn', 'ShowStats')
+    counts = (Note.objects.values('show_id')
+              .annotate(note_count=Count('pk'), rating_total=Sum('rating'), last_note_date=Max('posted_date'),
+                        **{f'rating_{stars}': Count('pk', filter=Q(rating=stars)) for stars in range(1, 6)}))
+    ShowStats.objects.bulk_create([ShowStats(**row) for row in counts.iterator()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lmn', '0010_record_fingerprints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShowStats',
+            fields=[
+                ('show', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='lmn.show')),
+                ('note_count', models.IntegerField(default=0)),
+                ('rating_total', models.IntegerField(default=0)),
+                ('rating_1', models.IntegerField(default=0)),
+                ('rating_2', models.IntegerField(default=0)),
+                ('rating_3', models.IntegerField(default=0)),
+                ('rating_4', models.IntegerField(default=0)),
+                ('rating_5', models.IntegerField(default=0)),
+                ('last_note_date', models.DateField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(count_existing_notes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,127 @@
+from django.db import migrations
+
+
+# The statements search.install() ran when this migration was written, kept here as they were so later
+# changes to lmn/search.py can't change what this migration does. See lmn/search.py for how they work.
+
+POSTGRES_INSTALL = [
+    'ALTER TABLE lmn_artist ADD COLUMN IF NOT EXISTS search_vector tsvector',
+    '''CREATE OR REPLACE FUNCTION lmn_artist_search_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := setweight(to_tsvector('simple', coalesce(NEW.name, '')), 'A');
+            RETURN NEW;
+        END $$ LANGUAGE plpgsql''',
+    'DROP TRIGGER IF EXISTS lmn_artist_search_update ON lmn_artist',
+    '''CREATE TRIGGER lmn_artist_search_update BEFORE INSERT OR UPDATE OF name ON lmn_artist
+        FOR EACH ROW EXECUTE PROCEDURE lmn_artist_search_update()''',
+    'UPDATE lmn_artist SET name = name WHERE search_vector IS NULL',
+    'CREATE INDEX IF NOT EXISTS lmn_artist_search_idx ON lmn_artist USING GIN (search_vector)',
+
+    'ALTER TABLE lmn_venue ADD COLUMN IF NOT EXISTS search_vector tsvector',
+    '''CREATE OR REPLACE FUNCTION lmn_venue_search_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := setweight(to_tsvector('simple', coalesce(NEW.name, '')), 'A') || setweight(to_tsvector('simple', coalesce(NEW.city, '')), 'B');
+            RETURN NEW;
+        END $$ LANGUAGE plpgsql''',
+    'DROP TRIGGER IF EXISTS lmn_venue_search_update ON lmn_venue',
+    '''CREATE TRIGGER lmn_venue_search_update BEFORE INSERT OR UPDATE OF name, city ON lmn_venue
+        FOR EACH ROW EXECUTE PROCEDURE lmn_venue_search_update()''',
+    'UPDATE lmn_venue SET name = name WHERE search_vector IS NULL',
+    'CREATE INDEX IF NOT EXISTS lmn_venue_search_idx ON lmn_venue USING GIN (search_vector)',
+
+    'ALTER TABLE lmn_note ADD COLUMN IF NOT EXISTS search_vector tsvector',
+    '''CREATE OR REPLACE FUNCTION lmn_note_search_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A') || setweight(to_tsvector('english', coalesce(NEW.text, '')), 'B');
+            RETURN NEW;
+        END $$ LANGUAGE plpgsql''',
+    'DROP TRIGGER IF EXISTS lmn_note_search_update ON lmn_note',
+    '''CREATE TRIGGER lmn_note_search_update BEFORE INSERT OR UPDATE OF title, text ON lmn_note
+        FOR EACH ROW EXECUTE PROCEDURE lmn_note_search_update()''',
+    'UPDATE lmn_note SET title = title WHERE search_vector IS NULL',
+    'CREATE INDEX IF NOT EXISTS lmn_note_search_idx ON lmn_note USING GIN (search_vector)',
+]
+
+POSTGRES_UNINSTALL = [
+    'DROP TRIGGER IF EXISTS lmn_artist_search_update ON lmn_artist',
+    'DROP FUNCTION IF EXISTS lmn_artist_search_update()',
+    'ALTER TABLE lmn_artist DROP COLUMN IF EXISTS search_vector',
+    'DROP TRIGGER IF EXISTS lmn_venue_search_update ON lmn_venue',
+    'DROP FUNCTION IF EXISTS lmn_venue_search_update()',
+    'ALTER TABLE lmn_venue DROP COLUMN IF EXISTS search_vector',
+    'DROP TRIGGER IF EXISTS lmn_note_search_update ON lmn_note',
+    'DROP FUNCTION IF EXISTS lmn_note_search_update()',
+    'ALTER TABLE lmn_note DROP COLUMN IF EXISTS search_vector',
+]
+
+SQLITE_INSTALL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS lmn_artist_fts USING fts5(name, content='lmn_artist', content_rowid='id')",
+    'CREATE TRIGGER IF NOT EXISTS lmn_artist_fts_insert AFTER INSERT ON lmn_artist BEGIN '
+    'INSERT INTO lmn_artist_fts(rowid, name) VALUES (new.id, new.name); END',
+    'CREATE TRIGGER IF NOT EXISTS lmn_artist_fts_delete AFTER DELETE ON lmn_artist BEGIN '
+    "INSERT INTO lmn_artist_fts(lmn_artist_fts, rowid, name) VALUES ('delete', old.id, old.name); END",
+    'CREATE TRIGGER IF NOT EXISTS lmn_artist_fts_update AFTER UPDATE OF name ON lmn_artist BEGIN '
+    "INSERT INTO lmn_artist_fts(lmn_artist_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+    'INSERT INTO lmn_artist_fts(rowid, name) VALUES (new.id, new.name); END',
+    "INSERT INTO lmn_artist_fts(lmn_artist_fts) VALUES ('rebuild')",
+
+    "CREATE VIRTUAL TABLE IF NOT EXISTS lmn_venue_fts USING fts5(name, city, content='lmn_venue', content_rowid='id')",
+    'CREATE TRIGGER IF NOT EXISTS lmn_venue_fts_insert AFTER INSERT ON lmn_venue BEGIN '
+    'INSERT INTO lmn_venue_fts(rowid, name, city) VALUES (new.id, new.name, new.city); END',
+    'CREATE TRIGGER IF NOT EXISTS lmn_venue_fts_delete AFTER DELETE ON lmn_venue BEGIN '
+    "INSERT INTO lmn_venue_fts(lmn_venue_fts, rowid, name, city) VALUES ('delete', old.id, old.name, old.city); END",
+    'CREATE TRIGGER IF NOT EXISTS lmn_venue_fts_update AFTER UPDATE OF name, city ON lmn_venue BEGIN '
+    "INSERT INTO lmn_venue_fts(lmn_venue_fts, rowid, name, city) VALUES ('delete', old.id, old.name, old.city); "
+    'INSERT INTO lmn_venue_fts(rowid, name, city) VALUES (new.id, new.name, new.city); END',
+    "INSERT INTO lmn_venue_fts(lmn_venue_fts) VALUES ('rebuild')",
+
+    "CREATE VIRTUAL TABLE IF NOT EXISTS lmn_note_fts USING fts5(title, text, content='lmn_note', content_rowid='id')",
+    'CREATE TRIGGER IF NOT EXISTS lmn_note_fts_insert AFTER INSERT ON lmn_note BEGIN '
+    'INSERT INTO lmn_note_fts(rowid, title, text) VALUES (new.id, new.title, new.text); END',
+    'CREATE TRIGGER IF NOT EXISTS lmn_note_fts_delete AFTER DELETE ON lmn_note BEGIN '
+    "INSERT INTO lmn_note_fts(lmn_note_fts, rowid, title, text) VALUES ('delete', old.id, old.title, old.text); END",
+    'CREATE TRIGGER IF NOT EXISTS lmn_note_fts_update AFTER UPDATE OF title, text ON lmn_note BEGIN '
+    "INSERT INTO lmn_note_fts(lmn_note_fts, rowid, title, text) VALUES ('delete', old.id, old.title, old.text); "
+    'INSERT INTO lmn_note_fts(rowid, title, text) VALUES (new.id, new.title, new.text); END',
+    "INSERT INTO lmn_note_fts(lmn_note_fts) VALUES ('rebuild')",
+]
+
+SQLITE_UNINSTALL = [
+    'DROP TRIGGER IF EXISTS lmn_artist_fts_insert',
+    'DROP TRIGGER IF EXISTS lmn_artist_fts_delete',
+    'DROP TRIGGER IF EXISTS lmn_artist_fts_update',
+    'DROP TABLE IF EXISTS lmn_artist_fts',
+    'DROP TRIGGER IF EXISTS lmn_venue_fts_insert',
+    'DROP TRIGGER IF EXISTS lmn_venue_fts_delete',
+    'DROP TRIGGER IF EXISTS lmn_venue_fts_update',
+    'DROP TABLE IF EXISTS lmn_venue_fts',
+    'DROP TRIGGER IF EXISTS lmn_note_fts_insert',
+    'DROP TRIGGER IF EXISTS lmn_note_fts_delete',
+    'DROP TRIGGER IF EXISTS lmn_note_fts_update',
+    'DROP TABLE IF EXISTS lmn_note_fts',
+]
+
+
+def execute(schema_editor, statements):
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement, params=None)
+
+
+def install_search(apps, schema_editor):
+    """ tsvector columns, triggers and GIN indexes on Postgres, FTS5 tables and triggers on SQLite. """
+    execute(schema_editor, {'postgresql': POSTGRES_INSTALL, 'sqlite': SQLITE_INSTALL})
+
+
+def uninstall_search(apps, schema_editor):
+    execute(schema_editor, {'postgresql': POSTGRES_UNINSTALL, 'sqlite': SQLITE_UNINSTALL})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lmn', '0011_showstats'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search, uninstall_search),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations
+
+
+def install_trigrams(apps, schema_editor):
+    """ pg_trgm and trigram GIN indexes on artist and venue names, on Postgres only. See search.similar(). """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute('CREATE INDEX IF NOT EXISTS lmn_artist_name_trgm_idx ON lmn_artist USING GIN (name gin_trgm_ops)')
+    schema_editor.execute('CREATE INDEX IF NOT EXISTS lmn_venue_name_trgm_idx ON lmn_venue USING GIN (name gin_trgm_ops)')
+
+
+def uninstall_trigrams(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS lmn_artist_name_trgm_idx')
+    schema_editor.execute('DROP INDEX IF EXISTS lmn_venue_name_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lmn', '0012_full_text_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_trigrams, uninstall_trigrams),
+    ]
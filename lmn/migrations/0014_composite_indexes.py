@@ -0,0 +1,34 @@
+# Generated by Django 3.1.2 on 2026-10-18 21:01
+
+from django.db import migrations, models
+import lmn.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lmn', '0013_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='note',
+            index=lmn.models.NullsLastIndex(fields=['-posted_date', '-id'], name='note_posted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=lmn.models.NullsLastIndex(fields=['show', '-posted_date', '-id'], name='note_show_posted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=lmn.models.NullsLastIndex(fields=['user', '-posted_date', '-id'], name='note_user_posted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='show',
+            index=models.Index(fields=['artist', '-show_date', '-id'], name='show_artist_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='show',
+            index=models.Index(fields=['venue', '-show_date', '-id'], name='show_venue_date_idx'),
+        ),
+    ]
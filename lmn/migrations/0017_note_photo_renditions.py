@@ -0,0 +1,18 @@
+# Generated by Django 3.1.2 on 2026-10-18 21:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lmn', '0016_pending_photo_deletion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='photo_renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
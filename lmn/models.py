@@ -1,8 +1,14 @@
 from django.db import models
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, FloatField, ExpressionWrapper, Max, Sum
+from django.db.models.functions import Cast
 from django.contrib.auth.models import User
 from django.core.files.storage import default_storage
+from django.utils import timezone
+from django.db.models.fields.files import FieldFile
+
+from . import photos
 
 
 # Every model gets a primary key field by default.
@@ -26,6 +32,7 @@ class Profile(models.Model):
 """ A music artist """
 class Artist(models.Model):
     name = models.CharField(max_length=200, blank=False, unique=True)
+    fingerprint = models.CharField(max_length=32, blank=True, default='')  # hash of the Ticketmaster record, so syncs can skip unchanged rows
 
     def __str__(self):
         return f'Name: {self.name}'
@@ -36,21 +43,83 @@ class Venue(models.Model):
     name = models.CharField(max_length=200, blank=False, unique=True)
     city = models.CharField(max_length=200, blank=False)
     state = models.CharField(max_length=2, blank=False) 
+    fingerprint = models.CharField(max_length=32, blank=True, default='')  # hash of the Ticketmaster record
 
     def __str__(self):
         return f'Name: {self.name} Location: {self.city}, {self.state}'
 
 
+class NullsLastIndex(models.Index):
+    """
+    An index whose descending nullable columns keep NULLs last, the order pagination.ordering() sorts them in,
+    so lists can be read from the index in order. Postgres puts NULLs first in a descending index unless told;
+    SQLite always puts them last when descending.
+    """
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        fields = [model._meta.get_field(field_name) for field_name, _ in self.fields_orders]
+        col_suffixes = []
+        for field, (field_name, order) in zip(fields, self.fields_orders):
+            if order == 'DESC' and field.null and schema_editor.connection.vendor == 'postgresql':
+                order = 'DESC NULLS LAST'
+            col_suffixes.append(order)
+        return schema_editor._create_index_sql(
+            model, fields, name=self.name, using=using, db_tablespace=self.db_tablespace,
+            col_suffixes=col_suffixes, opclasses=self.opclasses, condition=self._get_condition_sql(model, schema_editor),
+            **kwargs,
+        )
+
+
+class ShowQuerySet(models.QuerySet):
+
+    def ranked_by_notes(self, prior_weight):
+        """
+        Shows with at least one note, best first, annotated with note_count, mean_rating and score.
+        The score is a Bayesian average: the show's ratings plus `prior_weight` notes at the
+        average rating of all notes. Shows with few notes stay near the average until more agree.
+        Reads the running totals in ShowStats, so nothing is aggregated per show.
+        """
+        totals = ShowStats.objects.aggregate(ratings=Sum('rating_total'), notes=Sum('note_count'))
+        prior_mean = totals['ratings'] / totals['notes'] if totals['notes'] else 0.0
+        return self.filter(stats__note_count__gt=0).annotate(
+            note_count=F('stats__note_count'),
+            mean_rating=ExpressionWrapper(Cast('stats__rating_total', FloatField()) / F('stats__note_count'), output_field=FloatField()),
+            score=ExpressionWrapper((prior_weight * prior_mean + F('stats__rating_total')) / (prior_weight + F('stats__note_count')), output_field=FloatField()),
+        ).select_related('artist', 'venue').order_by('-score', '-note_count', 'pk')
+
+
 """ A show - one artist playing at one venue at a particular date. """
 class Show(models.Model):
     show_date = models.DateTimeField(blank=False)
     artist = models.ForeignKey(Artist, on_delete=models.CASCADE)
     venue = models.ForeignKey(Venue, on_delete=models.CASCADE)
+    ticketmaster_id = models.CharField(max_length=100, blank=True, null=True, unique=True)  # the upstream event id, if it came from Ticketmaster
+    fingerprint = models.CharField(max_length=32, blank=True, default='')  # hash of the Ticketmaster record
+
+    objects = ShowQuerySet.as_manager()
+
+    class Meta:
+        # The natural key. Syncs upsert on this (or the Ticketmaster id) so reruns never duplicate a show
+        constraints = [
+            models.UniqueConstraint(fields=['artist', 'venue', 'show_date'], name='unique_show'),
+        ]
+        # An artist's or venue's shows, newest first. pk is last because pagination sorts on it to break ties
+        indexes = [
+            models.Index(fields=['artist', '-show_date', '-id'], name='show_artist_date_idx'),
+            models.Index(fields=['venue', '-show_date', '-id'], name='show_venue_date_idx'),
+        ]
 
     def __str__(self):
         return f'Artist: {self.artist} At: {self.venue} On: {self.show_date}'
 
 
+class NoteQuerySet(models.QuerySet):
+
+    def for_listing(self):
+        """ Notes with everything a note card shows (artist, venue and author) loaded in the same query. """
+        return self.select_related('show__artist', 'show__venue', 'user')
+
+
 """ One user's opinion of one show. """
 class Note(models.Model):
 
@@ -69,29 +138,195 @@ class Note(models.Model):
     rating = models.IntegerField(choices=STAR_RATING, blank=True, default=None)
     posted_date = models.DateField(blank=True, null=True)
     photo = models.ImageField(upload_to='user_images/', blank=True, null=True)
+    photo_renditions = models.JSONField(default=dict, blank=True)  # the photo's smaller copies, see photos.py
+    updated_at = models.DateTimeField(auto_now=True, null=True)  # in the key of the note's cached card, see note_cards.py
+
+    objects = NoteQuerySet.as_manager()
+
+    class Meta:
+        # Latest notes, a show's notes and a user's notes, newest first, in the order pagination reads them
+        indexes = [
+            NullsLastIndex(fields=['-posted_date', '-id'], name='note_posted_idx'),
+            NullsLastIndex(fields=['show', '-posted_date', '-id'], name='note_show_posted_idx'),
+            NullsLastIndex(fields=['user', '-posted_date', '-id'], name='note_user_posted_idx'),
+        ]
+
+    # Notes remember the values they were loaded with, so saving knows what changed without reading the row again.
+    # Saving compares these old values with the new ones, so they have to have been loaded, not deferred.
+    TRACKED = {'show_id', 'rating', 'posted_date', 'photo'}
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        note = super().from_db(db, field_names, values)
+        note._loaded = note._current_values(field_names)
+        return note
+
+    def refresh_from_db(self, using=None, fields=None):
+        # Also called to load a deferred field on first use
+        super().refresh_from_db(using, fields)
+        refreshed = [self._meta.get_field(name).attname for name in fields] if fields else self._loaded_attnames()
+        self._loaded = {**getattr(self, '_loaded', {}), **self._current_values(refreshed)}
+
+    def _loaded_attnames(self):
+        deferred = self.get_deferred_fields()
+        return [field.attname for field in self._meta.concrete_fields if field.attname not in deferred]
+
+    def _current_values(self, attnames):
+        values = {}
+        for attname in attnames:
+            value = getattr(self, attname)
+            values[attname] = (value.name or '') if isinstance(value, FieldFile) else value
+        return values
+
+    def changed_fields(self):
+        """
+        The attnames of fields changed since the note was loaded, or None for a note that wasn't loaded from
+        the database. updated_at isn't counted, it changes on every save.
+        """
+        loaded = getattr(self, '_loaded', None)
+        if loaded is None:
+            return None
+        current = self._current_values(self._loaded_attnames())
+        changed = {attname for attname, value in current.items() if attname not in loaded or loaded[attname] != value}
+        if self.photo and not self.photo._committed:
+            changed.add('photo')  # a new upload, even one with the old file's name
+        return changed - {self._meta.pk.attname, 'updated_at'}
 
-    #this will override djangos built in save function
     def save(self, *args, **kwargs):
-        old_note = Note.objects.filter(pk=self.pk).first()
-        if old_note and old_note.photo:
-            if old_note.photo != self.photo:
-                self.delete_photo(old_note.photo)
-        
-        super().save(*args, **kwargs)
+        changed = self.changed_fields()
+        if changed is not None and not args and kwargs.get('update_fields') is None:
+            if not changed:
+                return  # nothing to write
+            kwargs['update_fields'] = changed | {'updated_at'}
+        if 'photo' in (changed or ()) and self.photo_renditions:
+            self.photo_renditions = {}  # they're of the old photo
+            if 'update_fields' in kwargs:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'photo_renditions'}
+
+        with transaction.atomic():
+            if changed is not None and self.TRACKED.issubset(self._loaded):
+                old_note = Note(**self._loaded)
+            elif self.pk is None:
+                old_note = None
+            else:
+                # Made with a primary key rather than loaded, so only the database knows what it replaces
+                old_note = Note.objects.filter(pk=self.pk).first()
 
-    #if a whole note is deleted, this is used so the photo associated with the note is not taking up space in our file system
-    def delete(self, *args, **kwargs):
-        if self.photo:
-            self.delete_photo(self.photo)
+            if old_note and old_note.photo and old_note.photo != self.photo:
+                old_note.delete_photo()
+
+            super().save(*args, **kwargs)
+            ShowStats.note_changed(old_note, self)
+
+            update_fields = kwargs.get('update_fields')
+            saved = [self._meta.get_field(name).attname for name in update_fields] if update_fields else self._loaded_attnames()
+            self._loaded = {**getattr(self, '_loaded', {}), **self._current_values(saved)}
+
+    def delete_photo(self):
+        """ Queue the photo and its renditions to be deleted once this transaction commits, see PendingPhotoDeletion. """
+        names = [self.photo.name, *photos.rendition_names(self.photo.name, self.photo_renditions)]
+        PendingPhotoDeletion.objects.bulk_create([PendingPhotoDeletion(name=name) for name in names])
+
+    @property
+    def card_photo_sources(self):
+        """ [(mime type, srcset)] of the renditions small enough for a note card. """
+        return photos.sources(self.photo.name, self.photo_renditions, photos.CARD_WIDTHS)
+
+    @property
+    def card_photo_url(self):
+        """ The smallest JPEG rendition, for browsers that don't understand srcset. """
+        return default_storage.url(photos.rendition_name(self.photo.name, self.photo_renditions['token'], min(self.photo_renditions['widths']), 'jpg'))
+
+    @property
+    def photo_sources(self):
+        """ [(mime type, srcset)] of every rendition, for the note's own page. """
+        return photos.sources(self.photo.name, self.photo_renditions)
+
+
+""" A photo file to delete from storage, queued in the transaction that stopped using it. """
+class PendingPhotoDeletion(models.Model):
+    # Storage calls are slow and can fail, so requests only add a row here and the drain_photo_deletions
+    # command deletes the files. A row rolled back with its note never deletes a file that's still in use,
+    # and a failed delete stays queued to be tried again, rather than leaving an orphaned file.
+    name = models.CharField(max_length=255)
+    queued = models.DateTimeField(auto_now_add=True)
+    attempts = models.IntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now, db_index=True)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f'Delete {self.name}, {self.attempts} attempts'
+
+
+class ShowStats(models.Model):
+    show = models.OneToOneField(Show, primary_key=True, on_delete=models.CASCADE, related_name='stats')
+    note_count = models.IntegerField(default=0)
+    rating_total = models.IntegerField(default=0)
+    # how many notes gave each number of stars
+    rating_1 = models.IntegerField(default=0)
+    rating_2 = models.IntegerField(default=0)
+    rating_3 = models.IntegerField(default=0)
+    rating_4 = models.IntegerField(default=0)
+    rating_5 = models.IntegerField(default=0)
+    last_note_date = models.DateField(blank=True, null=True)
+
+    @property
+    def mean_rating(self):
+        return self.rating_total / self.note_count if self.note_count else None
+
+    @property
+    def histogram(self):
+        return [self.rating_1, self.rating_2, self.rating_3, self.rating_4, self.rating_5]
+
+    @classmethod
+    def note_changed(cls, old_note, new_note):
+        """
+        Take `old_note` (the note as it was before saving, or None if it's new) out of its show's
+        totals, and add `new_note` (None if it was deleted). Call in the transaction that wrote the note.
+        """
+        if old_note and new_note and (old_note.show_id, old_note.rating, old_note.posted_date) == \
+                (new_note.show_id, new_note.rating, new_note.posted_date):
+            return  # nothing counted here changed
+
+        changes = [(note, sign) for note, sign in ((old_note, -1), (new_note, 1)) if note is not None]
+        for show_id in {note.show_id for note, sign in changes}:
+            if new_note is not None and new_note.show_id == show_id:
+                cls.objects.get_or_create(show_id=show_id)
+            # Lock the row, so concurrent notes for the same show add up instead of overwriting each other
+            stats = cls.objects.select_for_update().filter(show_id=show_id).first()
+            if stats is None:
+                continue  # the show, and its stats, are being deleted
+
+            recount_last_date = False
+            for note, sign in changes:
+                if note.show_id != show_id:
+                    continue
+                stats.note_count += sign
+                stats.rating_total += sign * (note.rating or 0)
+                if note.rating in (1, 2, 3, 4, 5):
+                    field = f'rating_{note.rating}'
+                    setattr(stats, field, getattr(stats, field) + sign)
+                if sign > 0 and note.posted_date and (stats.last_note_date is None or note.posted_date > stats.last_note_date):
+                    stats.last_note_date = note.posted_date
+                if sign < 0 and note.posted_date and note.posted_date == stats.last_note_date:
+                    recount_last_date = True
+
+            if recount_last_date:
+                stats.last_note_date = Note.objects.filter(show_id=show_id).aggregate(last=Max('posted_date'))['last']
+            stats.save()
+
+    def __str__(self):
+        return f'Stats for show {self.show_id}: {self.note_count} notes, {self.rating_total} stars, last note {self.last_note_date}'
 
-        super().delete(*args, **kwargs)
 
-    def delete_photo(self, photo):
-        if default_storage.exists(photo.name):
-            default_storage.delete(photo.name)
-    
+""" How far the last Ticketmaster sync of one resource got, so the next run can resume or only fetch what changed. """
+class SyncCheckpoint(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    next_page = models.IntegerField(default=0)  # every page before this one has been ingested
+    run_started = models.DateTimeField(blank=True, null=True)
+    last_updated = models.DateTimeField(blank=True, null=True)  # start of the last run that finished
+    completed = models.BooleanField(default=False)
 
     def __str__(self):
-        photo_str = self.photo.url if self.photo else 'no photo'
-        return f'Note for user {self.user} for show ID {self.show} with title {self.title} text {self.text} posted on {self.posted_date} \nPhoto {photo_str}'
\ No newline at end of file
+        state = 'complete' if self.completed else f'at page {self.next_page}'
+        return f'Sync checkpoint {self.name} {state}, last updated {self.last_updated}'
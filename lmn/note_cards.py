@@ -0,0 +1,86 @@
+"""
+Cached note cards.
+
+Every list of notes renders lmn/notes/_note.html once per note. Each rendered
+card is cached under a key made from everything it shows that can change: the
+note's updated_at stamp, its show's artist, venue and date, and its author's
+name, plus the template itself. When any of those change the card gets a new
+key, so nothing has to be deleted, and old cards expire.
+
+render_cards() fetches a whole page of cards with one get_many and renders and
+stores only the misses with one set_many. Hits and misses are counted in the
+cache, so every process adds to the same totals; see the note_card_stats command.
+
+Changes made without Note.save (QuerySet.update, bulk_update) don't touch
+updated_at, so those notes' cards stay stale until NOTE_CARD_CACHE_SECONDS pass.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template, render_to_string
+
+
+TEMPLATE = 'lmn/notes/_note.html'
+HITS_KEY = 'note_cards:hits'
+MISSES_KEY = 'note_cards:misses'
+
+_template_digest = None
+
+
+def template_digest():
+    """ A hash of _note.html, so editing the template replaces every cached card. """
+    global _template_digest
+    if _template_digest is None:
+        source = get_template(TEMPLATE).template.source
+        _template_digest = hashlib.sha1(source.encode()).hexdigest()[:8]
+    return _template_digest
+
+
+def card_key(note, long=False):
+    show = note.show
+    stamp = '|'.join(str(part) for part in (
+        note.updated_at.isoformat() if note.updated_at else '', long,
+        show.show_date.isoformat(), show.artist.name, show.venue.name, note.user.username,
+    ))
+    return f'note_card:{note.pk}:{template_digest()}:{hashlib.sha1(stamp.encode()).hexdigest()}'
+
+
+def _count(key, amount):
+    if not amount:
+        return
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        if not cache.add(key, amount, timeout=None):
+            cache.incr(key, amount)  # another process started the count first
+
+
+def render_cards(notes, long=False):
+    """ The rendered cards of `notes`, in order, from the cache where possible. """
+    notes = list(notes)
+    keys = [card_key(note, long) for note in notes]
+    cards = cache.get_many(keys)
+
+    missed = {}
+    for note, key in zip(notes, keys):
+        if key not in cards:
+            missed[key] = render_to_string(TEMPLATE, {'note': note, 'long': long})
+    if missed:
+        cache.set_many(missed, settings.NOTE_CARD_CACHE_SECONDS)
+
+    _count(HITS_KEY, len(cards))
+    _count(MISSES_KEY, len(missed))
+    cards.update(missed)
+    return [cards[key] for key in keys]
+
+
+def stats():
+    """ {'hits': n, 'misses': n} since the counts were last reset. """
+    counts = cache.get_many([HITS_KEY, MISSES_KEY])
+    return {'hits': counts.get(HITS_KEY, 0), 'misses': counts.get(MISSES_KEY, 0)}
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
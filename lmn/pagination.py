@@ -0,0 +1,236 @@
+"""
+Page-number pagination for the first few pages, keyset (cursor) pagination after that.
+
+Django's Paginator counts every row, then skips (page - 1) * per_page of them,
+so deep pages get slower as tables grow. A cursor page remembers the sort
+values of its last (or first) row and asks for the rows after (or before)
+them instead, WHERE (sort columns) > (those values) ORDER BY ... LIMIT, which
+costs the same on page 1,000 as on page 1 given an index on the sort columns.
+Cursor pages don't know their page number or the total.
+
+Views call paginate(request, queryset). Pages up to PAGINATION_CURSOR_AFTER_PAGE
+are numbered as before, so ?page=N links keep working; links going further
+(and Last) carry an opaque, signed ?cursor= token instead. The queryset's own
+order_by gives the sort columns, with pk added to break ties. Sort columns
+must be fields of the model itself.
+
+Numbered pages show "Page X of N", which needs the number of rows.
+CountingPaginator keeps that from costing a COUNT(*) over the whole table on
+every page view:
+- An unfiltered list of a big table on Postgres uses the planner's estimate
+  (pg_class.reltuples, kept up to date by autovacuum), shown as "about N".
+- Other counts are exact, and cached until the model's table is written to.
+Tables estimated below PAGINATION_EXACT_COUNT_BELOW rows are always counted
+exactly, where an estimate could be noticeably off and counting is cheap.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import F, Q
+from django.utils.functional import cached_property
+
+from .caching import versioned_key
+
+
+CURSOR_SALT = 'lmn.pagination.cursor'
+
+# The cache version bumped whenever a model's table is written to (see signals.py). Tables not listed use their name.
+COUNT_VERSIONS = {'lmn_note': 'notes'}
+
+
+def estimated_count(queryset):
+    """ The planner's estimate of the rows in `queryset`, or None if there isn't a usable one. """
+    query = queryset.query
+    if connections[queryset.db].vendor != 'postgresql' or query.where or query.distinct or query.combinator \
+            or query.low_mark or query.high_mark is not None:
+        return None
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+    # -1 until the table is first analyzed
+    return int(row[0]) if row and row[0] >= 0 else None
+
+
+def cached_count(queryset):
+    """ The exact count, cached until the queryset's table changes. """
+    table = queryset.model._meta.db_table
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0  # a queryset.none(), which can't match anything
+    query_hash = hashlib.sha1(f'{queryset.db} {sql} {params!r}'.encode()).hexdigest()
+    key = versioned_key('count', table, query_hash, depends_on=[COUNT_VERSIONS.get(table, table)])
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, settings.PAGINATION_COUNT_CACHE_SECONDS)
+    return count
+
+
+class CountingPaginator(Paginator):
+    """ A Paginator that estimates or caches its count instead of counting on every request. """
+
+    count_is_estimate = False
+
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, 'query'):
+            return super().count
+        estimate = estimated_count(self.object_list)
+        if estimate is not None and estimate >= settings.PAGINATION_EXACT_COUNT_BELOW:
+            self.count_is_estimate = True
+            return estimate
+        return cached_count(self.object_list)
+
+
+class CursorPage:
+    """ One page of a cursor-paginated list. Iterates like a Page, without page numbers. """
+
+    number = None
+
+    def __init__(self, object_list, has_next, has_previous, next_cursor, previous_cursor, last_cursor):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.last_cursor = last_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+
+def sort_columns(queryset):
+    """ [(field, descending)] from the queryset's order_by, with pk last to make every position unique. """
+    columns = []
+    for term in queryset.query.order_by:
+        name = term.lstrip('-')
+        name = queryset.model._meta.pk.name if name == 'pk' else name
+        columns.append((name, term.startswith('-')))
+    pk_name = queryset.model._meta.pk.name
+    if pk_name not in [name for name, descending in columns]:
+        columns.append((pk_name, columns[-1][1] if columns else False))
+    return columns
+
+
+def sortable_by_cursor(queryset):
+    """ Cursors need every sort column to be a field of the model. Search results sorted by rank get page numbers only. """
+    model_fields = {field.name for field in queryset.model._meta.concrete_fields} | {'pk'}
+    return all(isinstance(term, str) and term.lstrip('-') in model_fields for term in queryset.query.order_by)
+
+
+def make_cursor(columns, row, forward):
+    values = []
+    for name, descending in columns:
+        value = getattr(row, row._meta.get_field(name).attname)
+        values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+    return signing.dumps({'values': values, 'forward': forward}, salt=CURSOR_SALT, compress=True)
+
+
+def last_page_cursor():
+    # No position, walking backwards: the rows before the end of the list
+    return signing.dumps({'values': None, 'forward': False}, salt=CURSOR_SALT)
+
+
+def _past(field, descending, value, forward):
+    """ Rows whose `field` comes strictly after `value` in the direction of travel. NULLs sort last. """
+    if forward:
+        if value is None:
+            return Q(pk__in=[])
+        condition = Q(**{f'{field.name}__{"lt" if descending else "gt"}': value})
+        return condition | Q(**{f'{field.name}__isnull': True}) if field.null else condition
+    if value is None:
+        return Q(**{f'{field.name}__isnull': False})
+    return Q(**{f'{field.name}__{"gt" if descending else "lt"}': value})
+
+
+def _equal(field, value):
+    return Q(**{f'{field.name}__isnull': True}) if value is None else Q(**{field.name: value})
+
+
+def keyset_filter(model, columns, values, forward):
+    """ (a, b, c) > (x, y, z) spelled out: a past x, or a = x and b past y, or a = x and b = y and c past z. """
+    fields = [model._meta.get_field(name) for name, descending in columns]
+    values = [field.to_python(value) for field, value in zip(fields, values)]
+    condition = Q(pk__in=[])
+    equal_so_far = Q()
+    for (name, descending), field, value in zip(columns, fields, values):
+        condition |= equal_so_far & _past(field, descending, value, forward)
+        equal_so_far &= _equal(field, value)
+    return condition
+
+
+def ordering(model, columns, forward=True):
+    """
+    order_by() arguments for `columns`, with NULLs last whichever way the database sorts them, so cursors agree
+    with page numbers. Walking backwards reverses every column, so a LIMIT takes the rows just before the cursor.
+    """
+    terms = []
+    for name, descending in columns:
+        descending = descending if forward else not descending
+        nulls = {}
+        if model._meta.get_field(name).null:
+            nulls = {'nulls_last': True} if forward else {'nulls_first': True}
+        terms.append(F(name).desc(**nulls) if descending else F(name).asc(**nulls))
+    return terms
+
+
+def cursor_page(queryset, token, per_page):
+    """ The page the token points to. Raises signing.BadSignature for tokens we didn't make. """
+    cursor = signing.loads(token, salt=CURSOR_SALT)
+    columns = sort_columns(queryset)
+    forward = cursor['forward']
+
+    if cursor['values'] is not None:
+        queryset = queryset.filter(keyset_filter(queryset.model, columns, cursor['values'], forward))
+    rows = list(queryset.order_by(*ordering(queryset.model, columns, forward))[:per_page + 1])
+
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if not forward:
+        rows.reverse()
+    has_next = more if forward else cursor['values'] is not None
+    has_previous = more if not forward else True
+    return CursorPage(
+        rows, has_next, has_previous,
+        make_cursor(columns, rows[-1], True) if has_next and rows else None,
+        make_cursor(columns, rows[0], False) if has_previous and rows else None,
+        last_page_cursor(),
+    )
+
+
+def paginate(request, queryset, per_page=25):
+    """ The requested page of `queryset`: numbered for ?page=N, or a CursorPage for ?cursor=... """
+    cursor_after = settings.PAGINATION_CURSOR_AFTER_PAGE
+    token = request.GET.get('cursor')
+    if token and cursor_after and sortable_by_cursor(queryset):
+        try:
+            return cursor_page(queryset, token, per_page)
+        except signing.BadSignature:
+            pass  # a mangled link, start from the top
+
+    columns = sort_columns(queryset) if sortable_by_cursor(queryset) else None
+    if columns:
+        queryset = queryset.order_by(*ordering(queryset.model, columns))
+    paginator = CountingPaginator(queryset, per_page)
+    page_object = paginator.get_page(request.GET.get('page'))
+    page_object.next_cursor = page_object.last_cursor = None
+    if cursor_after and columns:
+        # Past the numbered pages, links carry a cursor instead, so no page is reached by a deep OFFSET
+        if page_object.has_next() and page_object.number + 1 > cursor_after:
+            page_object.next_cursor = make_cursor(columns, page_object[len(page_object) - 1], True)
+        if paginator.num_pages > cursor_after:
+            page_object.last_cursor = last_page_cursor()
+    return page_object
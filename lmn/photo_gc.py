@@ -0,0 +1,114 @@
+"""
+Finding photo files no note refers to.
+
+Notes' photos are deleted through PendingPhotoDeletion, but files can still be
+left behind: notes deleted with raw SQL or before the queue existed, and uploads
+whose note was never saved because its transaction rolled back. The
+collect_orphaned_photos command finds and deletes them.
+
+There may be millions of both files and notes, so neither side is held in
+memory. The photo names notes use are read with a server-side cursor into a
+Bloom filter, a few bits per name. Then the storage listing is read a file at
+a time. A file the filter has never seen is certainly not a note's photo. A
+file it may have seen is kept, which is the safe mistake, and happens for
+about one file in FALSE_POSITIVE_RATE. Each chunk of files to delete is also
+checked against the notes again just before deleting it.
+
+A rendition (see photos.py) is judged by the photo it was made from.
+"""
+
+import datetime
+import hashlib
+import math
+import os
+from collections import namedtuple
+
+from .models import Note
+
+
+FALSE_POSITIVE_RATE = 0.001
+
+StoredFile = namedtuple('StoredFile', 'name size modified')
+
+
+class BloomFilter:
+    """ A set of strings that can say a string is certainly not in it, in about 15 bits a string at 0.1% false positives. """
+
+    def __init__(self, capacity, false_positive_rate=FALSE_POSITIVE_RATE):
+        capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, text):
+        # Two hashes combined make as many as needed (Kirsch and Mitzenmacher)
+        digest = hashlib.blake2b(text.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, text):
+        for position in self._positions(text):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, text):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(text))
+
+
+def referenced_photos(chunk_size=2000):
+    """ A BloomFilter of the photo names of every note, read `chunk_size` at a time. """
+    photos = Note.objects.exclude(photo='').exclude(photo__isnull=True)
+    names = BloomFilter(photos.count())
+    for name in photos.values_list('photo', flat=True).iterator(chunk_size=chunk_size):
+        names.add(name)
+    return names
+
+
+def still_referenced(names):
+    """ Which of `names` notes use now, asked of the database rather than the filter. """
+    return set(Note.objects.filter(photo__in=names).values_list('photo', flat=True))
+
+
+def stored_files(storage, prefix):
+    """ StoredFiles under `prefix` in `storage`, listed as they're read rather than all at once. """
+    if hasattr(storage, 'bucket') and hasattr(storage.bucket, 'list_blobs'):
+        # Google Cloud Storage lists a page of blobs per request
+        location = f'{storage.location.strip("/")}/' if getattr(storage, 'location', '') else ''
+        for blob in storage.bucket.list_blobs(prefix=location + prefix):
+            yield StoredFile(blob.name[len(location):], blob.size, blob.updated)
+        return
+
+    try:
+        root = storage.path(prefix)
+    except NotImplementedError:
+        # Some other remote storage, which can only list a directory at once
+        directories, files = storage.listdir(prefix)
+        for name in files:
+            name = f'{prefix}{name}'
+            yield StoredFile(name, storage.size(name), storage.get_modified_time(name))
+        for directory in directories:
+            yield from stored_files(storage, f'{prefix}{directory}/')
+        return
+    yield from _walk(root, prefix)
+
+
+def _walk(directory, prefix):
+    try:
+        entries = os.scandir(directory)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            name = f'{prefix}{entry.name}'
+            if entry.is_dir(follow_symlinks=False):
+                yield from _walk(entry.path, f'{name}/')
+            elif entry.is_file(follow_symlinks=False):
+                stat = entry.stat()
+                yield StoredFile(name, stat.st_size, datetime.datetime.fromtimestamp(stat.st_mtime, datetime.timezone.utc))
+
+
+def format_bytes(count):
+    for unit in ('bytes', 'KB', 'MB', 'GB'):
+        if count < 1024 or unit == 'GB':
+            break
+        count /= 1024
+    return f'{count} bytes' if unit == 'bytes' else f'{count:.1f} {unit}'
@@ -0,0 +1,99 @@
+"""
+Smaller copies of note photos, so pages don't download every original.
+
+When a photo is uploaded, make_renditions() saves it scaled to each of
+PHOTO_RENDITION_WIDTHS that's narrower than the original, as both WebP and
+JPEG, and records them in Note.photo_renditions as {'token': ..., 'widths': [...]}.
+Templates offer them with srcset and let the browser pick: note cards the
+widths up to CARD_WIDTHS, the note's own page every width, linking to the original.
+
+A rendition of user_images/pic.jpg is user_images/renditions/pic.jpg.300w.1f9c04ab.webp.
+The token is new for every set of renditions, so a new photo saved under an old
+one's name never overwrites its renditions, or has them deleted by the old
+photo's queued PendingPhotoDeletion. Renditions made before tokens have none.
+Uploaded names can't contain a slash, so nothing but renditions is ever saved
+under renditions/, and original_name() can tell which photo a file belongs to.
+"""
+
+import io
+import logging
+import os
+import re
+import secrets
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+
+FORMATS = (('webp', 'WEBP', 'image/webp'), ('jpg', 'JPEG', 'image/jpeg'))
+CARD_WIDTHS = 600  # note cards are 300 pixels wide, so this covers screens up to twice as dense
+RENDITION = re.compile(r'^(?P<directory>(?:.*/)?)renditions/(?P<original>[^/]+)\.\d+w\.[0-9a-f]+\.(?:webp|jpg)$')
+
+
+def rendition_name(name, token, width, extension):
+    directory, original = os.path.split(name)
+    return os.path.join(directory, 'renditions', f'{original}.{width}w.{token}.{extension}')
+
+
+def rendition_names(name, renditions):
+    """ Every file in `renditions`, a Note.photo_renditions, of the photo `name`. """
+    return [rendition_name(name, renditions['token'], width, extension)
+            for width in renditions.get('widths', []) for extension, pil_format, mime in FORMATS]
+
+
+def original_name(name):
+    """ The photo `name` is a rendition of, or `name` itself if it isn't one. """
+    match = RENDITION.match(name)
+    return match['directory'] + match['original'] if match else name
+
+
+def sources(name, renditions, max_width=None):
+    """ [(mime type, srcset)] of the `renditions` of `name`, WebP first, up to `max_width`. """
+    token, widths = renditions['token'], renditions['widths']
+    widths = [width for width in widths if max_width is None or width <= max_width] or widths[:1]
+    return [(mime, ', '.join(f'{default_storage.url(rendition_name(name, token, width, extension))} {width}w' for width in widths))
+            for extension, pil_format, mime in FORMATS]
+
+
+def make_renditions(note):
+    """ Save renditions of `note`'s photo and record them on the note. Photos Pillow can't read are left as they are. """
+    name = note.photo.name
+    try:
+        with default_storage.open(name) as photo:
+            image = Image.open(photo)
+            widest = max(settings.PHOTO_RENDITION_WIDTHS)
+            # Decode a JPEG at the smallest scale (1/2, 1/4 or 1/8) still at least this big, which is much
+            # faster than decoding it whole and scaling it down. A square box, as EXIF may turn it sideways.
+            image.draft('RGB', (widest, widest))
+            image = ImageOps.exif_transpose(image).convert('RGB')
+    except Exception:
+        logging.exception(f'Couldn\'t read photo {name} to make renditions')
+        return
+
+    # No exists() or delete() first: the token makes every name new
+    token = secrets.token_hex(4)
+    widths = []
+    saved = []
+    try:
+        for width in sorted(settings.PHOTO_RENDITION_WIDTHS, reverse=True):
+            if width >= image.width:
+                continue  # never scale up
+            height = round(image.height * width / image.width)
+            # Scale each from the one before, the biggest first, rather than every one from the original
+            image = image.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+            for extension, pil_format, mime in FORMATS:
+                output = io.BytesIO()
+                image.save(output, pil_format, quality=settings.PHOTO_RENDITION_QUALITY)
+                saved.append(default_storage.save(rendition_name(name, token, width, extension), ContentFile(output.getvalue())))
+            widths.append(width)
+    except Exception:
+        # The note is already saved, so carry on with the original photo, and queue what was saved for deletion
+        logging.exception(f'Couldn\'t save renditions of photo {name}')
+        from .models import PendingPhotoDeletion
+        PendingPhotoDeletion.objects.bulk_create([PendingPhotoDeletion(name=rendition) for rendition in saved])
+        return
+
+    note.photo_renditions = {'token': token, 'widths': sorted(widths)} if widths else {}
+    note.save()
@@ -0,0 +1,26 @@
+"""
+Keeps calls to an outside service under a rate, across threads.
+
+The Ticketmaster crawler spaces its requests with it, and
+collect_orphaned_photos its storage deletes.
+"""
+
+import threading
+import time
+
+
+class RateLimiter:
+    """ Spaces calls evenly so no more than `per_second` start in any second. Thread safe. """
+
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second if per_second else 0
+        self._next_slot = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
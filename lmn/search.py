@@ -0,0 +1,199 @@
+"""
+Full-text search for artists, venues and notes.
+
+On Postgres each searchable table has a tsvector column, filled in by a
+trigger on insert and update and indexed with GIN. On SQLite each has an FTS5
+index, an external content table reading the real table, kept in step by
+triggers. Either way the database maintains the index itself, so rows are
+searchable however they were saved: forms, bulk ingestion or fixtures. Any
+other database falls back to icontains.
+
+Migration 0012 sets this up. install() runs the same statements again after
+every migrate, because SQLite drops a table's triggers when Django rebuilds
+the table to alter it.
+
+A search matches rows containing every word of the query, each as a prefix
+("first ave" finds "First Avenue"), best match first. A one-letter word is
+too short to be a useful prefix, so a query with one falls back to icontains,
+which matches it anywhere in the text as searches always have.
+
+similar() is for misspelled artist and venue names, which full-text search
+can't match. It finds names sharing enough trigrams (three letter runs) with
+the query, most similar first: with pg_trgm and a trigram GIN index on
+Postgres, with an in-memory trigram index (lmn/trigrams.py) anywhere else.
+"""
+
+import re
+import threading
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import BooleanField, Case, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+from .caching import get_version
+from .trigrams import TrigramIndex
+
+
+# Table -> searched columns with their weight (A counts most), and the Postgres text search configuration.
+# Names use 'simple', so words like "the" in "The The" aren't dropped as stop words.
+SEARCHABLE = {
+    'lmn_artist': {'columns': [('name', 'A')], 'config': 'simple'},
+    'lmn_venue': {'columns': [('name', 'A'), ('city', 'B')], 'config': 'simple'},
+    'lmn_note': {'columns': [('title', 'A'), ('text', 'B')], 'config': 'english'},
+}
+
+SQLITE_WEIGHTS = {'A': 10.0, 'B': 1.0}
+
+# Table -> the name column similar() compares
+TRIGRAM_COLUMNS = {
+    'lmn_artist': 'name',
+    'lmn_venue': 'name',
+}
+
+# Without an index in the database, similar() orders its matches in the query itself, so only this many are kept
+IN_MEMORY_MATCH_LIMIT = 200
+
+# pg_trgm.similarity_threshold's default, which the % operator matches at
+PG_TRGM_THRESHOLD = 0.3
+
+
+def _postgres_setup(table, columns, config):
+    vector = ' || '.join(f"setweight(to_tsvector('{config}', coalesce(NEW.{column}, '')), '{weight}')" for column, weight in columns)
+    column_names = ', '.join(column for column, weight in columns)
+    return [
+        f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector',
+        f'''CREATE OR REPLACE FUNCTION {table}_search_update() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector := {vector};
+                RETURN NEW;
+            END $$ LANGUAGE plpgsql''',
+        f'DROP TRIGGER IF EXISTS {table}_search_update ON {table}',
+        f'''CREATE TRIGGER {table}_search_update BEFORE INSERT OR UPDATE OF {column_names} ON {table}
+            FOR EACH ROW EXECUTE PROCEDURE {table}_search_update()''',
+        # Fill in rows saved before the trigger existed; updating a searched column fires it
+        f'UPDATE {table} SET {columns[0][0]} = {columns[0][0]} WHERE search_vector IS NULL',
+        f'CREATE INDEX IF NOT EXISTS {table}_search_idx ON {table} USING GIN (search_vector)',
+    ]
+
+
+def _sqlite_triggers(table, columns):
+    names = ', '.join(column for column, weight in columns)
+    new_values = ', '.join(f'new.{column}' for column, weight in columns)
+    old_values = ', '.join(f'old.{column}' for column, weight in columns)
+    add = f'INSERT INTO {table}_fts(rowid, {names}) VALUES (new.id, {new_values});'
+    remove = f"INSERT INTO {table}_fts({table}_fts, rowid, {names}) VALUES ('delete', old.id, {old_values});"
+    return {
+        f'{table}_fts_insert': f'CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN {add} END',
+        f'{table}_fts_delete': f'CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN {remove} END',
+        f'{table}_fts_update': f'CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF {names} ON {table} BEGIN {remove} {add} END',
+    }
+
+
+def install(connection):
+    """ Create (or repair) the search indexes and the triggers that maintain them. Safe to run again. """
+    existing_tables = set(connection.introspection.table_names())
+    with connection.cursor() as cursor:
+        for table, spec in SEARCHABLE.items():
+            if table not in existing_tables:
+                continue
+            if connection.vendor == 'postgresql':
+                for statement in _postgres_setup(table, spec['columns'], spec['config']):
+                    cursor.execute(statement)
+            elif connection.vendor == 'sqlite':
+                names = ', '.join(column for column, weight in spec['columns'])
+                cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5({names}, content='{table}', content_rowid='id')")
+                triggers = _sqlite_triggers(table, spec['columns'])
+                cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [table])
+                missing = set(triggers) - {row[0] for row in cursor.fetchall()}
+                for name in missing:
+                    cursor.execute(triggers[name])
+                if missing:
+                    # Rows may have changed while the triggers were gone
+                    cursor.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')")
+
+
+def words(text):
+    return re.findall(r'\w+', (text or '').lower())
+
+
+def search(queryset, text):
+    """
+    The rows of `queryset` matching every word of `text`, annotated with `rank` and ordered
+    best first. Nothing matches a query without any words.
+    """
+    terms = words(text)
+    if not terms:
+        return queryset.none()
+
+    table = queryset.model._meta.db_table
+    spec = SEARCHABLE[table]
+    vendor = connections[queryset.db].vendor
+
+    if vendor == 'postgresql' and all(len(term) > 1 for term in terms):
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        params = [spec['config'], tsquery]
+        return queryset.annotate(
+            search_match=RawSQL(f'{table}.search_vector @@ to_tsquery(%s, %s)', params, output_field=BooleanField()),
+            rank=RawSQL(f'ts_rank({table}.search_vector, to_tsquery(%s, %s))', params, output_field=FloatField()),
+        ).filter(search_match=True).order_by('-rank', 'pk')
+
+    if vendor == 'sqlite' and all(len(term) > 1 for term in terms):
+        match = ' '.join(f'"{term}"*' for term in terms)
+        weights = ', '.join(str(SQLITE_WEIGHTS[weight]) for column, weight in spec['columns'])
+        # bm25 is lower for better matches, so negate it to sort the same way as ts_rank
+        rank = RawSQL(f'SELECT -bm25({table}_fts, {weights}) FROM {table}_fts WHERE {table}_fts MATCH %s AND rowid = {table}.id',
+                      [match], output_field=FloatField())
+        return queryset.filter(pk__in=RawSQL(f'SELECT rowid FROM {table}_fts WHERE {table}_fts MATCH %s', [match])
+                               ).annotate(rank=rank).order_by('-rank', 'pk')
+
+    condition = Q()
+    for term in terms:
+        any_column = Q()
+        for column, weight in spec['columns']:
+            any_column |= Q(**{f'{column}__icontains': term})
+        condition &= any_column
+    return queryset.filter(condition).annotate(rank=Value(0.0, output_field=FloatField())).order_by(spec['columns'][0][0], 'pk')
+
+
+# (database alias, table) -> (version, TrigramIndex). Rebuilt when the table's version is bumped, see lmn/signals.py.
+_trigram_indexes = {}
+_trigram_lock = threading.Lock()
+
+
+def trigram_index(queryset):
+    """ The in-memory index of every name in the queryset's table, built on first use. """
+    table = queryset.model._meta.db_table
+    key = (queryset.db, table)
+    version = get_version(table)
+    with _trigram_lock:
+        cached = _trigram_indexes.get(key)
+        if cached is None or cached[0] != version:
+            rows = queryset.model._default_manager.using(queryset.db).values_list('pk', TRIGRAM_COLUMNS[table])
+            cached = _trigram_indexes[key] = (version, TrigramIndex(rows.iterator()))
+        return cached[1]
+
+
+def similar(queryset, text, threshold=None):
+    """
+    The rows of `queryset` whose name is at least `threshold` similar to `text` (NAME_SIMILARITY_THRESHOLD
+    by default), annotated with `similarity` and ordered most similar first.
+    """
+    threshold = settings.NAME_SIMILARITY_THRESHOLD if threshold is None else threshold
+    table = queryset.model._meta.db_table
+    column = TRIGRAM_COLUMNS[table]
+
+    if connections[queryset.db].vendor == 'postgresql':
+        queryset = queryset.annotate(similarity=RawSQL(f'similarity({table}.{column}, %s)', [text], output_field=FloatField()))
+        if threshold >= PG_TRGM_THRESHOLD:
+            # % is pg_trgm's similarity operator, the one the GIN index answers. It matches at the default
+            # pg_trgm.similarity_threshold, so it can narrow down the rows to check for a threshold at least that high.
+            queryset = queryset.annotate(trigram_match=RawSQL(f'{table}.{column} %% %s', [text], output_field=BooleanField())
+                                         ).filter(trigram_match=True)
+        return queryset.filter(similarity__gte=threshold).order_by('-similarity', 'pk')
+
+    matches = trigram_index(queryset).search(text, threshold, limit=IN_MEMORY_MATCH_LIMIT)
+    if not matches:
+        return queryset.none()
+    scores = Case(*[When(pk=pk, then=Value(score)) for score, pk in matches], output_field=FloatField())
+    return queryset.filter(pk__in=[pk for score, pk in matches]).annotate(similarity=scores).order_by('-similarity', 'pk')
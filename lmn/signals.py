@@ -0,0 +1,89 @@
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.models.signals import post_save, post_delete, post_migrate
+from django.dispatch import receiver
+
+from . import search
+from .caching import bump_now_and_on_commit
+from .models import Artist, Note, Profile, Show, ShowStats, Venue
+
+
+# Cached pages and data (see caching.py) name the versions they depend on. Each write bumps only the
+# versions of the pages that show what it changed: a new note makes its show's page, its author's page and
+# the latest notes stale, but not every other show's.
+
+@receiver(post_save, sender=Note)
+@receiver(post_delete, sender=Note)
+def notes_changed(sender, instance, **kwargs):
+    bump_now_and_on_commit(['notes', f'show:{instance.show_id}', f'user:{instance.user_id}'])
+
+
+def authors(show_pks):
+    """ Versions of the profile pages of everyone with notes on these shows, whose note cards name the shows. """
+    users = Note.objects.filter(show_id__in=show_pks).values_list('user_id', flat=True).distinct()
+    return {f'user:{user_pk}' for user_pk in users}
+
+
+@receiver(post_save, sender=Show)
+@receiver(post_delete, sender=Show)
+def show_changed(sender, instance, created=False, **kwargs):
+    names = [f'show:{instance.pk}', f'venue:{instance.venue_id}', 'lmn_show']
+    if not created:
+        names.append('notes')  # note cards show the show's artist, venue and date
+        names.extend(authors([instance.pk]))
+    bump_now_and_on_commit(names)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Profile)
+def profile_changed(sender, instance, created=False, update_fields=None, **kwargs):
+    user_pk = instance.pk if sender is User else instance.user_id
+    names = {f'user:{user_pk}'}
+    if sender is User and not created and (update_fields is None or 'username' in update_fields):
+        # Note cards name their author, on every list of notes (logging in only saves last_login)
+        shows = Note.objects.filter(user_id=user_pk).values_list('show_id', flat=True).distinct()
+        names.update(['notes', *(f'show:{show_pk}' for show_pk in shows)])
+    bump_now_and_on_commit(names)
+
+
+@receiver(post_save, sender=Artist)
+@receiver(post_save, sender=Venue)
+def renamed(sender, instance, created, raw=False, **kwargs):
+    # A new artist or venue isn't on any page yet. An edited one is on its shows' pages and on note cards.
+    if created or raw:
+        return
+    shows = list(Show.objects.filter(**{sender.__name__.lower(): instance}).values_list('pk', 'venue_id'))
+    names = {'notes', *(f'show:{pk}' for pk, venue_pk in shows), *(f'venue:{venue_pk}' for pk, venue_pk in shows)}
+    names.update(authors([pk for pk, venue_pk in shows]))
+    if sender is Venue:
+        names.add(f'venue:{instance.pk}')
+    bump_now_and_on_commit(names)
+
+
+@receiver(post_save, sender=Artist)
+@receiver(post_delete, sender=Artist)
+@receiver(post_save, sender=Venue)
+@receiver(post_delete, sender=Venue)
+def names_changed(sender, **kwargs):
+    # The venue list, and in-memory trigram indexes of the names (search.trigram_index), which are rebuilt on next use
+    bump_now_and_on_commit([sender._meta.db_table])
+
+
+@receiver(post_delete, sender=Note)
+def remove_from_show_stats(sender, instance, **kwargs):
+    # A receiver rather than Note.delete, so notes deleted along with their user are taken out too
+    ShowStats.note_changed(instance, None)
+
+
+@receiver(post_delete, sender=Note)
+def delete_photo(sender, instance, **kwargs):
+    # Here too, so photos of notes deleted along with their user are queued for deletion
+    if instance.photo:
+        instance.delete_photo()
+
+
+@receiver(post_migrate)
+def repair_search(sender, using, **kwargs):
+    # SQLite drops a table's triggers when a migration rebuilds the table, leaving its search index stale
+    if sender.name == 'lmn':
+        search.install(connections[using])
@@ -0,0 +1,13 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from lmn.note_cards import render_cards
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def note_cards(notes, long=False):
+    """ {% note_cards notes %} renders every note's card, reusing cached ones. """
+    return mark_safe(''.join(render_cards(notes, long)))
@@ -0,0 +1,15 @@
+""" A TestCase that starts every test with an empty cache. """
+
+from django.core.cache import cache
+from django.test import TestCase
+
+
+class CacheTestCase(TestCase):
+    """
+    For tests of cached pages and data. Cache entries aren't rolled back with a test's database changes,
+    and versions restart from the same numbers, so an entry cached by an earlier test could be served again.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
@@ -1,28 +1,444 @@
-from django.test import TestCase
-from unittest.mock import patch
+from django.test import TestCase, override_settings
+from unittest.mock import patch, Mock
 from django.urls import reverse
 from django.http import HttpResponseServerError
 from lmn.api_views import unavailable_message
+from django.core.management import call_command
+from lmn.models import Show, SyncCheckpoint
+from lmn.ticketmaster.cache import ResponseCache, normalize_url
+from lmn.ticketmaster.client import HttpClient
+from lmn.ratelimit import RateLimiter
+from lmn.ticketmaster.crawler import Crawler
+from lmn.ticketmaster import recording
+from lmn.ticketmaster.markets import crawl_market, event_query, venue_query
+from lmn.ticketmaster.stream import StreamingPage
+from lmn.ticketmaster.sync import sync_markets
+from lmn.ticketmaster.fakes import StubTicketmaster, make_pages
+from lmn.tests.test_ingest import make_event
+from io import StringIO
+import datetime
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
 
+@override_settings(TICKETMASTER_CACHE_DIR=None)
 class ApiTests(TestCase):
     #all other exceptions show the unavailable_message and respond with 500
-    @patch('requests.get', side_effect=[Exception])
+    @patch('requests.Session.get', side_effect=[Exception])
     def test_artist_server_error_500(self, requests_mock):
         url = reverse('admin_get_artist')
         response = self.client.get(url)
         self.assertContains(response, unavailable_message, status_code=500)
         self.assertEqual(response.status_code, 500)
 
-    @patch('requests.get', side_effect=[Exception])
+    @patch('requests.Session.get', side_effect=[Exception])
     def test_venue_server_error_500(self, requests_mock):
         url = reverse('admin_get_venue')
         response = self.client.get(url)
         self.assertContains(response, unavailable_message, status_code=500)
         self.assertEqual(response.status_code, 500)
 
-    @patch('requests.get', side_effect=[Exception])
+    @patch('requests.Session.get', side_effect=[Exception])
     def test_show_server_error_500(self, requests_mock):
         url = reverse('admin_get_show')
         response = self.client.get(url)
         self.assertContains(response, unavailable_message, status_code=500)
         self.assertEqual(response.status_code, 500)
+
+
+class CrawlerTests(TestCase):
+
+    def crawler(self, stub, page_size=2, stream=True):
+        return Crawler(base_url=stub.base_url, api_key='test', page_size=page_size, max_workers=2, per_second=1000, cache=False, stream=stream)
+
+    def test_crawler_reads_every_page(self):
+        events = [make_event(f'Band {n}', 'First Avenue') for n in range(7)]
+        with StubTicketmaster(make_pages('events', events, 2)) as stub:
+            pages = [list(items) for items in self.crawler(stub).items('events', {'dmaId': '336'})]
+
+        self.assertEqual(4, len(pages))
+        names = sorted(event['_embedded']['attractions'][0]['name'] for page in pages for event in page)
+        self.assertEqual(sorted(f'Band {n}' for n in range(7)), names)
+        # every request carries the query and the key
+        self.assertTrue(all(query['dmaId'] == '336' and query['apikey'] == 'test' for path, query in stub.requests))
+
+    def test_crawler_reads_every_page_without_streaming(self):
+        events = [make_event(f'Band {n}', 'First Avenue') for n in range(5)]
+        with StubTicketmaster(make_pages('events', events, 2)) as stub:
+            pages = [list(items) for items in self.crawler(stub, stream=False).items('events', {})]
+        self.assertEqual(events, sorted((event for page in pages for event in page), key=events.index))
+
+    def test_crawler_stops_at_deep_paging_limit(self):
+        venues = [{'name': f'Venue {n}'} for n in range(30)]
+        with StubTicketmaster(make_pages('venues', venues, 10)) as stub:
+            with patch('lmn.ticketmaster.crawler.DEEP_PAGING_LIMIT', 20), self.assertLogs(level='WARNING'):
+                pages = [list(items) for items in self.crawler(stub, page_size=10).items('venues', {})]
+        self.assertEqual(2, len(pages))
+
+    def test_crawler_splits_big_event_searches_into_date_windows(self):
+        start = datetime.datetime(2021, 3, 1, tzinfo=datetime.timezone.utc)
+        events = [make_event(f'Band {n}', 'First Avenue', (start + datetime.timedelta(hours=n)).strftime('%Y-%m-%dT%H:%M:%SZ'))
+                  for n in range(2500)]
+        with StubTicketmaster({}, searches={'events': events}) as stub:
+            crawler = self.crawler(stub, page_size=200)
+            # the first page is read before the search is split, and its events come again in the first window
+            pages = [list(items) for items in crawler.items('events', {'startDateTime': '2021-03-01T00:00:00Z'})][1:]
+        names = [event['_embedded']['attractions'][0]['name'] for page in pages for event in page]
+        # every event once, none twice from windows that meet
+        self.assertEqual(2500, len(names))
+        self.assertEqual(2500, len(set(names)))
+        self.assertEqual([], crawler.truncated)
+
+    def test_crawler_reports_searches_it_cannot_split(self):
+        venues = [{'name': f'Venue {n}', 'dates': {'start': {'dateTime': ''}}} for n in range(1100)]
+        with StubTicketmaster({}, searches={'venues': venues}) as stub:
+            crawler = self.crawler(stub, page_size=200)
+            with self.assertLogs(level='WARNING'):
+                pages = [list(items) for items in crawler.items('venues', {'stateCode': 'MN'})]
+        self.assertEqual(1000, sum(len(page) for page in pages))
+        self.assertEqual([('venues stateCode=MN', 1100)], crawler.truncated)
+
+    def test_crawler_follows_next_links_without_page_metadata(self):
+        pages = make_pages('events', [make_event('REM', 'First Avenue'), make_event('Yes', 'First Avenue')], 1)
+        for (resource, number), page in pages.items():
+            del page['page']
+            if number == 0:
+                page['_links'] = {'next': {'href': '/discovery/v2/events.json?page=1'}}
+        with StubTicketmaster(pages) as stub:
+            crawled = [list(items) for items in self.crawler(stub, page_size=1).items('events', {})]
+        self.assertEqual(2, len(crawled))
+
+    def test_rate_limiter_spaces_calls(self):
+        limiter = RateLimiter(per_second=50)
+        start = time.monotonic()
+        for call in range(6):
+            limiter.wait()
+        self.assertGreaterEqual(time.monotonic() - start, 5 / 50)
+
+
+class StreamingPageTests(TestCase):
+
+    def page_bytes(self):
+        data = make_pages('events', [make_event(f'Bänd {n}', 'First Avenue') for n in range(20)], 20)[('events', 0)]
+        data['_links'] = {'self': {'href': '/discovery/v2/events.json?page=0'}}
+        return data, json.dumps(data, ensure_ascii=False, indent=1).encode()
+
+    def test_items_and_meta_match_whole_page_parse_at_any_chunk_size(self):
+        data, body = self.page_bytes()
+        for size in (1, 7, 1000, len(body)):
+            page = StreamingPage((body[n:n + size] for n in range(0, len(body), size)), 'events')
+            self.assertEqual(data['_embedded']['events'], list(page.items))
+            self.assertEqual(data['page'], page.meta['page'])
+            self.assertEqual(data['_links'], page.meta['_links'])
+
+    def test_items_are_yielded_before_the_stream_is_read(self):
+        data, body = self.page_bytes()
+        chunks_read = []
+
+        def chunks():
+            for n in range(0, len(body), 100):
+                chunks_read.append(n)
+                yield body[n:n + 100]
+
+        page = StreamingPage(chunks(), 'events')
+        next(page.items)
+        self.assertLess(len(chunks_read) * 100, len(body) / 2)
+
+    def test_meta_reads_past_unread_items(self):
+        data, body = self.page_bytes()
+        self.assertEqual(data['page'], StreamingPage([body], 'events').meta['page'])
+
+    def test_truncated_page_raises(self):
+        data, body = self.page_bytes()
+        with self.assertRaises(ValueError):
+            list(StreamingPage([body[:len(body) // 2]], 'events').items)
+
+
+class HttpClientTests(TestCase):
+
+    def stub(self):
+        return StubTicketmaster(make_pages('events', [make_event('REM', 'First Avenue')], 2))
+
+    def test_retries_server_errors_honoring_retry_after(self):
+        client = HttpClient(max_retries=3, backoff=0)
+        with self.stub() as stub:
+            stub.failures = [(503, {}), (429, {'Retry-After': '0'})]
+            response = client.get(stub.base_url + 'events.json')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(3, len(stub.requests))
+        self.assertEqual(2, client.metrics.retries)
+        self.assertEqual(3, client.metrics.calls)
+        self.assertGreater(client.metrics.bytes, 0)
+
+    def test_gives_up_after_max_retries(self):
+        client = HttpClient(max_retries=1, backoff=0)
+        with self.stub() as stub:
+            stub.failures = [(500, {}), (500, {}), (500, {})]
+            response = client.get(stub.base_url + 'events.json')
+        self.assertEqual(500, response.status_code)
+        self.assertEqual(2, len(stub.requests))
+        self.assertEqual(1, client.metrics.failures)
+
+    def test_client_errors_not_retried(self):
+        client = HttpClient(max_retries=3, backoff=0)
+        with self.stub() as stub:
+            response = client.get(stub.base_url + 'nothing.json')
+        self.assertEqual(404, response.status_code)
+        self.assertEqual(1, len(stub.requests))
+
+    def test_chunked_body_counted_once_read(self):
+        client = HttpClient(max_retries=0)
+        with self.stub() as stub, tempfile.TemporaryFile() as body:
+            stub.chunked = True
+            client.get(stub.base_url + 'events.json', body=body)
+            data = body.read()
+        self.assertEqual(len(data), client.metrics.bytes)
+        self.assertEqual(1, len(json.loads(data)['_embedded']['events']))
+
+    def test_body_cut_off_is_fetched_again(self):
+        client = HttpClient(max_retries=2, backoff=0)
+        with self.stub() as stub, tempfile.TemporaryFile() as body:
+            stub.cut_off = 1
+            with self.assertLogs(level='WARNING'):
+                response = client.get(stub.base_url + 'events.json', body=body)
+            data = json.load(body)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, len(stub.requests))
+        self.assertEqual(1, client.metrics.retries)
+        self.assertEqual(1, len(data['_embedded']['events']))
+
+    def test_retry_after_overrides_backoff(self):
+        client = HttpClient(backoff=100, max_backoff=60)
+        response = Mock(headers={'Retry-After': '7'})
+        self.assertEqual(7, client.backoff_seconds(0, response))
+        # without Retry-After, full jitter up to the capped exponential delay
+        self.assertLessEqual(client.backoff_seconds(5), 60)
+
+
+class ResponseCacheTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def crawler(self, stub, cache):
+        return Crawler(base_url=stub.base_url, api_key='test', page_size=2, max_workers=2, per_second=1000, cache=cache)
+
+    def test_key_ignores_api_key_and_parameter_order(self):
+        self.assertEqual(normalize_url('http://tm/events.json?a=1&b=2&apikey=one'), normalize_url('http://tm/events.json?b=2&apikey=two&a=1'))
+
+    def test_fresh_entry_served_without_request(self):
+        cache = ResponseCache(self.directory, ttl=60, max_bytes=10 ** 6)
+        with StubTicketmaster(make_pages('events', [make_event('REM', 'First Avenue')], 2)) as stub:
+            first = [list(items) for items in self.crawler(stub, cache).items('events', {})]
+            second = [list(items) for items in self.crawler(stub, cache).items('events', {})]
+        self.assertEqual(first, second)
+        self.assertEqual(1, len(stub.requests))
+
+    def test_stale_entry_revalidated_with_etag(self):
+        cache = ResponseCache(self.directory, ttl=0, max_bytes=10 ** 6)
+        with StubTicketmaster(make_pages('events', [make_event('REM', 'First Avenue')], 2)) as stub:
+            first = [list(items) for items in self.crawler(stub, cache).items('events', {})]
+            second = [list(items) for items in self.crawler(stub, cache).items('events', {})]
+        self.assertEqual(first, second)
+        self.assertEqual(2, len(stub.requests))
+        self.assertEqual(1, stub.not_modified)
+
+    def test_least_recently_used_entries_evicted_over_budget(self):
+        cache = ResponseCache(self.directory, ttl=60, max_bytes=250)
+        cache.store('http://tm/events.json?page=0', b'a' * 100, {})
+        cache.store('http://tm/events.json?page=1', b'b' * 100, {})
+        os.utime(cache._paths('http://tm/events.json?page=0')[0], (0, 0))  # make page 0 the least recently used
+        cache.store('http://tm/events.json?page=2', b'c' * 100, {})
+
+        self.assertIsNone(cache.get('http://tm/events.json?page=0'))
+        self.assertEqual(b'b' * 100, cache.get('http://tm/events.json?page=1').body)
+        self.assertEqual(b'c' * 100, cache.get('http://tm/events.json?page=2').body)
+
+
+@override_settings(TICKETMASTER_CACHE_DIR=None)
+class SyncViewTests(TestCase):
+
+    fixtures = ['testing_artists', 'testing_venues']
+
+    def test_show_sync_ingests_every_page(self):
+        events = [make_event('REM', 'First Avenue', f'2021-03-0{day}T02:00:00Z') for day in range(1, 6)]
+        with StubTicketmaster(make_pages('events', events, 2)) as stub:
+            with self.settings(TICKETMASTER_BASE_URL=stub.base_url, TICKETMASTER_PAGE_SIZE=2, TICKETMASTER_REQUESTS_PER_SECOND=1000):
+                response = self.client.get(reverse('admin_get_show'))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(5, Show.objects.count())
+
+
+@override_settings(TICKETMASTER_CACHE_DIR=None)
+class SyncCommandTests(TestCase):
+
+    fixtures = ['testing_venues']
+
+    def sync(self, stub, *args):
+        out = StringIO()
+        with self.settings(TICKETMASTER_BASE_URL=stub.base_url, TICKETMASTER_PAGE_SIZE=2, TICKETMASTER_REQUESTS_PER_SECOND=1000):
+            call_command('sync_ticketmaster', *args, stdout=out)
+        return out.getvalue()
+
+    def test_sync_reports_inserted_and_unchanged_rows(self):
+        events = [make_event(f'Band {n}', 'First Avenue', f'2021-03-0{n + 1}T02:00:00Z') for n in range(3)]
+        pages = make_pages('events', events, 2)
+        pages.update(make_pages('venues', [{'name': 'First Avenue', 'city': {'name': 'Minneapolis'}, 'state': {'stateCode': 'MN'}}], 2))
+        with StubTicketmaster(pages) as stub:
+            output = self.sync(stub)
+
+        self.assertIn('artists: 3 inserted, 0 updated, 0 unchanged, 0 skipped', output)
+        self.assertIn('shows: 3 inserted, 0 updated, 0 unchanged, 0 skipped', output)
+        self.assertIn('venues: 0 inserted, 1 updated, 0 unchanged, 0 skipped', output)
+        self.assertIn('total:', output)
+        self.assertTrue(SyncCheckpoint.objects.get(name='events:minneapolis').completed)
+
+        with StubTicketmaster(pages) as stub:
+            output = self.sync(stub, '--full')
+        self.assertIn('shows: 0 inserted, 0 updated, 3 unchanged, 0 skipped', output)
+        self.assertIn('venues: 0 inserted, 0 updated, 1 unchanged, 0 skipped', output)
+
+    def test_truncated_searches_are_reported(self):
+        venues = [{'name': f'Venue {n}', 'city': {'name': 'Minneapolis'}, 'state': {'stateCode': 'MN'}} for n in range(5)]
+        with StubTicketmaster(make_pages('venues', venues, 2)) as stub:
+            with patch('lmn.ticketmaster.crawler.DEEP_PAGING_LIMIT', 4), self.assertLogs(level='WARNING'):
+                output = self.sync(stub, '--only', 'venues')
+        self.assertIn('venues classificationName=music stateCode=MN truncated: 5 results', output)
+
+    def test_interrupted_sync_resumes_from_checkpoint(self):
+        events = [make_event(f'Band {n}', 'First Avenue', f'2021-03-0{n + 1}T02:00:00Z') for n in range(5)]
+        pages = make_pages('events', events, 2)
+        missing_page = pages.pop(('events', 1))
+
+        with StubTicketmaster(pages) as stub:
+            with self.assertLogs(level='ERROR'):
+                output = self.sync(stub, '--only', 'events')
+            self.assertIn('minneapolis failed: 404 Client Error', output)
+            checkpoint = SyncCheckpoint.objects.get(name='events:minneapolis')
+            self.assertFalse(checkpoint.completed)
+            self.assertEqual(1, checkpoint.next_page)
+
+            stub.requests.clear()
+            stub.pages[('events', 1)] = missing_page
+            self.sync(stub, '--only', 'events')
+
+        # picked up at the first page that had not been ingested
+        self.assertEqual('1', stub.requests[0][1]['page'])
+        self.assertEqual(5, Show.objects.count())
+        self.assertTrue(SyncCheckpoint.objects.get(name='events:minneapolis').completed)
+
+    def test_reruns_revalidate_cached_pages(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        pages = make_pages('events', [make_event(f'Band {n}', 'First Avenue', f'2021-03-0{n + 1}T02:00:00Z') for n in range(3)], 2)
+        with StubTicketmaster(pages) as stub, self.settings(TICKETMASTER_CACHE_DIR=directory, TICKETMASTER_CACHE_TTL=0):
+            self.sync(stub, '--only', 'events')
+            first_run = list(stub.requests)
+            for rerun in range(2):
+                self.sync(stub, '--only', 'events')
+        # the same query every time, so every page of a rerun is a 304
+        self.assertEqual(first_run * 3, stub.requests)
+        self.assertEqual(4, stub.not_modified)
+
+
+@override_settings(TICKETMASTER_CACHE_DIR=None)
+class MarketSyncTests(TestCase):
+
+    markets = [
+        {'name': 'minneapolis', 'dmaId': '336', 'stateCode': 'MN'},
+        {'name': 'milwaukee', 'dmaId': '617', 'stateCode': 'WI'},
+    ]
+
+    def pages(self):
+        pages = make_pages('events', [make_event(f'Band {n}', 'First Avenue', f'2021-03-0{n + 1}T02:00:00Z') for n in range(3)], 2)
+        pages.update(make_pages('venues', [{'name': 'First Avenue', 'city': {'name': 'Minneapolis'}, 'state': {'stateCode': 'MN'}}], 2))
+        return pages
+
+    def test_event_query_for_market(self):
+        self.assertEqual({'classificationName': 'music', 'dmaId': '336'}, event_query(self.markets[0]))
+        self.assertEqual({'classificationName': 'music', 'stateCode': 'WI'}, venue_query(self.markets[1]))
+
+    def test_crawl_market_returns_normalized_records(self):
+        with StubTicketmaster(self.pages()) as stub:
+            options = {'base_url': stub.base_url, 'page_size': 2, 'per_second': 1000, 'cache': False}
+            shard = crawl_market(self.markets[0], options)
+
+        self.assertEqual('minneapolis', shard.market)
+        self.assertEqual(['First Avenue'], [record[0] for record in shard.venues])
+        self.assertEqual(3, len(shard.artists))
+        self.assertEqual(3, len(shard.shows))
+        self.assertEqual(3, shard.requests)
+        # the whole shard has to survive the trip back from a worker process
+        self.assertEqual(shard, pickle.loads(pickle.dumps(shard)))
+
+    def test_failed_market_does_not_stop_the_others(self):
+        with StubTicketmaster(self.pages()) as stub:
+            stub.rejected = {'dmaId': '617'}
+            with self.settings(TICKETMASTER_BASE_URL=stub.base_url, TICKETMASTER_PAGE_SIZE=2, TICKETMASTER_REQUESTS_PER_SECOND=1000):
+                report = sync_markets(self.markets, processes=2)
+
+        self.assertEqual(['milwaukee'], list(report.failures))
+        self.assertEqual(3, Show.objects.count())
+        self.assertEqual(3, report.counts['shows']['inserted'])
+        self.assertIn('minneapolis crawl', report.timings)
+        self.assertIn('minneapolis write', report.timings)
+        self.assertTrue(SyncCheckpoint.objects.get(name='events:minneapolis').completed)
+        self.assertFalse(SyncCheckpoint.objects.get(name='events:milwaukee').completed)
+
+    def test_failed_market_does_not_stop_the_others_one_process(self):
+        out = StringIO()
+        with StubTicketmaster(self.pages()) as stub:
+            stub.rejected = {'stateCode': 'MN'}
+            with self.settings(TICKETMASTER_BASE_URL=stub.base_url, TICKETMASTER_PAGE_SIZE=2, TICKETMASTER_REQUESTS_PER_SECOND=1000,
+                               TICKETMASTER_MARKETS=self.markets), self.assertLogs(level='ERROR'):
+                call_command('sync_ticketmaster', '--processes', '1', stdout=out)
+
+        self.assertIn('minneapolis failed: 400 Client Error', out.getvalue())
+        self.assertIn('failed markets: 1 of 2', out.getvalue())
+        self.assertEqual(3, Show.objects.count())
+        self.assertFalse(SyncCheckpoint.objects.filter(name='events:minneapolis').exists())
+        self.assertTrue(SyncCheckpoint.objects.get(name='events:milwaukee').completed)
+
+
+class RecordingTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_recorded_pages_replay_as_served(self):
+        pages = make_pages('events', [make_event(f'Band {n}', 'First Avenue') for n in range(3)], 2)
+        pages[('events', 0)]['_links'] = {'next': {'href': '/discovery/v2/events.json?page=1&apikey=secret&size=2'}}
+        with StubTicketmaster(pages) as stub:
+            crawler = Crawler(base_url=stub.base_url, api_key='secret', page_size=2, per_second=1000, cache=False, stream=False)
+            self.assertEqual(3, recording.record(self.directory, 'events', {'dmaId': '336'}, crawler))
+
+        replayed = recording.load(self.directory)
+        self.assertEqual([('events', 0), ('events', 1)], sorted(replayed))
+        self.assertEqual(pages[('events', 1)], replayed[('events', 1)])
+        self.assertEqual('/discovery/v2/events.json?page=1&size=2', replayed[('events', 0)]['_links']['next']['href'])
+
+        with StubTicketmaster(replayed) as stub:
+            crawler = Crawler(base_url=stub.base_url, api_key='replay', page_size=2, per_second=1000, cache=False)
+            names = [event['_embedded']['attractions'][0]['name'] for items in crawler.items('events', {}) for event in items]
+        self.assertEqual(['Band 0', 'Band 1', 'Band 2'], sorted(names))
+
+    def test_windowed_crawl_recorded_without_overwriting_pages(self):
+        start = datetime.datetime(2021, 3, 1, tzinfo=datetime.timezone.utc)
+        events = [make_event(f'Band {n}', 'First Avenue', (start + datetime.timedelta(hours=n)).strftime('%Y-%m-%dT%H:%M:%SZ'))
+                  for n in range(1500)]
+        with StubTicketmaster({}, searches={'events': events}) as stub:
+            crawler = Crawler(base_url=stub.base_url, api_key='secret', page_size=200, per_second=1000, cache=False, stream=False)
+            count = recording.record(self.directory, 'events', {'startDateTime': '2021-03-01T00:00:00Z'}, crawler)
+
+        recorded = [event['_embedded']['attractions'][0]['name']
+                    for page in recording.load(self.directory).values() for event in page['_embedded']['events']]
+        self.assertEqual(1500, count)
+        self.assertEqual(1500, len(recorded))
+        self.assertEqual(1500, len(set(recorded)))
@@ -1,7 +1,12 @@
 from django.test import TestCase
 
 from django.contrib.auth.models import User
-from lmn.models import Note
+from lmn.tests.cache_test_case import CacheTestCase
+from lmn.models import Note, PendingPhotoDeletion
+from lmn import photos
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from unittest.mock import patch
 from lmn.forms import VenueSearchForm, ArtistSearchForm, NoteSearchForm, NewNoteForm, UserRegistrationForm, ProfileForm
 import string
 import shutil
@@ -9,6 +14,7 @@ from PIL import Image
 from django.urls import reverse
 
 import tempfile
+import io
 import filecmp
 import os 
 
@@ -155,10 +161,11 @@ class LoginFormTests(TestCase):
     pass
 
 
-class TestImageUpload(TestCase):
+class TestImageUpload(CacheTestCase):
     fixtures = ['testing_users', 'testing_venues', 'testing_artists', 'testing_shows']
 
     def setUp(self):
+        super().setUp()
         user = User.objects.get(pk=1)
         self.client.force_login(user)
         self.MEDIA_ROOT = tempfile.mkdtemp()
@@ -198,6 +205,77 @@ class TestImageUpload(TestCase):
                 self.assertTrue(filecmp.cmp(img_file_path, expected_uploaded_file_path))
 
 
+    def upload(self, url, size=(2000, 1500)):
+        handle, path = tempfile.mkstemp(suffix='.jpg', dir=self.MEDIA_ROOT)
+        Image.new('RGB', size, 'red').save(path, format='JPEG')
+        with open(path, 'rb') as photo:
+            post_data = {'title': 'note title', 'text': 'note description', 'rating': 1, 'posted_date': '12/17/2020', 'photo': photo}
+            self.client.post(url, post_data)
+        return os.path.basename(path)
+
+    def test_uploads_get_smaller_renditions(self):
+        with self.settings(MEDIA_ROOT=self.MEDIA_ROOT):
+            name = self.upload(reverse('new_note', kwargs={'show_pk': 1}))
+            note = Note.objects.get()
+            self.assertEqual([300, 600, 1200], note.photo_renditions['widths'])
+            stem = f'{name}.{{}}w.{note.photo_renditions["token"]}'
+            for width in (300, 600, 1200):
+                for extension in ('webp', 'jpg'):
+                    with Image.open(os.path.join(self.MEDIA_ROOT, 'user_images', 'renditions', f'{stem.format(width)}.{extension}')) as rendition:
+                        self.assertEqual((width, width * 3 // 4), rendition.size)
+
+            # cards offer the renditions, only the note's own page the original
+            response = self.client.get(reverse('latest_notes'))
+            self.assertContains(response, f'/media/user_images/renditions/{stem.format(300)}.webp 300w, /media/user_images/renditions/{stem.format(600)}.webp 600w"')
+            self.assertNotContains(response, f'{name}.1200w')
+            self.assertNotContains(response, f'/media/user_images/{name}"')
+            response = self.client.get(reverse('note_detail', kwargs={'note_pk': note.pk}))
+            self.assertContains(response, f'{stem.format(1200)}.webp 1200w')
+            self.assertContains(response, f'/media/user_images/{name}"')
+
+    def test_replaced_photo_renditions_are_deleted_too(self):
+        with self.settings(MEDIA_ROOT=self.MEDIA_ROOT):
+            first = self.upload(reverse('new_note', kwargs={'show_pk': 1}))
+            note = Note.objects.get()
+            # smaller than every rendition width, so only the original is used
+            self.upload(reverse('modify_note', kwargs={'note_pk': note.pk}), size=(200, 100))
+            self.assertEqual({}, Note.objects.get().photo_renditions)
+            queued = sorted(pending.name for pending in PendingPhotoDeletion.objects.all())
+            self.assertEqual(7, len(queued))
+            self.assertIn(f'user_images/{first}', queued)
+            self.assertIn(f'user_images/renditions/{first}.600w.{note.photo_renditions["token"]}.webp', queued)
+
+    def test_new_photo_under_an_old_name_keeps_its_renditions(self):
+        with self.settings(MEDIA_ROOT=self.MEDIA_ROOT):
+            self.upload(reverse('new_note', kwargs={'show_pk': 1}))
+            old = Note.objects.get()
+            old.delete()  # queues the photo and its renditions, but they're not deleted yet
+
+            # another note's photo saved under the same name before the queue is drained
+            note = Note.objects.create(show=old.show, user=old.user, title='again', text='again', rating=1, photo=old.photo.name)
+            photos.make_renditions(note)
+            self.assertNotEqual(old.photo_renditions['token'], note.photo_renditions['token'])
+            call_command('drain_photo_deletions', stdout=io.StringIO())
+            for name in photos.rendition_names(note.photo.name, note.photo_renditions):
+                self.assertTrue(os.path.exists(os.path.join(self.MEDIA_ROOT, name)))
+
+    def test_storage_errors_leave_the_note_with_its_original_photo(self):
+        real_save = default_storage.save
+
+        def save(name, content, **kwargs):
+            if name.endswith('.jpg') and '.600w.' in name:
+                raise OSError('disk full')
+            return real_save(name, content, **kwargs)
+
+        with self.settings(MEDIA_ROOT=self.MEDIA_ROOT), patch.object(default_storage, 'save', save), self.assertLogs(level='ERROR'):
+            name = self.upload(reverse('new_note', kwargs={'show_pk': 1}))
+        note = Note.objects.get()
+        self.assertEqual(f'user_images/{name}', note.photo.name)
+        self.assertEqual({}, note.photo_renditions)
+        # the renditions saved before the error are queued for deletion
+        self.assertEqual(3, PendingPhotoDeletion.objects.count())
+
+
 
 class SearchFormTests(TestCase):
 
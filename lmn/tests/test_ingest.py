@@ -0,0 +1,147 @@
+from django.test import TestCase
+from django.db import IntegrityError
+from unittest.mock import patch
+from lmn.caching import get_version
+from lmn.models import Venue, Artist, Show
+from lmn.ticketmaster.ingest import ingest_artists, ingest_venues, ingest_shows
+import datetime
+from datetime import timezone
+
+
+def make_event(artist, venue, date_time='2021-03-01T02:00:00Z', event_id=None):
+    return {
+        'id': event_id,
+        '_embedded': {
+            'attractions': [{'name': artist}],
+            'venues': [{'name': venue}],
+        },
+        'dates': {'start': {'dateTime': date_time}},
+    }
+
+
+def make_venue(name, city='Minneapolis', state='MN'):
+    return {'name': name, 'city': {'name': city}, 'state': {'stateCode': state}}
+
+
+class TestIngestArtists(TestCase):
+
+    fixtures = ['testing_artists']
+
+    def test_new_artists_inserted_and_known_artists_left_alone(self):
+        events = [make_event('REM', 'First Avenue'), make_event('Prince', 'First Avenue'), make_event('Prince', 'Turf Club')]
+        report = ingest_artists(events)
+        self.assertEqual(1, Artist.objects.filter(name='Prince').count())
+        self.assertEqual({'inserted': 1, 'updated': 0, 'unchanged': 1, 'skipped': 0}, report.counts['artists'])
+        self.assertNotEqual('', Artist.objects.get(name='Prince').fingerprint)
+
+    def test_rerun_leaves_artists_unchanged(self):
+        events = [make_event('REM', 'First Avenue'), make_event('Prince', 'First Avenue')]
+        ingest_artists(events)
+        report = ingest_artists(events)
+        self.assertEqual({'inserted': 0, 'updated': 0, 'unchanged': 2, 'skipped': 0}, report.counts['artists'])
+
+    def test_ingest_is_a_fixed_number_of_queries(self):
+        events = [make_event(f'Band {n}', 'First Avenue') for n in range(100)]
+        # savepoint, select existing names, insert new ones, release savepoint
+        with self.assertNumQueries(4):
+            ingest_artists(events)
+        self.assertEqual(103, Artist.objects.count())
+
+
+class TestIngestVenues(TestCase):
+
+    fixtures = ['testing_venues']
+
+    def test_new_venues_inserted_and_changed_venues_updated(self):
+        venues = [make_venue('The Turf Club', city='St Paul'), make_venue('The Armory')]
+        report = ingest_venues(venues)
+        self.assertEqual('St Paul', Venue.objects.get(name='The Turf Club').city)
+        self.assertTrue(Venue.objects.filter(name='The Armory').exists())
+        self.assertEqual({'inserted': 1, 'updated': 1, 'unchanged': 0, 'skipped': 0}, report.counts['venues'])
+
+    def test_unchanged_venue_not_written(self):
+        turf_club = Venue.objects.get(name='The Turf Club')
+        ingest_venues([make_venue(turf_club.name, turf_club.city, turf_club.state)])
+        # savepoint, read the venue back, release savepoint. Nothing is written
+        with self.assertNumQueries(3):
+            report = ingest_venues([make_venue(turf_club.name, turf_club.city, turf_club.state)])
+        self.assertEqual({'inserted': 0, 'updated': 0, 'unchanged': 1, 'skipped': 0}, report.counts['venues'])
+
+
+class TestIngestShows(TestCase):
+
+    fixtures = ['testing_artists', 'testing_venues', 'testing_shows']
+
+    def test_new_shows_inserted_and_rerun_skips_them(self):
+        events = [make_event('REM', 'First Avenue'), make_event('ACDC', 'The Turf Club')]
+        report = ingest_shows(events)
+        self.assertEqual({'inserted': 2, 'updated': 0, 'unchanged': 0, 'skipped': 0}, report.counts['shows'])
+
+        report = ingest_shows(events)
+        self.assertEqual({'inserted': 0, 'updated': 0, 'unchanged': 2, 'skipped': 0}, report.counts['shows'])
+        show_date = datetime.datetime(2021, 3, 1, 2, 0, tzinfo=timezone.utc)
+        self.assertEqual(1, Show.objects.filter(artist__name='REM', venue__name='First Avenue', show_date=show_date).count())
+
+    def test_cached_lists_made_stale_again_after_commit(self):
+        # Until the ingest commits, a request may cache the old shows under the version bumped mid-transaction
+        before = get_version('lmn_show')
+        with patch('lmn.caching.transaction.on_commit') as on_commit:
+            ingest_shows([make_event('REM', 'First Avenue', '2021-05-01T02:00:00Z')])
+        during = get_version('lmn_show')
+        self.assertNotEqual(before, during)
+        for call in on_commit.call_args_list:
+            call.args[0]()
+        self.assertNotEqual(during, get_version('lmn_show'))
+
+    def test_show_matched_by_ticketmaster_id_is_moved_not_duplicated(self):
+        ingest_shows([make_event('REM', 'First Avenue', '2021-03-01T02:00:00Z', event_id='tm1')])
+        report = ingest_shows([make_event('REM', 'First Avenue', '2021-04-01T02:00:00Z', event_id='tm1')])
+
+        self.assertEqual({'inserted': 0, 'updated': 1, 'unchanged': 0, 'skipped': 0}, report.counts['shows'])
+        show = Show.objects.get(ticketmaster_id='tm1')
+        self.assertEqual(datetime.datetime(2021, 4, 1, 2, 0, tzinfo=timezone.utc), show.show_date)
+
+    def test_changes_to_fields_we_dont_store_leave_show_unchanged(self):
+        event = make_event('REM', 'First Avenue', event_id='tm1')
+        ingest_shows([event])
+        event['url'] = 'https://www.ticketmaster.com/rem'
+        event['priceRanges'] = [{'min': 25.0, 'max': 40.0}]
+        report = ingest_shows([event])
+        self.assertEqual({'inserted': 0, 'updated': 0, 'unchanged': 1, 'skipped': 0}, report.counts['shows'])
+
+    def test_existing_show_gets_ticketmaster_id(self):
+        # Show 1 in the fixtures is REM at the Turf Club
+        show = Show.objects.get(pk=1)
+        event = make_event('REM', 'The Turf Club', show.show_date.strftime('%Y-%m-%dT%H:%M:%SZ'), event_id='tm1')
+        report = ingest_shows([event])
+
+        self.assertEqual({'inserted': 0, 'updated': 1, 'unchanged': 0, 'skipped': 0}, report.counts['shows'])
+        self.assertEqual('tm1', Show.objects.get(pk=1).ticketmaster_id)
+        self.assertEqual(3, Show.objects.count())
+
+    def test_duplicate_show_rejected_by_database(self):
+        show = Show.objects.get(pk=1)
+        with self.assertRaises(IntegrityError):
+            Show(artist=show.artist, venue=show.venue, show_date=show.show_date).save()
+
+    def test_unknown_artists_and_venues_created_for_shows(self):
+        event = make_event('Prince', 'Paisley Park')
+        event['_embedded']['venues'][0].update(city={'name': 'Chanhassen'}, state={'stateCode': 'MN'})
+        events = [event, make_event('REM', 'First Avenue')]
+
+        report = ingest_shows(events)
+
+        self.assertEqual({'inserted': 2, 'updated': 0, 'unchanged': 0, 'skipped': 0}, report.counts['shows'])
+        self.assertEqual(1, report.counts['artists']['inserted'])
+        self.assertEqual(1, report.counts['venues']['inserted'])
+        paisley_park = Venue.objects.get(name='Paisley Park')
+        self.assertEqual(('Chanhassen', 'MN'), (paisley_park.city, paisley_park.state))
+        self.assertTrue(Show.objects.filter(artist__name='Prince', venue=paisley_park).exists())
+
+    def test_names_resolved_with_one_query_per_model(self):
+        events = [make_event(artist, venue, f'2021-03-0{day}T02:00:00Z')
+                  for day in range(1, 4) for artist in ('REM', 'ACDC', 'Yes') for venue in ('First Avenue', 'The Turf Club')]
+        # savepoint, artist names, venue names, existing shows, insert shows, release savepoint
+        with self.assertNumQueries(6):
+            report = ingest_shows(events)
+        self.assertEqual(18, report.counts['shows']['inserted'])
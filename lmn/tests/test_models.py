@@ -1,7 +1,21 @@
 from django.test import TestCase
 
 from django.contrib.auth.models import User
-from django.db import IntegrityError
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from lmn.caching import get_version
+from lmn.models import Artist, Venue, Show, Note, ShowStats, PendingPhotoDeletion
+from lmn.photo_gc import BloomFilter
+from lmn.photos import original_name
+import datetime
+from io import StringIO
+import os
+import shutil
+import tempfile
+from unittest import mock
 # Create your tests here.
 
 
@@ -26,3 +40,238 @@ class TestUser(TestCase):
             user2.save()
 
 
+class TestShowStats(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'password')
+        venue = Venue.objects.create(name='First Avenue', city='Minneapolis', state='MN')
+        self.show = Show.objects.create(show_date=datetime.datetime(2021, 2, 1, tzinfo=datetime.timezone.utc),
+                                        artist=Artist.objects.create(name='REM'), venue=venue)
+        self.other_show = Show.objects.create(show_date=datetime.datetime(2021, 2, 2, tzinfo=datetime.timezone.utc),
+                                              artist=Artist.objects.create(name='Prince'), venue=venue)
+
+    def note(self, rating, posted_date, show=None):
+        return Note.objects.create(show=show or self.show, user=self.user, title='Note', text='Note',
+                                   rating=rating, posted_date=posted_date)
+
+    def stats(self, show=None):
+        return ShowStats.objects.get(show=show or self.show)
+
+    def test_new_notes_are_counted(self):
+        self.note(5, datetime.date(2021, 2, 3))
+        self.note(3, datetime.date(2021, 2, 5))
+        self.note(5, datetime.date(2021, 2, 4))
+        stats = self.stats()
+        self.assertEqual(3, stats.note_count)
+        self.assertEqual(13, stats.rating_total)
+        self.assertEqual([0, 0, 1, 0, 2], stats.histogram)
+        self.assertEqual(datetime.date(2021, 2, 5), stats.last_note_date)
+
+    def test_changed_rating_and_show_move_between_totals(self):
+        note = self.note(5, datetime.date(2021, 2, 3))
+        note.rating = 2
+        note.save()
+        self.assertEqual([0, 1, 0, 0, 0], self.stats().histogram)
+        self.assertEqual(2, self.stats().rating_total)
+
+        note.show = self.other_show
+        note.save()
+        self.assertEqual(0, self.stats().note_count)
+        self.assertIsNone(self.stats().last_note_date)
+        self.assertEqual(1, self.stats(self.other_show).note_count)
+
+    def test_deleted_notes_are_taken_out(self):
+        self.note(4, datetime.date(2021, 2, 3))
+        latest = self.note(2, datetime.date(2021, 2, 9))
+        latest.delete()
+        stats = self.stats()
+        self.assertEqual(1, stats.note_count)
+        self.assertEqual(4.0, stats.mean_rating)
+        self.assertEqual(datetime.date(2021, 2, 3), stats.last_note_date)
+
+        # notes deleted along with their author
+        self.user.delete()
+        self.assertEqual(0, self.stats().note_count)
+
+    def test_rebuild_matches_running_totals(self):
+        self.note(5, datetime.date(2021, 2, 3))
+        self.note(1, None)
+        self.note(4, datetime.date(2021, 2, 4), show=self.other_show)
+        expected = {stats.pk: (stats.note_count, stats.rating_total, stats.histogram, stats.last_note_date) for stats in ShowStats.objects.all()}
+
+        ShowStats.objects.all().delete()
+        version = get_version('notes')
+        call_command('rebuild_show_stats', '--batch-size', '1', stdout=StringIO())
+        self.assertNotEqual(version, get_version('notes'))  # cached rankings are stale
+        rebuilt = {stats.pk: (stats.note_count, stats.rating_total, stats.histogram, stats.last_note_date) for stats in ShowStats.objects.all()}
+        self.assertEqual(expected, rebuilt)
+
+
+class TestNoteSave(TestCase):
+
+    def setUp(self):
+        self.MEDIA_ROOT = tempfile.mkdtemp()
+        user = User.objects.create_user('alice', 'alice@example.com', 'password')
+        show = Show.objects.create(show_date=datetime.datetime(2021, 2, 1, tzinfo=datetime.timezone.utc),
+                                   artist=Artist.objects.create(name='REM'),
+                                   venue=Venue.objects.create(name='First Avenue', city='Minneapolis', state='MN'))
+        Note.objects.create(show=show, user=user, title='Loud', text='Great encore', rating=4)
+
+    def tearDown(self):
+        shutil.rmtree(self.MEDIA_ROOT)
+
+    def test_edit_writes_only_changed_columns_without_reading_first(self):
+        note = Note.objects.get()
+        note.rating = 2
+        with CaptureQueriesContext(connection) as queries:
+            note.save()
+        sql = [query['sql'] for query in queries.captured_queries]
+        self.assertFalse([query for query in sql if query.startswith('SELECT') and 'lmn_note' in query.split('WHERE')[0]])
+        update = next(query for query in sql if query.startswith('UPDATE "lmn_note"'))
+        self.assertIn('"rating"', update)
+        self.assertNotIn('"text"', update)
+        self.assertEqual(2, Note.objects.get().rating)
+        self.assertEqual(2, ShowStats.objects.get().rating_total)
+
+    def test_unchanged_note_is_not_written(self):
+        note = Note.objects.get()
+        note.rating = 4
+        with CaptureQueriesContext(connection) as queries:
+            note.save()
+        self.assertEqual(0, len(queries))
+
+        # saved values are the new baseline
+        note.title = 'Quiet'
+        note.save()
+        with CaptureQueriesContext(connection) as queries:
+            note.save()
+        self.assertEqual(0, len(queries))
+
+    def test_replaced_photo_is_deleted(self):
+        with self.settings(MEDIA_ROOT=self.MEDIA_ROOT):
+            note = Note.objects.get()
+            note.photo = SimpleUploadedFile('first.jpg', b'first')
+            note.save()
+            first = note.photo.path
+
+            note = Note.objects.get()
+            note.photo = SimpleUploadedFile('second.jpg', b'second')
+            note.save()
+            # queued, then deleted by the worker
+            self.assertEqual(['user_images/first.jpg'], [pending.name for pending in PendingPhotoDeletion.objects.all()])
+            self.assertTrue(os.path.exists(first))
+            call_command('drain_photo_deletions', stdout=StringIO())
+            self.assertFalse(os.path.exists(first))
+            self.assertTrue(os.path.exists(Note.objects.get().photo.path))
+
+            # editing something else leaves the photo alone
+            note = Note.objects.get()
+            note.title = 'Quiet'
+            note.save()
+            self.assertFalse(PendingPhotoDeletion.objects.exists())
+
+
+class TestPhotoDeletionQueue(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'password')
+        show = Show.objects.create(show_date=datetime.datetime(2021, 2, 1, tzinfo=datetime.timezone.utc),
+                                   artist=Artist.objects.create(name='REM'),
+                                   venue=Venue.objects.create(name='First Avenue', city='Minneapolis', state='MN'))
+        self.note = Note.objects.create(show=show, user=self.user, title='Loud', text='Great encore', rating=4,
+                                        photo='user_images/encore.jpg')
+
+    def test_deleting_notes_queues_their_photos_without_calling_storage(self):
+        with mock.patch('django.core.files.storage.default_storage.delete') as delete, \
+                mock.patch('django.core.files.storage.default_storage.exists') as exists:
+            self.user.delete()  # and the note along with them
+        delete.assert_not_called()
+        exists.assert_not_called()
+        self.assertEqual(['user_images/encore.jpg'], [pending.name for pending in PendingPhotoDeletion.objects.all()])
+
+    def test_rolled_back_delete_queues_nothing(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.note.delete()
+            raise IntegrityError
+        self.assertFalse(PendingPhotoDeletion.objects.exists())
+
+    def test_failed_deletes_are_retried_later(self):
+        self.note.delete()
+        out = StringIO()
+        with mock.patch('django.core.files.storage.default_storage.delete', side_effect=OSError('unavailable')):
+            call_command('drain_photo_deletions', stdout=out)
+        self.assertIn('Deleted 0 photos, 1 failed attempts, 1 still queued', out.getvalue())
+        pending = PendingPhotoDeletion.objects.get()
+        self.assertEqual(1, pending.attempts)
+        self.assertEqual('OSError: unavailable', pending.last_error)
+        self.assertGreater(pending.next_attempt, timezone.now())
+
+        # not due yet
+        with mock.patch('django.core.files.storage.default_storage.delete') as delete:
+            call_command('drain_photo_deletions', stdout=StringIO())
+        delete.assert_not_called()
+
+        PendingPhotoDeletion.objects.update(next_attempt=timezone.now())
+        out = StringIO()
+        with mock.patch('django.core.files.storage.default_storage.delete') as delete:
+            call_command('drain_photo_deletions', '--batch-size', '1', stdout=out)
+        delete.assert_called_once_with('user_images/encore.jpg')
+        self.assertIn('Deleted 1 photos, 0 failed attempts, 0 still queued', out.getvalue())
+
+
+class TestCollectOrphanedPhotos(TestCase):
+
+    def setUp(self):
+        self.MEDIA_ROOT = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.MEDIA_ROOT, 'user_images', 'old'))
+        os.makedirs(os.path.join(self.MEDIA_ROOT, 'user_images', 'renditions'))
+        user = User.objects.create_user('alice', 'alice@example.com', 'password')
+        show = Show.objects.create(show_date=datetime.datetime(2021, 2, 1, tzinfo=datetime.timezone.utc),
+                                   artist=Artist.objects.create(name='REM'),
+                                   venue=Venue.objects.create(name='First Avenue', city='Minneapolis', state='MN'))
+        Note.objects.create(show=show, user=user, title='Loud', text='Great encore', rating=4, photo='user_images/kept.jpg')
+        # a week old, apart from an upload that may not have its note yet
+        for name, size, age in (('kept.jpg', 10, 7), ('renditions/kept.jpg.300w.1f9c04ab.webp', 10, 7), ('orphan.jpg', 100, 7), ('old/orphan.jpg', 1000, 7), ('uploading.jpg', 10, 0)):
+            path = os.path.join(self.MEDIA_ROOT, 'user_images', name)
+            with open(path, 'wb') as photo:
+                photo.write(b'x' * size)
+            modified = (timezone.now() - datetime.timedelta(days=age)).timestamp()
+            os.utime(path, (modified, modified))
+
+    def tearDown(self):
+        shutil.rmtree(self.MEDIA_ROOT)
+
+    def remaining(self):
+        return sorted(os.path.relpath(os.path.join(directory, name), self.MEDIA_ROOT)
+                      for directory, directories, names in os.walk(self.MEDIA_ROOT) for name in names)
+
+    def collect(self, *args):
+        out = StringIO()
+        with self.settings(MEDIA_ROOT=self.MEDIA_ROOT):
+            call_command('collect_orphaned_photos', '--deletes-per-second', '0', *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_deletes_nothing(self):
+        before = self.remaining()
+        out = self.collect('--dry-run')
+        self.assertIn('Scanned 5 files, 1 too recent to check. Would delete 2 orphaned photos, 1.1 KB reclaimed', out)
+        self.assertEqual(before, self.remaining())
+
+    def test_old_unreferenced_files_are_deleted(self):
+        out = self.collect('--chunk-size', '1')
+        self.assertIn('Deleted 2 orphaned photos, 1.1 KB reclaimed, 0 failed', out)
+        self.assertEqual(['user_images/kept.jpg', 'user_images/renditions/kept.jpg.300w.1f9c04ab.webp', 'user_images/uploading.jpg'],
+                         self.remaining())
+
+    def test_renditions_belong_to_their_photo(self):
+        self.assertEqual('user_images/pic.jpg', original_name('user_images/renditions/pic.jpg.300w.1f9c04ab.webp'))
+        self.assertEqual('user_images/pic.300w.1f9c04ab.jpg', original_name('user_images/renditions/pic.300w.1f9c04ab.jpg.600w.5e2d7a90.webp'))
+        self.assertEqual('user_images/pic.jpg', original_name('user_images/pic.jpg'))
+
+    def test_bloom_filter_never_misses_a_name(self):
+        names = BloomFilter(1000)
+        for n in range(1000):
+            names.add(f'user_images/{n}.jpg')
+        self.assertTrue(all(f'user_images/{n}.jpg' in names for n in range(1000)))
+        false_positives = sum(f'user_images/other{n}.jpg' in names for n in range(10000))
+        self.assertLess(false_positives, 50)
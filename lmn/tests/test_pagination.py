@@ -0,0 +1,120 @@
+from django.test import override_settings
+from django.urls import reverse
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from unittest.mock import patch
+from lmn.tests.cache_test_case import CacheTestCase
+from lmn.models import Artist, Venue, Show, Note
+import datetime
+
+
+@override_settings(PAGINATION_CURSOR_AFTER_PAGE=2)
+class TestCursorPagination(CacheTestCase):
+
+    def walk(self, url, name, start='?page=1'):
+        """ Follow Next links from `start` to the end, returning every item seen. """
+        seen = []
+        query = start
+        while query:
+            page = self.client.get(url + query).context[name]
+            seen.extend(page)
+            if page.next_cursor:
+                query = f'?cursor={page.next_cursor}'
+            elif page.number and page.has_next():
+                query = f'?page={page.next_page_number()}'
+            else:
+                query = None
+        return seen
+
+    def test_walk_every_page_of_artists(self):
+        Artist.objects.bulk_create([Artist(name=f'Band {n:03d}') for n in range(130)])
+        seen = self.walk(reverse('artist_list'), 'artists')
+        self.assertEqual(list(Artist.objects.order_by('name')), seen)
+
+    def test_cursor_pages_skip_the_count(self):
+        Artist.objects.bulk_create([Artist(name=f'Band {n:03d}') for n in range(80)])
+        page = self.client.get(reverse('artist_list') + '?page=2').context['artists']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('artist_list') + f'?cursor={page.next_cursor}')
+        self.assertEqual(['Band 050', 'Band 074'], [response.context['artists'][0].name, response.context['artists'][-1].name])
+        self.assertFalse(any('COUNT' in query['sql'] for query in queries))
+
+    def test_previous_and_last_links_walk_backwards(self):
+        Artist.objects.bulk_create([Artist(name=f'Band {n:03d}') for n in range(130)])
+        page = self.client.get(reverse('artist_list')).context['artists']
+        seen = []
+        page = self.client.get(reverse('artist_list') + f'?cursor={page.last_cursor}').context['artists']
+        self.assertEqual('Band 105', page[0].name)
+        self.assertFalse(page.has_next)
+        while page:
+            seen = list(page) + seen
+            if not page.previous_cursor:
+                break
+            page = self.client.get(reverse('artist_list') + f'?cursor={page.previous_cursor}').context['artists']
+        self.assertEqual(list(Artist.objects.order_by('name')), seen)
+
+    def test_ties_and_missing_dates_in_notes(self):
+        user = User.objects.create_user('alice', 'alice@example.com', 'password')
+        show = Show.objects.create(show_date=datetime.datetime(2021, 2, 1, tzinfo=datetime.timezone.utc),
+                                   artist=Artist.objects.create(name='REM'),
+                                   venue=Venue.objects.create(name='First Avenue', city='Minneapolis', state='MN'))
+        for n in range(90):
+            # lots of notes on the same day, and some with no date at all
+            posted_date = None if n % 10 == 0 else datetime.date(2021, 2, 1 + n % 3)
+            Note.objects.create(show=show, user=user, title=f'Note {n}', text='Note', rating=3, posted_date=posted_date)
+
+        seen = self.walk(reverse('latest_notes'), 'notes')
+        self.assertEqual(90, len(set(note.pk for note in seen)))
+        self.assertEqual(sorted(seen, key=lambda note: (note.posted_date is None, -(note.posted_date or datetime.date.min).toordinal(), -note.pk)), seen)
+
+    def test_mangled_cursor_starts_from_the_top(self):
+        Artist.objects.create(name='REM')
+        response = self.client.get(reverse('artist_list') + '?cursor=not-a-cursor')
+        self.assertEqual(1, response.context['artists'].number)
+
+
+@override_settings(PAGE_CACHE_SECONDS=0)
+class TestCountingPaginator(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'password')
+        self.show = Show.objects.create(show_date=datetime.datetime(2021, 2, 1, tzinfo=datetime.timezone.utc),
+                                        artist=Artist.objects.create(name='REM'),
+                                        venue=Venue.objects.create(name='First Avenue', city='Minneapolis', state='MN'))
+        for n in range(30):
+            Note.objects.create(show=self.show, user=self.user, title=f'Note {n}', text='Note', rating=3)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            page = self.client.get(url).context['notes']
+        return page, [query['sql'] for query in queries.captured_queries if 'COUNT(' in query['sql']]
+
+    def test_counts_cached_until_a_note_changes(self):
+        url = reverse('notes_for_show', kwargs={'show_pk': self.show.pk})
+        page, counts = self.count_queries(url)
+        self.assertEqual(1, len(counts))
+        self.assertEqual(2, page.paginator.num_pages)
+
+        page, counts = self.count_queries(url)
+        self.assertEqual([], counts)
+        self.assertEqual(2, page.paginator.num_pages)
+
+        Note.objects.filter(title__startswith='Note 2').delete()  # leaving 19
+        page, counts = self.count_queries(url)
+        self.assertEqual(1, len(counts))
+        self.assertEqual(1, page.paginator.num_pages)
+
+    def test_big_unfiltered_tables_use_the_estimate(self):
+        with patch('lmn.pagination.estimated_count', return_value=1000000):
+            page, counts = self.count_queries(reverse('latest_notes'))
+            self.assertContains(self.client.get(reverse('latest_notes')), 'Page 1 of about 40000<')
+        self.assertEqual([], counts)
+        self.assertEqual(40000, page.paginator.num_pages)
+        self.assertTrue(page.paginator.count_is_estimate)
+
+        with patch('lmn.pagination.estimated_count', return_value=500):
+            page, counts = self.count_queries(reverse('latest_notes'))
+        self.assertEqual(2, page.paginator.num_pages)
+        self.assertFalse(page.paginator.count_is_estimate)
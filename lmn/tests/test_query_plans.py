@@ -0,0 +1,85 @@
+from django.test import override_settings
+from django.urls import reverse
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from lmn.tests.cache_test_case import CacheTestCase
+from lmn.models import Artist, Venue, Show, Note
+import datetime
+import json
+
+
+def sorts_rows(sql):
+    """ Whether the database would sort rows to answer `sql`, rather than read them in order from an index. """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+            plan = cursor.fetchone()[0]
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            nodes = [plan[0]['Plan']]
+            while nodes:
+                node = nodes.pop()
+                if node['Node Type'] in ('Sort', 'Incremental Sort'):
+                    return True
+                nodes.extend(node.get('Plans', []))
+            return False
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        return any('TEMP B-TREE FOR' in row[-1] and 'ORDER BY' in row[-1] for row in cursor.fetchall())
+
+
+@override_settings(PAGINATION_CURSOR_AFTER_PAGE=2)
+class TestQueryPlans(CacheTestCase):
+    """ Every list reads its page from an index, however many rows there are, instead of sorting them all. """
+
+    @classmethod
+    def setUpTestData(cls):
+        # Enough rows that the planner prefers an index when there's one to use. The first user,
+        # artist, venue and show get a large share, so their lists go past the numbered pages.
+        User.objects.bulk_create([User(username=f'user{n}', email=f'user{n}@example.com') for n in range(2000)])
+        users = list(User.objects.all())
+        cls.user = users[0]
+        Artist.objects.bulk_create([Artist(name=f'Band {n}') for n in range(200)])
+        Venue.objects.bulk_create([Venue(name=f'Venue {n}', city='Minneapolis', state='MN') for n in range(50)])
+        artists, venues = list(Artist.objects.all()), list(Venue.objects.all())
+        start = datetime.datetime(2015, 1, 1, tzinfo=datetime.timezone.utc)
+        Show.objects.bulk_create([Show(artist=artists[n % 200 if n % 4 else 0], venue=venues[n % 47 if n % 4 else 0],
+                                       show_date=start + datetime.timedelta(hours=n)) for n in range(4000)])
+        shows = list(Show.objects.all())
+        Note.objects.bulk_create([Note(show=shows[n % 4000 if n % 5 else 0], user=users[n % 2000 if n % 10 else 0],
+                                       title=f'Note {n}', text='Loud', rating=1 + n % 5,
+                                       posted_date=None if n % 50 == 0 else datetime.date(2015, 1, 1) + datetime.timedelta(days=n // 7))
+                                  for n in range(20000)])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.show, cls.artist, cls.venue = shows[0], artists[0], venues[0]
+
+    def assertNoSorts(self, url, name):
+        """ Request a numbered page of `url`, then the cursor page after it, and check no query sorted rows. """
+        query = '?page=2'
+        for request in range(2):
+            with CaptureQueriesContext(connection) as queries:
+                page = self.client.get(url + query).context[name]
+            for captured in queries.captured_queries:
+                self.assertFalse(sorts_rows(captured['sql']), f'{url}{query} sorts rows: {captured["sql"]}')
+            if not getattr(page, 'next_cursor', None):
+                break
+            query = f'?cursor={page.next_cursor}'
+
+    def test_latest_notes(self):
+        self.assertNoSorts(reverse('latest_notes'), 'notes')
+
+    def test_notes_for_show(self):
+        self.assertNoSorts(reverse('notes_for_show', kwargs={'show_pk': self.show.pk}), 'notes')
+
+    def test_user_notes(self):
+        self.client.force_login(self.user)
+        self.assertNoSorts(reverse('user_notes'), 'notes')
+        self.assertNoSorts(reverse('user_profile', kwargs={'user_pk': self.user.pk}), 'notes')
+
+    def test_shows_for_artist_and_venue(self):
+        self.assertNoSorts(reverse('venues_for_artist', kwargs={'artist_pk': self.artist.pk}), 'shows')
+        self.assertNoSorts(reverse('artists_at_venue', kwargs={'venue_pk': self.venue.pk}), 'shows')
+
+    def test_artists_and_venues(self):
+        self.assertNoSorts(reverse('artist_list'), 'artists')
+        self.assertNoSorts(reverse('venue_list'), 'venues')
@@ -0,0 +1,96 @@
+from django.test import TestCase
+from django.urls import reverse
+from django.contrib.auth.models import User
+from lmn.tests.cache_test_case import CacheTestCase
+from lmn.models import Artist, Venue, Show, Note
+from lmn.search import search, similar
+from lmn.trigrams import similarity, trigrams
+import datetime
+
+
+class TestSearch(TestCase):
+
+    def test_every_word_matches_as_a_prefix(self):
+        Venue.objects.create(name='First Avenue', city='Minneapolis', state='MN')
+        Venue.objects.create(name='Fine Line', city='Minneapolis', state='MN')
+        results = search(Venue.objects.all(), 'first ave')
+        self.assertEqual(['First Avenue'], [venue.name for venue in results])
+
+    def test_venues_match_on_city(self):
+        Venue.objects.create(name='Turf Club', city='St. Paul', state='MN')
+        Venue.objects.create(name='Fine Line', city='Minneapolis', state='MN')
+        self.assertEqual(['Turf Club'], [venue.name for venue in search(Venue.objects.all(), 'paul')])
+
+    def test_better_matches_first(self):
+        # a title match outranks a match in the text
+        user = User.objects.create_user('alice', 'alice@example.com', 'password')
+        show = Show.objects.create(show_date=datetime.datetime(2021, 2, 1, tzinfo=datetime.timezone.utc),
+                                   artist=Artist.objects.create(name='REM'),
+                                   venue=Venue.objects.create(name='First Avenue', city='Minneapolis', state='MN'))
+        Note.objects.create(show=show, user=user, title='Good night', text='The encore was loud', rating=4)
+        Note.objects.create(show=show, user=user, title='Encore!', text='Best night', rating=5)
+        results = search(Note.objects.all(), 'encore')
+        self.assertEqual(['Encore!', 'Good night'], [note.title for note in results])
+
+    def test_bulk_created_and_edited_rows_are_searchable(self):
+        # the database keeps the index up to date, not Django
+        Artist.objects.bulk_create([Artist(name='Prince'), Artist(name='The Replacements')])
+        self.assertEqual(['Prince'], [artist.name for artist in search(Artist.objects.all(), 'prince')])
+
+        Artist.objects.filter(name='Prince').update(name='Hüsker Dü')
+        self.assertFalse(search(Artist.objects.all(), 'prince').exists())
+        self.assertEqual(['Hüsker Dü'], [artist.name for artist in search(Artist.objects.all(), 'hüsker')])
+
+        Artist.objects.filter(name='The Replacements').delete()
+        self.assertFalse(search(Artist.objects.all(), 'replacements').exists())
+
+    def test_nothing_matches_no_words(self):
+        Artist.objects.create(name='REM')
+        self.assertFalse(search(Artist.objects.all(), ' !? ').exists())
+
+    def test_user_notes_search_only_finds_own_notes(self):
+        alice = User.objects.create_user('alice', 'alice@example.com', 'password')
+        bob = User.objects.create_user('bob', 'bob@example.com', 'password')
+        show = Show.objects.create(show_date=datetime.datetime(2021, 2, 1, tzinfo=datetime.timezone.utc),
+                                   artist=Artist.objects.create(name='REM'),
+                                   venue=Venue.objects.create(name='First Avenue', city='Minneapolis', state='MN'))
+        Note.objects.create(show=show, user=alice, title='Loud', text='Great encore', rating=4)
+        Note.objects.create(show=show, user=bob, title='Quiet', text='No encore', rating=2)
+
+        self.client.force_login(alice)
+        response = self.client.get(reverse('user_notes'), {'search_name': 'encore'})
+        self.assertEqual(['Loud'], [note.title for note in response.context['notes']])
+
+
+class TestSimilarNames(CacheTestCase):
+
+    def test_trigrams_match_pg_trgm(self):
+        self.assertEqual({'  r', ' re', 'rem', 'em '}, trigrams('REM'))
+        self.assertAlmostEqual(4 / 11, similarity('word', 'two words'))
+        self.assertEqual(1.0, similarity('First Avenue', 'first   AVENUE!'))
+        self.assertEqual(0.0, similarity('', 'REM'))
+
+    def test_misspelled_names_most_similar_first(self):
+        Artist.objects.bulk_create([Artist(name='Metallica'), Artist(name='Metal Church'), Artist(name='Prince')])
+        results = similar(Artist.objects.all(), 'Metalica', threshold=0.2)
+        self.assertEqual(['Metallica', 'Metal Church'], [artist.name for artist in results])
+        self.assertGreater(results[0].similarity, results[1].similarity)
+        self.assertEqual(['Metallica'], [artist.name for artist in similar(Artist.objects.all(), 'Metalica', threshold=0.5)])
+
+    def test_renamed_names_are_found(self):
+        artist = Artist.objects.create(name='Prince')
+        self.assertTrue(similar(Artist.objects.all(), 'Prnce').exists())
+        artist.name = 'Hüsker Dü'
+        artist.save()
+        self.assertFalse(similar(Artist.objects.all(), 'Prnce').exists())
+        self.assertEqual([artist], list(similar(Artist.objects.all(), 'Husker Du', threshold=0.1)))
+
+    def test_search_falls_back_to_similar_names(self):
+        Venue.objects.create(name='First Avenue', city='Minneapolis', state='MN')
+        response = self.client.get(reverse('venue_list'), {'search_name': 'Frist Avenue'})
+        self.assertTrue(response.context['similar_names'])
+        self.assertEqual(['First Avenue'], [venue.name for venue in response.context['venues']])
+        self.assertContains(response, 'Venues with names like')
+
+        response = self.client.get(reverse('venue_list'), {'search_name': 'First'})
+        self.assertFalse(response.context['similar_names'])
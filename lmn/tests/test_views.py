@@ -1,10 +1,16 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.contrib import auth
 from django.contrib.auth import authenticate
+from lmn.tests.cache_test_case import CacheTestCase
 from lmn.models import Venue, Artist, Note, Show
+from lmn import note_cards
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 import re, datetime
+from io import StringIO
 from datetime import timezone
 
 # TODO verify correct templates are rendered.
@@ -81,9 +87,10 @@ class TestDeleteNotes(TestCase):
         self.assertContains(response, 'Jan. 1, 2014') #new text shown
 
 
-class TestEmptyViews(TestCase):
+class TestEmptyViews(CacheTestCase):
 
     ''' main views - the ones in the navigation menu'''
+
     def test_with_no_artists_returns_empty_list(self):
         response = self.client.get(reverse('artist_list'))
         self.assertFalse(response.context['artists'])  # An empty list is false
@@ -97,7 +104,7 @@ class TestEmptyViews(TestCase):
         self.assertFalse(response.context['notes'])  # An empty list is false
 
 
-class TestArtistViews(TestCase):
+class TestArtistViews(CacheTestCase):
 
     fixtures = ['testing_artists', 'testing_venues', 'testing_shows']
 
@@ -224,7 +231,7 @@ class TestArtistViews(TestCase):
         self.assertEqual(0, len(shows))
 
 
-class TestVenues(TestCase):
+class TestVenues(CacheTestCase):
 
     fixtures = ['testing_venues', 'testing_artists', 'testing_shows']
 
@@ -429,7 +436,7 @@ class TestAddNotesWhenUserLoggedIn(TestCase):
         self.assertRedirects(response, reverse('note_detail', kwargs={'note_pk': new_note.pk }))
 
 
-class TestUserProfile(TestCase):
+class TestUserProfile(CacheTestCase):
     fixtures = [ 'testing_users', 'testing_artists', 'testing_venues', 'testing_shows', 'testing_notes' ]  # Have to add artists and venues because of foreign key constrains in show
 
     # verify correct list of reviews for a user
@@ -484,7 +491,7 @@ class TestUserProfile(TestCase):
         self.assertContains(response, 'Login or sign up')
         
 
-class TestNotes(TestCase):
+class TestNotes(CacheTestCase):
     fixtures = ['testing_users', 'testing_artists', 'testing_venues', 'testing_shows', 'testing_notes']
     # Have to add artists and venues because of foreign key constrains in show
 
@@ -548,16 +555,18 @@ class TestNotes(TestCase):
         response = self.client.get(reverse('best_shows'))
         self.assertTemplateUsed(response, 'lmn/best_shows/best_shows.html')
 
-    #tests notes displayed in best_shows template are organized by top rating
+    #tests shows displayed in best_shows template are organized by top rating
     def test_best_shows_by_rating(self):
+        # fixtures are loaded without Note.save, so count their stats
+        call_command('rebuild_show_stats', stdout=StringIO())
         response = self.client.get(reverse('best_shows'))
-        context = response.context['notes']
+        context = response.context['shows']
         first = context[0]
-        self.assertEqual(first.rating, 5)
+        self.assertEqual(first.mean_rating, 5)
 
 
 
-class TestUserAuthentication(TestCase):
+class TestUserAuthentication(CacheTestCase):
 
     ''' Some aspects of registration (e.g. missing data, duplicate username) covered in test_forms '''
     ''' Currently using much of Django's built-in login and registration system'''
@@ -583,7 +592,7 @@ class TestUserAuthentication(TestCase):
         self.assertContains(response, 'sam12345')  # page has user's name on it
 
 
-class TestMyUserProfile(TestCase):
+class TestMyUserProfile(CacheTestCase):
     fixtures = ['testing_users', 'testing_users_profile']
 
     def test_user_not_logged_in_should_get_sent_to_login_page(self):
@@ -619,7 +628,7 @@ class TestMyUserProfile(TestCase):
         self.assertNotContains(response, 'This bio should be avilable on the page for user 1')
         
 
-class TestPagination(TestCase):
+class TestPagination(CacheTestCase):
     fixtures = ['testing_users', 'testing_artists_multi_page', 'testing_venues_multi_page', 'testing_shows', 'testing_notes_multi_page']
     
     def test_artists_multi_page(self):
@@ -657,3 +666,249 @@ class TestPagination(TestCase):
         response = self.client.get(reverse('latest_notes') + '?page=2')
         context = response.context['notes']
         self.assertEqual(len(context), 1)
+
+
+class TestNoteListQueries(CacheTestCase):
+
+    def make_notes(self, count, user=None, show=None):
+        """ Notes each with their own artist, venue, show and author unless given, so nothing is shared between cards. """
+        for n in range(Note.objects.count(), Note.objects.count() + count):
+            note_show = show or Show.objects.create(
+                show_date=datetime.datetime(2021, 2, 1, tzinfo=timezone.utc),
+                artist=Artist.objects.create(name=f'Band {n}'),
+                venue=Venue.objects.create(name=f'Venue {n}', city='Minneapolis', state='MN'))
+            note_user = user or User.objects.create_user(f'user{n}', f'user{n}@example.com', 'password')
+            Note.objects.create(show=note_show, user=note_user, title=f'Note {n}', text='Great', rating=4,
+                                posted_date=datetime.date(2021, 2, 2))
+
+    def queries_for(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        return len(queries)
+
+    def assertQueriesDontGrow(self, url, **note_options):
+        self.make_notes(2, **note_options)
+        few = self.queries_for(url)
+        self.make_notes(20, **note_options)
+        self.assertEqual(few, self.queries_for(url))
+
+    def test_latest_notes(self):
+        self.assertQueriesDontGrow(reverse('latest_notes'))
+
+    def test_notes_for_show(self):
+        self.make_notes(1)
+        show = Show.objects.get()
+        self.assertQueriesDontGrow(reverse('notes_for_show', kwargs={'show_pk': show.pk}), show=show)
+
+    def test_best_shows(self):
+        self.assertQueriesDontGrow(reverse('best_shows'))
+
+    def test_user_notes(self):
+        user = User.objects.create_user('alice', 'alice@example.com', 'password')
+        self.client.force_login(user)
+        self.assertQueriesDontGrow(reverse('user_notes'), user=user)
+
+    def test_user_profiles(self):
+        user = User.objects.create_user('alice', 'alice@example.com', 'password')
+        self.assertQueriesDontGrow(reverse('user_profile', kwargs={'user_pk': user.pk}), user=user)
+        self.client.force_login(user)
+        self.assertQueriesDontGrow(reverse('my_user_profile'), user=user)
+
+
+class TestBestShows(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'password')
+
+    def make_show(self, name, ratings):
+        show = Show.objects.create(show_date=datetime.datetime(2021, 2, 1, tzinfo=timezone.utc),
+                                   artist=Artist.objects.create(name=name),
+                                   venue=Venue.objects.create(name=f'{name} venue', city='Minneapolis', state='MN'))
+        for rating in ratings:
+            Note.objects.create(show=show, user=self.user, title='Note', text='Note', rating=rating)
+        return show
+
+    def test_shows_ranked_by_bayesian_score(self):
+        one_five = self.make_show('One five', [5])
+        many_fours = self.make_show('Many fours', [4, 5, 4, 5, 4, 5, 4, 5])
+        poor = self.make_show('Poor', [1, 2])
+        self.make_show('No notes', [])
+
+        shows = list(self.client.get(reverse('best_shows')).context['shows'])
+
+        self.assertEqual([many_fours, one_five, poor], shows)
+        self.assertEqual(8, shows[0].note_count)
+        self.assertEqual(4.5, shows[0].mean_rating)
+        self.assertGreater(shows[0].score, shows[1].score)
+
+    def test_best_shows_paginated(self):
+        for n in range(27):
+            self.make_show(f'Band {n}', [3])
+        response = self.client.get(reverse('best_shows') + '?page=2')
+        self.assertEqual(2, len(response.context['shows']))
+        self.assertEqual(2, response.context['shows'].paginator.num_pages)
+
+    def test_cache_keyed_by_page_that_exists(self):
+        for n in range(27):
+            self.make_show(f'Band {n}', [3])
+        self.client.get(reverse('best_shows') + '?page=2')
+        self.client.get(reverse('best_shows'))
+        # out of range and junk page numbers are the last and first pages, already cached
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('best_shows') + '?page=99%20%0a' + 'x' * 300)
+        self.assertEqual(1, response.context['shows'].number)
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('best_shows') + '?page=1000')
+        self.assertEqual(2, response.context['shows'].number)
+
+    def test_ranking_cached_until_a_note_changes(self):
+        first = self.make_show('First', [4])
+        self.client.get(reverse('best_shows'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('best_shows'))
+        self.assertEqual([first], list(response.context['shows']))
+
+        second = self.make_show('Second', [5, 5, 5])
+        response = self.client.get(reverse('best_shows'))
+        self.assertEqual([second, first], list(response.context['shows']))
+
+        Note.objects.filter(show=second).first().delete()
+        Note.objects.filter(show=second).first().delete()
+        Note.objects.filter(show=second).first().delete()
+        response = self.client.get(reverse('best_shows'))
+        self.assertEqual([first], list(response.context['shows']))
+
+
+class TestPageCache(CacheTestCase):
+    fixtures = ['testing_users', 'testing_artists', 'testing_venues', 'testing_shows', 'testing_notes']
+
+    def assertCached(self, url):
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+    def assertNotCached(self, url):
+        # Rendering the page queries the database
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertTrue(queries.captured_queries)
+
+    def test_pages_cached_until_something_on_them_changes(self):
+        show_one = reverse('notes_for_show', kwargs={'show_pk': 1})
+        show_two = reverse('notes_for_show', kwargs={'show_pk': 2})
+        latest = reverse('latest_notes')
+        for url in (show_one, show_two, latest):
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                self.assertEqual(first.content, self.client.get(url).content)
+
+        Note.objects.create(show=Show.objects.get(pk=1), user=User.objects.get(pk=1), title='Encore', text='Great', rating=5)
+        self.assertContains(self.client.get(show_one), 'Encore')
+        self.assertContains(self.client.get(latest), 'Encore')
+        self.assertCached(show_two)
+
+    def test_renaming_a_venue_refreshes_its_pages(self):
+        venue = Venue.objects.get(pk=1)
+        other_venue = Venue.objects.exclude(pk=1).first()
+        venue_page = reverse('artists_at_venue', kwargs={'venue_pk': venue.pk})
+        other_venue_page = reverse('artists_at_venue', kwargs={'venue_pk': other_venue.pk})
+        for url in (venue_page, other_venue_page, reverse('venue_list')):
+            self.client.get(url)
+
+        venue.name = 'The Entry'
+        venue.save()
+        self.assertContains(self.client.get(venue_page), 'The Entry')
+        self.assertContains(self.client.get(reverse('venue_list')), 'The Entry')
+        self.assertCached(other_venue_page)
+
+    def test_query_string_and_viewer_get_their_own_pages(self):
+        url = reverse('latest_notes')
+        self.client.get(url)
+        self.assertNotCached(url + '?page=2')
+
+        self.client.force_login(User.objects.get(pk=1))
+        response = self.client.get(url)
+        self.assertContains(response, 'You are logged in')
+        self.client.logout()
+        self.assertNotContains(self.client.get(url), 'You are logged in')
+
+    def test_user_profile_refreshed_by_their_notes(self):
+        user = User.objects.get(pk=1)
+        url = reverse('user_profile', kwargs={'user_pk': user.pk})
+        self.client.get(url)
+        self.assertCached(url)
+        Note.objects.filter(user=user).first().delete()
+        self.assertNotCached(url)
+
+    def test_user_profile_refreshed_by_renamed_artists_and_edited_shows(self):
+        note = Note.objects.get(pk=1)
+        url = reverse('user_profile', kwargs={'user_pk': note.user_id})
+        self.client.get(url)
+        artist = note.show.artist
+        artist.name = 'The Replacements'
+        artist.save()
+        self.assertContains(self.client.get(url), 'The Replacements')
+
+        show = note.show
+        show.show_date = datetime.datetime(2019, 7, 4, tzinfo=timezone.utc)
+        show.save()
+        self.assertContains(self.client.get(url), 'July 4, 2019')
+
+    def test_renamed_author_refreshes_note_lists(self):
+        note = Note.objects.get(pk=1)
+        latest = reverse('latest_notes')
+        show_page = reverse('notes_for_show', kwargs={'show_pk': note.show_id})
+        for url in (latest, show_page):
+            self.client.get(url)
+
+        # logging in saves the user too, but changes nothing the lists show
+        self.client.force_login(note.user)
+        self.client.logout()
+        self.assertCached(latest)
+
+        note.user.username = 'renamed_author'
+        note.user.save()
+        self.assertContains(self.client.get(latest), 'renamed_author')
+        self.assertContains(self.client.get(show_page), 'renamed_author')
+
+    @override_settings(PAGE_CACHE_SECONDS=0)
+    def test_caching_turned_off(self):
+        url = reverse('latest_notes')
+        self.client.get(url)
+        self.assertNotCached(url)
+
+
+@override_settings(PAGE_CACHE_SECONDS=0)
+class TestNoteCards(CacheTestCase):
+    fixtures = ['testing_users', 'testing_artists', 'testing_venues', 'testing_shows', 'testing_notes']
+
+    def test_cards_rendered_once_until_they_change(self):
+        notes = Note.objects.count()
+        first = self.client.get(reverse('latest_notes')).content
+        self.assertEqual({'hits': 0, 'misses': notes}, note_cards.stats())
+        self.assertEqual(first, self.client.get(reverse('latest_notes')).content)
+        self.assertEqual({'hits': notes, 'misses': notes}, note_cards.stats())
+
+        note = Note.objects.get(pk=1)
+        note.title = 'Even better'
+        note.save()
+        self.assertContains(self.client.get(reverse('latest_notes')), 'Even better')
+        self.assertEqual({'hits': 2 * notes - 1, 'misses': notes + 1}, note_cards.stats())
+
+    def test_cards_show_renamed_artists(self):
+        note = Note.objects.get(pk=1)
+        url = reverse('user_profile', kwargs={'user_pk': note.user_id})
+        self.client.get(url)
+        artist = note.show.artist
+        artist.name = 'The Replacements'
+        artist.save()
+        self.assertContains(self.client.get(url), 'The Replacements')
+
+    def test_stats_command(self):
+        self.client.get(reverse('latest_notes'))
+        self.client.get(reverse('latest_notes'))
+        out = StringIO()
+        call_command('note_card_stats', '--reset', stdout=out)
+        self.assertIn(f'{Note.objects.count()} hits, {Note.objects.count()} misses, hit rate 50.0%', out.getvalue())
+        self.assertEqual({'hits': 0, 'misses': 0}, note_cards.stats())
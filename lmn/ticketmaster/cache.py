@@ -0,0 +1,161 @@
+"""
+On-disk cache of Ticketmaster responses, shared by every sync on the machine.
+
+Entries are keyed by the request URL with the API key removed and the query
+sorted, so the same search made by different code paths (or with different
+keys) hits the same entry. Fresh entries are served without touching the
+network. Stale entries are revalidated with If-None-Match / If-Modified-Since,
+and a 304 just resets the entry's age. The cache is kept under a byte budget
+by evicting the least recently used entries.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from urllib import parse
+
+from django.conf import settings
+
+
+class CacheEntry:
+
+    def __init__(self, body_path, meta):
+        self.body_path = body_path
+        self.meta = meta
+
+    @property
+    def body(self):
+        with open(self.body_path, 'rb') as body_file:
+            return body_file.read()
+
+    def chunks(self, size=64 * 1024):
+        """ The body a piece at a time, for parsing it without reading it all into memory. """
+        with open(self.body_path, 'rb') as body_file:
+            while True:
+                chunk = body_file.read(size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def is_fresh(self, ttl):
+        return time.time() - self.meta['fetched_at'] < ttl
+
+    def conditional_headers(self):
+        headers = {}
+        if self.meta.get('etag'):
+            headers['If-None-Match'] = self.meta['etag']
+        if self.meta.get('last_modified'):
+            headers['If-Modified-Since'] = self.meta['last_modified']
+        return headers
+
+
+def normalize_url(url):
+    """ The URL without its API key and with the query parameters in a fixed order. """
+    parts = parse.urlsplit(url.strip())
+    query = sorted((name, value) for name, value in parse.parse_qsl(parts.query) if name != 'apikey')
+    return parse.urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, parse.urlencode(query), ''))
+
+
+class ResponseCache:
+
+    def __init__(self, directory, ttl, max_bytes):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._evict_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self):
+        # Locks don't pickle. A cache sent to a worker process gets a lock of its own.
+        state = dict(self.__dict__)
+        del state['_evict_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._evict_lock = threading.Lock()
+
+    def _paths(self, url):
+        key = hashlib.sha256(normalize_url(url).encode()).hexdigest()
+        base = os.path.join(self.directory, key)
+        return base + '.body', base + '.json'
+
+    def get(self, url):
+        """ The cached entry for `url`, fresh or stale, or None. Counts as a use for LRU eviction. """
+        body_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path) as meta_file:
+                meta = json.load(meta_file)
+            os.utime(body_path)
+        except (OSError, ValueError):
+            return None
+        return CacheEntry(body_path, meta)
+
+    def store(self, url, body, headers):
+        self.store_chunks(url, [body], headers)
+
+    def store_chunks(self, url, chunks, headers):
+        """ Store a body that arrives in pieces, such as a streamed response, without holding all of it in memory. """
+        body_path, meta_path = self._paths(url)
+        meta = {
+            'url': normalize_url(url),
+            'fetched_at': time.time(),
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+        }
+        # Body before metadata, so a reader never finds metadata pointing at a missing or partial body
+        self._write(body_path, chunks)
+        self._write(meta_path, [json.dumps(meta).encode()])
+        self.evict(keep=body_path)
+
+    def revalidated(self, url, entry, headers):
+        """ The upstream said 304 Not Modified, so the entry is good for another `ttl` seconds. """
+        entry.meta['fetched_at'] = time.time()
+        entry.meta['etag'] = headers.get('ETag', entry.meta.get('etag'))
+        entry.meta['last_modified'] = headers.get('Last-Modified', entry.meta.get('last_modified'))
+        self._write(self._paths(url)[1], [json.dumps(entry.meta).encode()])
+
+    def _write(self, path, chunks):
+        # Write then rename, so concurrent readers see the old file or the new one, never half of one
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as temp_file:
+                for chunk in chunks:
+                    temp_file.write(chunk)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def evict(self, keep=None):
+        """ Remove least recently used entries until the bodies fit in `max_bytes`, sparing the body at `keep`. """
+        with self._evict_lock:
+            bodies = []
+            total = 0
+            for dir_entry in os.scandir(self.directory):
+                if dir_entry.name.endswith('.body'):
+                    stat = dir_entry.stat()
+                    bodies.append((stat.st_mtime, stat.st_size, dir_entry.path))
+                    total += stat.st_size
+
+            for last_used, size, body_path in sorted(bodies):
+                if total <= self.max_bytes:
+                    break
+                if body_path == keep:
+                    continue
+                for path in (body_path, body_path[:-len('.body')] + '.json'):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                total -= size
+
+
+def default_cache():
+    """ The cache configured in settings, or None if caching is turned off. """
+    if not settings.TICKETMASTER_CACHE_DIR:
+        return None
+    return ResponseCache(settings.TICKETMASTER_CACHE_DIR, settings.TICKETMASTER_CACHE_TTL, settings.TICKETMASTER_CACHE_MAX_BYTES)
@@ -0,0 +1,165 @@
+"""
+HTTP client for upstream APIs.
+
+One pooled requests.Session is shared per process, so calls reuse kept-alive
+connections instead of paying a TCP and TLS handshake each time. Every call
+has connect and read timeouts. Connection errors, timeouts, bodies cut off
+part way, 429 and 5xx responses are retried with exponential backoff and full
+jitter, waiting for Retry-After instead when the upstream sends it. Latency
+and bytes for every call, measured once the whole body has been read, are
+added to the client's metrics.
+"""
+
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+CHUNK_SIZE = 64 * 1024
+
+
+class ClientMetrics:
+    """ Running totals for the calls made through one client. Thread safe. """
+
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.slowest = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds, size):
+        with self._lock:
+            self.calls += 1
+            self.bytes += size
+            self.seconds += seconds
+            self.slowest = max(self.slowest, seconds)
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def __str__(self):
+        average = self.seconds / self.calls if self.calls else 0
+        return (f'{self.calls} calls, {self.retries} retries, {self.failures} failures, {self.bytes} bytes, '
+                f'{average * 1000:.0f}ms average, {self.slowest * 1000:.0f}ms slowest')
+
+
+def retry_after_seconds(response):
+    """ The Retry-After header as a number of seconds, or None. It can be a delay or an HTTP date. """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HttpClient:
+
+    def __init__(self, pool_size=10, connect_timeout=5, read_timeout=30, max_retries=4,
+                 backoff=0.5, max_backoff=30, rate_limiter=None):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rate_limiter = rate_limiter
+        self.metrics = ClientMetrics()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def backoff_seconds(self, attempt, response=None):
+        retry_after = retry_after_seconds(response) if response is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def get(self, url, headers=None, rate_limiter=None, body=None):
+        """
+        GET `url`, retrying transient failures. Returns the last response; raises if every attempt errored.
+        Each attempt waits on `rate_limiter`, or the client's own one. With `body`, a binary file, the
+        response body is written to it a chunk at a time instead of being held in memory, and the file is
+        left at its start. A body cut off part way is written again from the start by the next attempt.
+        """
+        rate_limiter = rate_limiter or self.rate_limiter
+        for attempt in range(self.max_retries + 1):
+            if rate_limiter:
+                rate_limiter.wait()
+
+            start = time.monotonic()
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout, stream=body is not None)
+                size = len(response.content) if body is None else self._read_into(response, body)
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                self.metrics.record(time.monotonic() - start, 0)
+                if attempt == self.max_retries:
+                    self.metrics.record_failure()
+                    raise
+                logging.warning(f'Retrying {url.split("?")[0]} after {e}')
+                self.metrics.record_retry()
+                time.sleep(self.backoff_seconds(attempt))
+                continue
+
+            self.metrics.record(time.monotonic() - start, size)
+            if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                if response.status_code >= 400:
+                    self.metrics.record_failure()
+                return response
+
+            logging.warning(f'Retrying {url.split("?")[0]} after status {response.status_code}')
+            response.close()
+            self.metrics.record_retry()
+            time.sleep(self.backoff_seconds(attempt, response))
+
+    def _read_into(self, response, body):
+        # Sizes are of the decoded body, as with response.content, not of what was sent compressed
+        body.seek(0)
+        body.truncate()
+        size = 0
+        try:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                body.write(chunk)
+                size += len(chunk)
+        finally:
+            response.close()
+        body.seek(0)
+        return size
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def default_client():
+    """ The process wide client for Ticketmaster, configured from settings. """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = HttpClient(
+                pool_size=settings.TICKETMASTER_POOL_SIZE,
+                connect_timeout=settings.TICKETMASTER_CONNECT_TIMEOUT,
+                read_timeout=settings.TICKETMASTER_READ_TIMEOUT,
+                max_retries=settings.TICKETMASTER_MAX_RETRIES,
+            )
+        return _default_client
@@ -0,0 +1,231 @@
+"""
+Crawls every page of a Discovery API search.
+
+The first page tells us how many pages there are, the rest are fetched
+concurrently by a small thread pool. All requests share one rate limiter so
+the crawl stays under the API quota no matter how many workers there are.
+Pages are yielded as soon as they arrive, so callers can ingest page by page.
+Requests go through the shared HTTP client, and through the on-disk cache
+when one is configured. The client reads each body into a cache file or a
+spooled temporary file, retrying the request if the body is cut off. In
+streaming mode pages are then parsed incrementally from that file, one item
+at a time.
+"""
+
+import datetime
+import json
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib import parse
+
+from django.conf import settings
+
+from ..ratelimit import RateLimiter
+from .cache import default_cache
+from .client import default_client
+from .stream import Page, StreamingPage
+
+
+CHUNK_SIZE = 64 * 1024
+SPOOL_SIZE = 1024 * 1024  # bodies bigger than this are spooled to disk rather than memory
+
+
+# The Discovery API refuses to page past the 1000th item (size * page < 1000).
+DEEP_PAGING_LIMIT = 1000
+# Bigger events searches are split into date windows: the first year, then the rest, each halved until it's
+# small enough. A window this short that's still too big is read as far as the limit allows.
+FIRST_WINDOW = datetime.timedelta(days=365)
+SMALLEST_WINDOW = datetime.timedelta(hours=1)
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def _parse_time(text):
+    return datetime.datetime.strptime(text, TIME_FORMAT).replace(tzinfo=datetime.timezone.utc)
+
+
+def _format_time(moment):
+    return moment.strftime(TIME_FORMAT)
+
+
+def _read_chunks(body):
+    while True:
+        chunk = body.read(CHUNK_SIZE)
+        if not chunk:
+            body.close()
+            return
+        yield chunk
+
+
+class Crawler:
+
+    def __init__(self, base_url=None, api_key=None, page_size=None, max_workers=None, per_second=None, cache=None, client=None, stream=None):
+        self.base_url = base_url or settings.TICKETMASTER_BASE_URL
+        self.api_key = api_key or settings.TICKETMASTER_KEY
+        self.page_size = page_size or settings.TICKETMASTER_PAGE_SIZE
+        self.max_workers = max_workers or settings.TICKETMASTER_MAX_WORKERS
+        self.limiter = RateLimiter(per_second or settings.TICKETMASTER_REQUESTS_PER_SECOND)
+        # pass cache=False to skip the cache configured in settings
+        self.cache = cache if cache is not None else default_cache()
+        self.client = client or default_client()
+        self.stream = settings.TICKETMASTER_STREAM_PAGES if stream is None else stream
+        self.truncated = []  # (search, total results) of searches cut off at DEEP_PAGING_LIMIT
+
+    def url(self, resource, query, page=None, size=None):
+        query = dict(query, size=size or self.page_size)
+        if page is not None:
+            query['page'] = page
+        query['apikey'] = self.api_key
+        return '{}{}.json?{}'.format(self.base_url, resource, parse.urlencode(query))
+
+    def fetch(self, url, resource):
+        """ The page at `url` as a Page, or a StreamingPage in streaming mode. """
+        entry = self.cache.get(url) if self.cache else None
+        if entry and entry.is_fresh(self.cache.ttl):
+            return self._cached_page(entry, resource)
+
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        try:
+            response = self.client.get(url, headers=entry.conditional_headers() if entry else None,
+                                       rate_limiter=self.limiter, body=body)
+            if entry and response.status_code == 304:
+                self.cache.revalidated(url, entry, response.headers)
+                return self._cached_page(entry, resource)
+
+            response.raise_for_status()
+            if self.cache:
+                self.cache.store_chunks(url, _read_chunks(body), response.headers)
+                return self._cached_page(self.cache.get(url), resource)
+            if self.stream:
+                page = StreamingPage(_read_chunks(body), resource)
+                body = None  # closed once the page has read it all
+                return page
+            return Page(json.load(body), resource)
+        finally:
+            if body is not None:
+                body.close()
+
+    def _cached_page(self, entry, resource):
+        if self.stream:
+            return StreamingPage(entry.chunks(CHUNK_SIZE), resource)
+        return Page(json.loads(entry.body), resource)
+
+    def pages(self, resource, query, start_page=0):
+        """
+        Yield every page of results for `resource` ('events', 'venues') from `start_page` on, as they arrive.
+        Read a page's items before its meta: in streaming mode the page metadata comes after them.
+        Events searches with more results than the API will page through are crawled a date window at a
+        time instead; those pages have `windowed` set, and their numbers start again in each window.
+        """
+        first = self.fetch(self.url(resource, query, page=start_page), resource)
+        yield first
+
+        page_info = first.meta.get('page')
+        if page_info is None:
+            # No page metadata, so the only way forward is to follow the next links one at a time.
+            yield from self._follow_next_links(first, resource)
+            return
+
+        if page_info.get('totalElements', 0) > DEEP_PAGING_LIMIT and resource == 'events':
+            # The first page was still worth reading, its events are in one of the windows too
+            # From the start of today rather than now, so reruns on the same day ask for the same windows
+            start = _parse_time(query['startDateTime']) if 'startDateTime' in query else \
+                datetime.datetime.now(datetime.timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+            end = _parse_time(query['endDateTime']) if 'endDateTime' in query else None
+            yield from self._windowed_pages(resource, query, start, end)
+            return
+
+        self._check_truncation(resource, query, page_info)
+        yield from self._numbered_pages(resource, query, start_page + 1, page_info)
+
+    def _numbered_pages(self, resource, query, first_page, page_info):
+        last_page = min(page_info.get('totalPages', 1), -(-DEEP_PAGING_LIMIT // self.page_size))
+        remaining = iter(range(first_page, last_page))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # Keep a bounded window of requests in flight rather than queueing every page up front
+            in_flight = set()
+            for page in remaining:
+                in_flight.add(executor.submit(self.fetch, self.url(resource, query, page=page), resource))
+                if len(in_flight) >= self.max_workers * 2:
+                    break
+
+            while in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+                    page = next(remaining, None)
+                    if page is not None:
+                        in_flight.add(executor.submit(self.fetch, self.url(resource, query, page=page), resource))
+
+    def _window(self, query, start, end):
+        window = dict(query, startDateTime=_format_time(start))
+        if end is not None:
+            window['endDateTime'] = _format_time(end)
+        return window
+
+    def _count(self, resource, window):
+        """ The page metadata of a search, asked for with a one item page. """
+        return self.fetch(self.url(resource, window, size=1), resource).meta.get('page', {})
+
+    def _windowed_pages(self, resource, query, start, end, page_info=None):
+        """
+        Pages of events from `start` to `end` (None for no end), in windows each small enough to page through.
+        Too big a window is split in two, unless that doesn't make either half smaller.
+        """
+        window = self._window(query, start, end)
+        page_info = page_info or self._count(resource, window)
+        total = page_info.get('totalElements', 0)
+        if not total:
+            return
+
+        if total > DEEP_PAGING_LIMIT:
+            if end is None:
+                middle = start + FIRST_WINDOW  # a year of events, then everything after it
+            elif end - start > SMALLEST_WINDOW:
+                middle = start + (end - start) / 2
+            else:
+                middle = None
+            if middle is not None:
+                # Both ends of a search are inclusive, so the second half starts a second later
+                middle = middle.replace(microsecond=0)
+                halves = [(start, middle), (middle + datetime.timedelta(seconds=1), end)]
+                counts = [self._count(resource, self._window(query, *half)) for half in halves]
+                if any(half_info.get('totalElements', 0) < total for half_info in counts):
+                    for half, half_info in zip(halves, counts):
+                        yield from self._windowed_pages(resource, query, *half, page_info=half_info)
+                    return
+
+        self._check_truncation(resource, window, page_info)
+        first = self.fetch(self.url(resource, window, page=0), resource)
+        first.windowed = True
+        yield first
+        for page in self._numbered_pages(resource, window, 1, first.meta.get('page', {})):
+            page.windowed = True
+            yield page
+
+    def _check_truncation(self, resource, query, page_info):
+        total = page_info.get('totalElements', 0)
+        if total > DEEP_PAGING_LIMIT:
+            label = ' '.join(f'{name}={value}' for name, value in sorted(query.items()))
+            logging.warning(f'Only the first {DEEP_PAGING_LIMIT} of {total} {resource} can be fetched for {label}')
+            self.truncated.append((f'{resource} {label}', total))
+
+    def _follow_next_links(self, page, resource):
+        while True:
+            next_href = page.meta.get('_links', {}).get('next', {}).get('href')
+            if not next_href:
+                return
+            url = parse.urljoin(self.base_url, next_href)
+            if 'apikey=' not in url:
+                url = '{}&apikey={}'.format(url, self.api_key)
+            page = self.fetch(url, resource)
+            yield page
+
+    def items(self, resource, query, start_page=0):
+        """
+        Yield the embedded items (events, venues) on each page, as a list or in streaming mode an iterator.
+        Streamed items must be read before asking for the next page.
+        """
+        for page in self.pages(resource, query, start_page):
+            yield page.items
@@ -0,0 +1,128 @@
+""" A local stand-in for the Ticketmaster Discovery API, serving recorded pages over HTTP, for tests and benchmarks. """
+
+import hashlib
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib import parse
+
+
+def make_pages(resource, items, page_size):
+    """ Split a list of items into Discovery API style pages, keyed by (resource, page number). """
+    total_pages = max(1, -(-len(items) // page_size))
+    pages = {}
+    for number in range(total_pages):
+        page_items = items[number * page_size:(number + 1) * page_size]
+        pages[(resource, number)] = {
+            '_embedded': {resource: page_items},
+            'page': {'size': page_size, 'totalElements': len(items), 'totalPages': total_pages, 'number': number},
+        }
+    return pages
+
+
+def search_page(resource, items, query):
+    """
+    The page of `items` a search with `query` would get: events between startDateTime and endDateTime, at the
+    requested size and page. Like the real API, it refuses to page past the 1000th result.
+    """
+    start, end = query.get('startDateTime'), query.get('endDateTime')
+    found = [item for item in items if (not start or item['dates']['start']['dateTime'] >= start)
+             and (not end or item['dates']['start']['dateTime'] <= end)]
+    size, number = int(query.get('size', 20)), int(query.get('page', 0))
+    if size * number >= 1000:
+        return None
+    return {
+        '_embedded': {resource: found[number * size:(number + 1) * size]},
+        'page': {'size': size, 'totalElements': len(found), 'totalPages': max(1, -(-len(found) // size)), 'number': number},
+    }
+
+
+class StubTicketmaster:
+    """
+    Serves `pages`, a dict of (resource, page number) -> JSON payload, made by make_pages or loaded
+    from a recording of the real API with lmn.ticketmaster.recording.load.
+    Use as a context manager, point the crawler at `base_url`, and check `requests` afterwards.
+    Pages carry an ETag, and a matching If-None-Match gets a 304.
+    Resources in `searches`, a dict of resource -> items, are searched with search_page instead.
+    """
+
+    def __init__(self, pages, searches=None):
+        self.pages = pages
+        self.searches = searches or {}
+        self.requests = []
+        self.not_modified = 0
+        self.failures = []  # (status, headers) to answer the next requests with, before serving pages again
+        self.rejected = {}  # query parameter -> value that gets a 400, such as {'dmaId': '999'}
+        self.chunked = False  # send bodies with Transfer-Encoding: chunked, and no Content-Length
+        self.cut_off = 0  # how many of the next bodies to stop sending half way through
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                url = parse.urlparse(self.path)
+                query = dict(parse.parse_qsl(url.query))
+                stub.requests.append((url.path, query))
+                if stub.failures:
+                    status, headers = stub.failures.pop(0)
+                    self.send_response(status)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.end_headers()
+                    return
+                if any(query.get(name) == value for name, value in stub.rejected.items()):
+                    self.send_error(400)
+                    return
+                resource = url.path.rsplit('/', 1)[-1].replace('.json', '')
+                if resource in stub.searches:
+                    payload = search_page(resource, stub.searches[resource], query)
+                else:
+                    payload = stub.pages.get((resource, int(query.get('page', 0))))
+                if payload is None:
+                    self.send_error(404)
+                    return
+                body = json.dumps(payload).encode()
+                etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+                if self.headers.get('If-None-Match') == etag:
+                    stub.not_modified += 1
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                if stub.chunked or stub.cut_off:
+                    self.send_chunked(body, etag)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_chunked(self, body, etag):
+                self.protocol_version = 'HTTP/1.1'  # chunked encoding is HTTP/1.1
+                self.close_connection = True
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('ETag', etag)
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for piece in (body[:len(body) // 2], body[len(body) // 2:]):
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(piece), piece))
+                    if stub.cut_off:
+                        stub.cut_off -= 1
+                        return
+                self.wfile.write(b'0\r\n\r\n')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = 'http://127.0.0.1:{}/discovery/v2/'.format(self.server.server_address[1])
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,260 @@
+"""
+Set-based ingestion of Ticketmaster payloads.
+
+Upstream JSON is first normalized into plain tuples (no database access), then
+each batch is diffed against the existing rows with a few IN queries. New rows
+are written with bulk_create and changed rows with bulk_update, so a sync costs
+a handful of statements instead of one INSERT (and a failed INSERT for every
+known entity) per record.
+
+Every row from upstream stores a fingerprint (a short hash) of the fields it
+took from its record. When a record's fingerprint matches the stored one the
+row is counted as unchanged and not written at all, which is most rows on most
+syncs. An artist is only a name, so a known artist is always unchanged.
+"""
+
+import logging
+import time
+
+from django.db import transaction
+
+from ..caching import bump_now_and_on_commit
+from ..models import Artist, Venue, Show
+from .crawler import DEEP_PAGING_LIMIT
+from .normalize import normalize_events, normalize_artists, normalize_venues, normalize_shows
+
+
+BATCH_SIZE = 500
+
+
+class SyncReport:
+    """ Rows inserted, updated, unchanged (same fingerprint) and skipped per model, plus timings. """
+
+    def __init__(self):
+        self.counts = {}
+        self.timings = {}
+        self.failures = {}
+        self.truncated = {}
+
+    def add(self, kind, inserted=0, updated=0, unchanged=0, skipped=0):
+        counts = self.counts.setdefault(kind, {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0})
+        counts['inserted'] += inserted
+        counts['updated'] += updated
+        counts['unchanged'] += unchanged
+        counts['skipped'] += skipped
+
+    def time(self, label, seconds):
+        self.timings[label] = self.timings.get(label, 0) + seconds
+
+    def fail(self, label, error):
+        self.failures[label] = error
+
+    def truncate(self, search, total):
+        """ Record a search with more results than the API would page through, so some weren't fetched. """
+        self.truncated[search] = total
+
+    def total(self, column):
+        return sum(counts[column] for counts in self.counts.values())
+
+    def __str__(self):
+        lines = []
+        for kind, counts in self.counts.items():
+            lines.append(f'{kind}: {counts["inserted"]} inserted, {counts["updated"]} updated, '
+                         f'{counts["unchanged"]} unchanged, {counts["skipped"]} skipped')
+        for label, seconds in self.timings.items():
+            lines.append(f'{label}: {seconds:.2f}s')
+        for label, error in self.failures.items():
+            lines.append(f'{label} failed: {error}')
+        for search, total in self.truncated.items():
+            lines.append(f'{search} truncated: {total} results, only the first {DEEP_PAGING_LIMIT} fetched')
+        return '\n'.join(lines)
+
+
+# Writing. Each function takes normalized records and diffs them against the database.
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def write_artists(records, report, batch_size=BATCH_SIZE):
+    inserted = unchanged = 0
+    for chunk in _chunks(list(records), batch_size):
+        existing = set(Artist.objects.filter(name__in=[name for name, fingerprint in chunk]).values_list('name', flat=True))
+        new_artists = [Artist(name=name, fingerprint=fingerprint) for name, fingerprint in chunk if name not in existing]
+        Artist.objects.bulk_create(new_artists, batch_size=batch_size, ignore_conflicts=True)
+        inserted += len(new_artists)
+        unchanged += len(chunk) - len(new_artists)
+    if inserted:
+        bump_now_and_on_commit([Artist._meta.db_table])  # bulk_create sends no post_save
+    report.add('artists', inserted=inserted, unchanged=unchanged)
+
+
+def write_venues(records, report, batch_size=BATCH_SIZE):
+    inserted = updated = unchanged = 0
+    for chunk in _chunks(list(records), batch_size):
+        existing = Venue.objects.in_bulk([record[0] for record in chunk], field_name='name')
+        new_venues = []
+        changed_venues = []
+        for name, city, state, fingerprint in chunk:
+            venue = existing.get(name)
+            if venue is None:
+                new_venues.append(Venue(name=name, city=city, state=state, fingerprint=fingerprint))
+            elif venue.fingerprint != fingerprint:
+                venue.city, venue.state, venue.fingerprint = city, state, fingerprint
+                changed_venues.append(venue)
+            else:
+                unchanged += 1
+        Venue.objects.bulk_create(new_venues, batch_size=batch_size, ignore_conflicts=True)
+        Venue.objects.bulk_update(changed_venues, ['city', 'state', 'fingerprint'], batch_size=batch_size)
+        inserted += len(new_venues)
+        updated += len(changed_venues)
+    if inserted or updated:
+        bump_now_and_on_commit([Venue._meta.db_table])  # bulk_create and bulk_update send no post_save
+    report.add('venues', inserted=inserted, updated=updated, unchanged=unchanged)
+
+
+class NameResolver:
+    """
+    Name to primary key lookups for Artist or Venue, kept in a dict.
+    Names are loaded with one IN query per batch, and names the database doesn't have yet are created in bulk.
+    """
+
+    def __init__(self, model, batch_size=BATCH_SIZE):
+        self.model = model
+        self.batch_size = batch_size
+        self.pks = {}
+
+    def resolve(self, names):
+        """ Make sure every name in `names` (a dict of name to the fields to create it with) has a pk. Returns how many were created. """
+        unknown = [name for name in names if name not in self.pks]
+        if not unknown:
+            return 0
+        self.pks.update(self.model.objects.filter(name__in=unknown).values_list('name', 'pk'))
+
+        missing = [self.model(name=name, **names[name]) for name in unknown if name not in self.pks]
+        if missing:
+            # ignore_conflicts means the new pks aren't set on the objects, so read them back
+            self.model.objects.bulk_create(missing, batch_size=self.batch_size, ignore_conflicts=True)
+            self.pks.update(self.model.objects.filter(name__in=[obj.name for obj in missing]).values_list('name', 'pk'))
+            bump_now_and_on_commit([self.model._meta.db_table])
+        return len(missing)
+
+    def __getitem__(self, name):
+        return self.pks[name]
+
+
+def write_shows(records, report, batch_size=BATCH_SIZE):
+    """
+    Upsert shows. A record matches an existing show by Ticketmaster event id first, then by
+    the (artist, venue, show_date) natural key. Matched shows are only written if the event changed.
+    """
+    artists = NameResolver(Artist, batch_size)
+    venues = NameResolver(Venue, batch_size)
+    inserted = updated = unchanged = skipped = 0
+
+    for chunk in _chunks(list(records), batch_size):
+        new_artists = artists.resolve({record.artist_name: {} for record in chunk})
+        new_venues = venues.resolve({record.venue_name: {'city': record.venue_city, 'state': record.venue_state} for record in chunk})
+        report.add('artists', inserted=new_artists)
+        report.add('venues', inserted=new_venues)
+
+        # One entry per upstream event; the last one wins if the payload repeats an event
+        wanted = {}
+        for record in chunk:
+            key = (artists[record.artist_name], venues[record.venue_name], record.show_date)
+            wanted[record.ticketmaster_id or key] = (key, record.ticketmaster_id, record.fingerprint)
+        wanted = list(wanted.values())
+
+        by_id = Show.objects.in_bulk([tm_id for key, tm_id, fingerprint in wanted if tm_id], field_name='ticketmaster_id')
+        by_key = {(show.artist_id, show.venue_id, show.show_date): show for show in Show.objects.filter(
+            artist_id__in={key[0] for key, tm_id, fingerprint in wanted},
+            venue_id__in={key[1] for key, tm_id, fingerprint in wanted},
+            show_date__in={key[2] for key, tm_id, fingerprint in wanted},
+        )}
+
+        new_shows = []
+        changed_shows = []
+        stale = set()  # versions of cached pages showing these shows, see caching.py
+        claimed = set()  # natural keys already taken by a row in this chunk
+        for key, tm_id, fingerprint in wanted:
+            show = by_id.get(tm_id) or by_key.get(key)
+
+            if show is None:
+                if key in claimed:
+                    skipped += 1
+                    continue
+                artist_pk, venue_pk, show_date = key
+                new_shows.append(Show(artist_id=artist_pk, venue_id=venue_pk, show_date=show_date,
+                                      ticketmaster_id=tm_id, fingerprint=fingerprint))
+                stale.update([f'venue:{venue_pk}', 'lmn_show'])
+                claimed.add(key)
+                continue
+
+            if show.fingerprint == fingerprint:
+                unchanged += 1
+                continue
+
+            current_key = (show.artist_id, show.venue_id, show.show_date)
+            same_id = not tm_id or show.ticketmaster_id == tm_id
+            if current_key != key and (key in by_key or key in claimed):
+                # The event moved onto a show we already have. Leave both alone rather than break the natural key.
+                logging.warning(f'Skipping event {tm_id}, another show already has artist, venue and date {key}')
+                skipped += 1
+                continue
+            if not same_id and show.ticketmaster_id:
+                # Two upstream events for the same show. The first one keeps it.
+                skipped += 1
+                continue
+
+            if current_key != key:
+                stale.update(['notes', 'lmn_show', f'show:{show.pk}', f'venue:{show.venue_id}', f'venue:{key[1]}'])
+            show.artist_id, show.venue_id, show.show_date = key
+            show.ticketmaster_id = tm_id or show.ticketmaster_id
+            show.fingerprint = fingerprint
+            changed_shows.append(show)
+            claimed.add(key)
+
+        Show.objects.bulk_create(new_shows, batch_size=batch_size, ignore_conflicts=True)
+        Show.objects.bulk_update(changed_shows, ['artist', 'venue', 'show_date', 'ticketmaster_id', 'fingerprint'], batch_size=batch_size)
+        bump_now_and_on_commit(stale)  # bulk writes send no signals
+        inserted += len(new_shows)
+        updated += len(changed_shows)
+    report.add('shows', inserted=inserted, updated=updated, unchanged=unchanged, skipped=skipped)
+
+
+# Combined entry points used by the views.
+
+def _timed(report, label, function, *args):
+    start = time.monotonic()
+    with transaction.atomic():
+        function(*args)
+    report.time(label, time.monotonic() - start)
+
+
+def ingest_artists(events, report=None):
+    report = report or SyncReport()
+    _timed(report, 'artists', write_artists, normalize_artists(events), report)
+    return report
+
+
+def ingest_venues(venues, report=None):
+    report = report or SyncReport()
+    _timed(report, 'venues', write_venues, normalize_venues(venues), report)
+    return report
+
+
+def ingest_shows(events, report=None):
+    report = report or SyncReport()
+    _timed(report, 'shows', write_shows, normalize_shows(events), report)
+    return report
+
+
+def ingest_events(events, report=None):
+    """ Artists and shows from the same events, reading `events` only once. """
+    report = report or SyncReport()
+    artists, shows = normalize_events(events)
+    # Artists first, so every show can find its artist
+    _timed(report, 'artists', write_artists, artists, report)
+    _timed(report, 'shows', write_shows, shows, report)
+    return report
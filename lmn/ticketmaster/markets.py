@@ -0,0 +1,73 @@
+"""
+Markets, and crawling them in worker processes.
+
+Each market in settings.TICKETMASTER_MARKETS is a shard: its events are
+searched by DMA (designated market area) and its venues by state. A shard is
+crawled and normalized by crawl_market in a worker process, which never
+touches the database and sends back plain records. The parent process writes
+what each worker returns, one shard at a time, so shards never contend for
+rows. Nothing here imports the models, so workers don't need Django set up.
+"""
+
+import time
+from collections import namedtuple
+
+from django.conf import settings
+
+from .cache import default_cache
+from .crawler import Crawler
+from .normalize import normalize_events, normalize_venues
+
+
+ShardResult = namedtuple('ShardResult', ['market', 'venues', 'artists', 'shows', 'requests', 'seconds', 'truncated'])
+
+
+def markets():
+    """ The configured markets, each a dict with a name, a dmaId and a stateCode. """
+    return settings.TICKETMASTER_MARKETS
+
+
+def event_query(market):
+    # https://developer.ticketmaster.com/products-and-docs/apis/discovery-api/v2/#supported-dma
+    return {'classificationName': 'music', 'dmaId': market['dmaId']}
+
+
+def venue_query(market):
+    return {'classificationName': 'music', 'stateCode': market['stateCode']}
+
+
+def crawler_options(processes):
+    """
+    Crawler arguments for a worker, taken from this process's settings.
+    The request quota is per API key, so it's split between the workers.
+    """
+    return {
+        'base_url': settings.TICKETMASTER_BASE_URL,
+        'api_key': settings.TICKETMASTER_KEY,
+        'page_size': settings.TICKETMASTER_PAGE_SIZE,
+        'max_workers': settings.TICKETMASTER_MAX_WORKERS,
+        'per_second': settings.TICKETMASTER_REQUESTS_PER_SECOND / processes,
+        'cache': default_cache() or False,
+        'stream': settings.TICKETMASTER_STREAM_PAGES,
+    }
+
+
+def crawl_market(market, options):
+    """ Crawl and normalize one market's venues and events. Runs in a worker process. """
+    start = time.monotonic()
+    crawler = Crawler(**options)
+    requests_before = crawler.client.metrics.calls
+
+    venues = {}
+    for items in crawler.items('venues', venue_query(market)):
+        venues.update((record[0], record) for record in normalize_venues(items))
+
+    artists = {}
+    shows = []
+    for items in crawler.items('events', event_query(market)):
+        page_artists, page_shows = normalize_events(items)
+        artists.update((record[0], record) for record in page_artists)
+        shows.extend(page_shows)
+
+    return ShardResult(market['name'], list(venues.values()), list(artists.values()), shows,
+                       crawler.client.metrics.calls - requests_before, time.monotonic() - start, crawler.truncated)
@@ -0,0 +1,91 @@
+"""
+Normalizing Ticketmaster payloads into plain tuples.
+
+These functions only read the upstream JSON and never touch the database, and
+nothing here imports the models, so they can run in a worker process that has
+not set Django up. Records are tuples of strings and datetimes, so they pickle.
+"""
+
+import hashlib
+import json
+import logging
+from collections import namedtuple
+
+from django.utils.dateparse import parse_datetime
+
+
+ShowRecord = namedtuple('ShowRecord', ['ticketmaster_id', 'artist_name', 'venue_name', 'venue_city', 'venue_state', 'show_date', 'fingerprint'])
+
+
+def fingerprint_of(*fields):
+    """
+    A short hash of the `fields` we store from an upstream record. Only these, not the whole record, so
+    churn in things we never store (prices, sales dates, images, links) doesn't count as a change.
+    """
+    canonical = json.dumps(fields, separators=(',', ':'), default=str)
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+
+def _artist_records(event):
+    # attractions are artists
+    for attraction in event.get('_embedded', {}).get('attractions', []):
+        name = attraction.get('name')
+        if name:
+            yield name, fingerprint_of(name)
+
+
+def _show_record(event):
+    try:
+        # todo: there is a many to many relationship that needs to be fixed.
+        # a show can have many artists and an artist can have many shows.
+        artist_name = event['_embedded']['attractions'][0]['name']
+        venue = event['_embedded']['venues'][0]
+        venue_name = venue['name']
+        show_date = parse_datetime(event['dates']['start']['dateTime'])
+    except (KeyError, IndexError, TypeError, ValueError):
+        logging.warning(f'Skipping event without artist, venue or start time: {event.get("id")}')
+        return None
+    if show_date is None:
+        return None
+    venue_city = venue.get('city', {}).get('name', '')
+    venue_state = venue.get('state', {}).get('stateCode', '')
+    return ShowRecord(event.get('id'), artist_name, venue_name, venue_city, venue_state, show_date,
+                      fingerprint_of(event.get('id'), artist_name, venue_name, show_date))
+
+
+def normalize_events(events):
+    """
+    Artist records and show records from one pass over `events`, which can be a one-shot iterator.
+    Artists are (name, fingerprint) without duplicate names. The last one wins if a name repeats.
+    """
+    artists = {}
+    shows = []
+    for event in events:
+        for name, fingerprint in _artist_records(event):
+            artists[name] = (name, fingerprint)
+        record = _show_record(event)
+        if record:
+            shows.append(record)
+    return list(artists.values()), shows
+
+
+def normalize_artists(events):
+    """ (name, fingerprint) for the attractions of each event, in order, without duplicate names. """
+    return normalize_events(events)[0]
+
+
+def normalize_venues(venues):
+    """ (name, city, state, fingerprint) for each venue, the last one wins if a name repeats. """
+    records = {}
+    for venue in venues:
+        try:
+            name, city, state = venue['name'], venue['city']['name'], venue['state']['stateCode']
+            records[name] = (name, city, state, fingerprint_of(name, city, state))
+        except (KeyError, TypeError):
+            logging.warning(f'Skipping venue without name, city or state: {venue.get("id")}')
+    return list(records.values())
+
+
+def normalize_shows(events):
+    """ A ShowRecord for each event. The venue's city and state come along in case the venue is new to us. """
+    return normalize_events(events)[1]
@@ -0,0 +1,70 @@
+"""
+Recordings of Discovery API responses, for replaying offline.
+
+A recording is a directory holding each page exactly as the API returned it,
+one JSON file per page at <resource>/<page number>.json. The record_ticketmaster
+command makes one from the live API. Tests and benchmarks replay it with the
+stub server in fakes.py, so they see real payloads
+without a network or an API key.
+
+A search big enough to be crawled in date windows (see crawler.py) numbers its
+pages from 0 again in every window, so its pages are numbered in the order they
+arrived instead. Their page metadata is still as the API returned it.
+"""
+
+import json
+import os
+import re
+
+from .crawler import Crawler
+
+
+def _scrub(data):
+    # Pages link to other pages. Keep API keys out of anything written to disk.
+    text = json.dumps(data, indent=1, sort_keys=True)
+    return re.sub(r'([?&])apikey=[^&"]*&?', r'\1', text)
+
+
+def save_page(directory, resource, number, data):
+    os.makedirs(os.path.join(directory, resource), exist_ok=True)
+    with open(os.path.join(directory, resource, f'{number}.json'), 'w') as page_file:
+        page_file.write(_scrub(data))
+
+
+def record(directory, resource, query, crawler=None):
+    """ Save every page of `resource` matching `query` to the recording in `directory`. Returns the number of items saved. """
+    crawler = crawler or Crawler(cache=False, stream=False)
+    count = 0
+    windowed = 0  # pages saved from date windows, which are named in the order they arrived
+    pages = crawler.pages(resource, query)
+    # The first page is only saved once it's known the search wasn't split into date windows,
+    # since the first window holds its items again
+    first = next(pages, None)
+    for number, page in enumerate(pages, 1):
+        if getattr(page, 'windowed', False):
+            first = None
+            name = windowed
+            windowed += 1
+        else:
+            name = page.meta.get('page', {}).get('number', number)
+        save_page(directory, resource, name, page.meta)
+        count += len(page.items)
+    if first is not None:
+        save_page(directory, resource, first.meta.get('page', {}).get('number', 0), first.meta)
+        count += len(first.items)
+    return count
+
+
+def load(directory):
+    """ The pages in a recording, as a dict of (resource, page number) -> page. """
+    pages = {}
+    for resource in sorted(os.listdir(directory)):
+        resource_dir = os.path.join(directory, resource)
+        if not os.path.isdir(resource_dir):
+            continue
+        for filename in os.listdir(resource_dir):
+            number, extension = os.path.splitext(filename)
+            if extension == '.json' and number.isdigit():
+                with open(os.path.join(resource_dir, filename)) as page_file:
+                    pages[(resource, int(number))] = json.load(page_file)
+    return pages
@@ -0,0 +1,134 @@
+"""
+Incremental parsing of Discovery API pages.
+
+A page looks like {"_embedded": {"events": [...]}, "_links": {...}, "page": {...}}.
+StreamingPage reads it from an iterable of byte chunks and yields the items
+of the embedded list one at a time, so only one item is ever held as Python
+objects. Everything else on the page (links, page numbers) is small and kept
+in `meta`, which is complete once the items have been read.
+"""
+
+import codecs
+import json
+
+
+class Page:
+    """ A page that has already been parsed. `items` is the embedded list, `meta` is the whole page. """
+
+    def __init__(self, data, resource):
+        self.meta = data
+        self.items = data.get('_embedded', {}).get(resource, [])
+
+
+class StreamingPage:
+
+    def __init__(self, chunks, resource):
+        self.resource = resource
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._meta = {}
+        self.items = self._items()
+
+    @property
+    def meta(self):
+        """ The page without its items. Reads (and discards) any items that haven't been read yet. """
+        for item in self.items:
+            pass
+        return self._meta
+
+    # Reading the buffer
+
+    def _more(self):
+        """ Append the next chunk to the buffer. False at the end of the stream. """
+        for chunk in self._chunks:
+            text = self._decoder.decode(chunk)
+            if text:
+                # Drop what has been parsed already, so the buffer never holds more than about one item
+                self._buffer = self._buffer[self._pos:] + text
+                self._pos = 0
+                return True
+        text = self._decoder.decode(b'', final=True)
+        if text:
+            self._buffer = self._buffer[self._pos:] + text
+            self._pos = 0
+            return True
+        return False
+
+    def _peek(self):
+        """ The next character that isn't whitespace, without consuming it. """
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in ' \t\r\n':
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._more():
+                raise ValueError('Unexpected end of page')
+
+    def _expect(self, char):
+        found = self._peek()
+        if found != char:
+            raise ValueError(f'Expected {char!r} at {self._pos}, found {found!r}')
+        self._pos += 1
+
+    def _value(self):
+        """ Decode one complete JSON value, reading more of the stream until it's all there. """
+        self._peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if not self._more():
+                    raise
+                continue
+            # A number at the very end of the buffer might continue in the next chunk
+            if end == len(self._buffer) and isinstance(value, (int, float)) and self._more():
+                continue
+            self._pos = end
+            return value
+
+    def _members(self):
+        """ Yield the keys of the object being read; the caller must consume each value. """
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            yield key
+            if self._peek() == ',':
+                self._pos += 1
+                continue
+            self._expect('}')
+            return
+
+    def _array(self):
+        """ Yield each element of the array being read. """
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            if self._peek() == ',':
+                self._pos += 1
+                continue
+            self._expect(']')
+            return
+
+    # Walking the page
+
+    def _items(self):
+        for key in self._members():
+            if key != '_embedded':
+                self._meta[key] = self._value()
+                continue
+            embedded = self._meta.setdefault('_embedded', {})
+            for embedded_key in self._members():
+                if embedded_key != self.resource:
+                    embedded[embedded_key] = self._value()
+                    continue
+                yield from self._array()
@@ -0,0 +1,133 @@
+"""
+Checkpointed syncs, run by the sync_ticketmaster management command.
+
+Each resource has a SyncCheckpoint row. While a run is in progress the row
+records the first page that has not been ingested yet, so a run that dies
+part way through picks up from there next time. Once a run completes, its
+start time becomes the checkpoint's last_updated.
+
+The API has no "updated since" filter, so every run asks for every upcoming
+event, with the same query each time. That lets the response cache serve or
+revalidate pages from earlier runs, and the fingerprints skip writing rows
+whose records haven't changed (see ingest.py).
+
+With several markets, sync_markets crawls each one in a worker process and
+writes the results here as each market finishes. A market is then written
+all at once, so its checkpoint only records whether it completed.
+"""
+
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import SyncCheckpoint
+from .crawler import Crawler
+from .ingest import SyncReport, ingest_events, ingest_venues, write_artists, write_shows, write_venues
+from .markets import crawl_market, crawler_options
+
+
+def checkpoint_name(resource, market):
+    return f'{resource}:{market["name"]}'
+
+
+def ingest_event_page(events, report):
+    ingest_events(events, report)
+
+
+def ingest_venue_page(venues, report):
+    ingest_venues(venues, report)
+
+
+def start_or_resume(name, full=False):
+    """ The checkpoint for `name`, reset for a new run unless the previous run needs resuming. """
+    checkpoint, created = SyncCheckpoint.objects.get_or_create(name=name)
+    if full or checkpoint.completed or created:
+        checkpoint.next_page = 0
+        checkpoint.run_started = timezone.now()
+        checkpoint.completed = False
+        checkpoint.save()
+    return checkpoint
+
+
+def sync_resource(name, resource, query, ingest_page, report=None, full=False, crawler=None):
+    """ Crawl `resource` with `query` and hand each page of items to `ingest_page`, checkpointing as pages land. """
+    report = report or SyncReport()
+    crawler = crawler or Crawler()
+    checkpoint = start_or_resume(name, full)
+
+    # Pages can arrive out of order, so the checkpoint only moves past pages that are done with no gaps before them
+    done = set()
+    sequential_page = checkpoint.next_page
+    start = time.monotonic()
+
+    for page in crawler.pages(resource, query, start_page=checkpoint.next_page):
+        ingest_page(page.items, report)
+        if getattr(page, 'windowed', False):
+            # Numbered within a date window, so not a page to resume from. An interrupted windowed
+            # crawl starts its windows again, from the response cache when there is one.
+            continue
+        number = page.meta.get('page', {}).get('number', sequential_page)
+        sequential_page += 1
+
+        done.add(number)
+        while checkpoint.next_page in done:
+            checkpoint.next_page += 1
+        checkpoint.save(update_fields=['next_page'])
+
+    for search, total in crawler.truncated:
+        report.truncate(search, total)
+    checkpoint.completed = True
+    checkpoint.last_updated = checkpoint.run_started
+    checkpoint.save(update_fields=['completed', 'last_updated'])
+    report.time(f'{name} crawl', time.monotonic() - start)
+    return report
+
+
+def write_shard(shard, report):
+    """ Write one market's records. Venues first, so shows find their venue, then artists, then shows. """
+    start = time.monotonic()
+    with transaction.atomic():
+        write_venues(shard.venues, report)
+        write_artists(shard.artists, report)
+        write_shows(shard.shows, report)
+    report.time(f'{shard.market} write', time.monotonic() - start)
+
+
+def sync_markets(markets, report=None, full=False, processes=None):
+    """
+    Crawl each market in a worker process, and write each one here as it comes back, so only this
+    process writes. A market that fails is logged and reported, and the others carry on.
+    """
+    report = report or SyncReport()
+    processes = min(processes or settings.TICKETMASTER_SHARD_PROCESSES, len(markets))
+    options = crawler_options(processes)
+    checkpoints = {market['name']: start_or_resume(checkpoint_name('events', market), full) for market in markets}
+
+    # spawn rather than fork, so workers don't inherit this process's database connections
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {pool.submit(crawl_market, market, options): market['name']
+                   for market in markets}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                shard = future.result()
+                logging.info(f'Market {name}: {shard.requests} requests in {shard.seconds:.2f}s')
+                report.time(f'{name} crawl', shard.seconds)
+                for search, total in shard.truncated:
+                    report.truncate(search, total)
+                write_shard(shard, report)
+            except Exception as e:
+                logging.exception(f'Sync of market {name} failed')
+                report.fail(name, e)
+                continue
+
+            checkpoint = checkpoints[name]
+            checkpoint.completed = True
+            checkpoint.last_updated = checkpoint.run_started
+            checkpoint.save(update_fields=['completed', 'last_updated'])
+    return report
@@ -0,0 +1,67 @@
+"""
+Trigram similarity, the same way Postgres' pg_trgm works it out, for databases without pg_trgm.
+
+A string's trigrams are the three letter runs of each of its words, lowercased and
+padded with two spaces in front and one behind, so "REM" has "  r", " re", "rem" and
+"em ". Two strings' similarity is the trigrams they share over all the trigrams either
+has: 1 for the same words, 0 for nothing in common, and in between a misspelling
+("Metalica") scores well against the real thing ("Metallica").
+
+TrigramIndex holds every name of a table in memory, as lists of the rows each trigram
+appears in, so a search only looks at rows sharing at least one trigram with the query.
+"""
+
+import re
+from array import array
+from collections import Counter
+
+
+def trigrams(text):
+    found = set()
+    for word in re.findall(r'[^\W_]+', (text or '').lower()):
+        padded = f'  {word} '
+        found.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return found
+
+
+def similarity(a, b):
+    a, b = trigrams(a), trigrams(b)
+    if not a or not b:
+        return 0.0
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
+
+
+class TrigramIndex:
+    """ Inverted trigram index over (pk, text) rows. """
+
+    def __init__(self, rows):
+        self.postings = {}
+        self.sizes = {}
+        for pk, text in rows:
+            row_trigrams = trigrams(text)
+            self.sizes[pk] = len(row_trigrams)
+            for trigram in row_trigrams:
+                posting = self.postings.get(trigram)
+                if posting is None:
+                    posting = self.postings[trigram] = array('q')
+                posting.append(pk)
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def search(self, text, threshold, limit=None):
+        """ [(similarity, pk)] of rows at least `threshold` similar to `text`, most similar first. """
+        query = trigrams(text)
+        if not query:
+            return []
+        shared = Counter()
+        for trigram in query:
+            shared.update(self.postings.get(trigram, ()))
+        matches = []
+        for pk, count in shared.items():
+            score = count / (len(query) + self.sizes[pk] - count)
+            if score >= threshold:
+                matches.append((score, pk))
+        matches.sort(key=lambda match: (-match[0], match[1]))
+        return matches[:limit] if limit else matches
@@ -8,7 +8,8 @@ from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login, logout
 
 from django.utils import timezone
-from django.core.paginator import Paginator
+from ..pagination import paginate
+from ..search import search, similar
 
 
 def venues_for_artist(request, artist_pk):   # pk = artist_pk
@@ -18,9 +19,7 @@ def venues_for_artist(request, artist_pk):   # pk = artist_pk
     shows = Show.objects.filter(artist=artist_pk).order_by('-show_date')  # most recent first
     artist = Artist.objects.get(pk=artist_pk)
     
-    paginator = Paginator(shows, 25)
-    page_number = request.GET.get('page')
-    page_object = paginator.get_page(page_number)
+    page_object = paginate(request, shows)
 
     return render(request, 'lmn/venues/venue_list_for_artist.html', { 'artist': artist, 'shows': page_object })
 
@@ -28,17 +27,20 @@ def venues_for_artist(request, artist_pk):   # pk = artist_pk
 def artist_list(request):
     form = ArtistSearchForm()
     search_name = request.GET.get('search_name')
+    similar_names = False
     
     if search_name:
-        artists = Artist.objects.filter(name__icontains=search_name).order_by('name')
+        artists = search(Artist.objects.all(), search_name)
+        if not artists.exists():
+            # Nothing starts with those words, maybe they're misspelled
+            artists = similar(Artist.objects.all(), search_name)
+            similar_names = True
     else:
         artists = Artist.objects.all().order_by('name')
         
-    paginator = Paginator(artists, 25)
-    page_number = request.GET.get('page')
-    page_object = paginator.get_page(page_number)
+    page_object = paginate(request, artists)
 
-    return render(request, 'lmn/artists/artist_list.html', { 'artists': page_object, 'form': form, 'search_term': search_name })
+    return render(request, 'lmn/artists/artist_list.html', { 'artists': page_object, 'form': form, 'search_term': search_name, 'similar_names': similar_names })
 
 
 def artist_detail(request, artist_pk):
@@ -8,6 +8,13 @@ from django.contrib.auth import authenticate, login, logout
 from django.http import HttpResponseForbidden
 from django.contrib import messages
 from django.core.paginator import Paginator
+from django.core.cache import cache
+from django.conf import settings
+
+from .. import photos
+from ..caching import cached_page, versioned_key
+from ..pagination import paginate
+from ..search import search
 
 
 @login_required
@@ -22,6 +29,8 @@ def new_note(request, show_pk):
             note.user = request.user
             note.show = show
             note.save()
+            if 'photo' in request.FILES:
+                photos.make_renditions(note)
             return redirect('note_detail', note_pk=note.pk)
 
     else :
@@ -30,30 +39,28 @@ def new_note(request, show_pk):
     return render(request, 'lmn/notes/new_note.html', { 'form': form, 'show': show })
 
 
+@cached_page(lambda request: ['notes'])
 def latest_notes(request):
-    notes = Note.objects.all().order_by('-posted_date')
+    notes = Note.objects.for_listing().order_by('-posted_date')
         
-    paginator = Paginator(notes, 25)
-    page_number = request.GET.get('page')
-    page_object = paginator.get_page(page_number)
+    page_object = paginate(request, notes)
     
     return render(request, 'lmn/notes/note_list.html', { 'notes': page_object })
 
 
+@cached_page(lambda request, show_pk: [f'show:{show_pk}'])
 def notes_for_show(request, show_pk): 
     # Notes for show, most recent first
-    notes = Note.objects.filter(show=show_pk).order_by('-posted_date')
-    show = Show.objects.get(pk=show_pk)  
+    notes = Note.objects.for_listing().filter(show=show_pk).order_by('-posted_date')
+    show = Show.objects.select_related('artist', 'venue', 'stats').get(pk=show_pk)
     
-    paginator = Paginator(notes, 25)
-    page_number = request.GET.get('page')
-    page_object = paginator.get_page(page_number)
+    page_object = paginate(request, notes)
     
     return render(request, 'lmn/notes/note_list.html', { 'show': show, 'notes': page_object })
 
 
 def note_detail(request, note_pk):
-    note = get_object_or_404(Note, pk=note_pk)
+    note = get_object_or_404(Note.objects.for_listing(), pk=note_pk)
     return render(request, 'lmn/notes/note_detail.html', { 'note': note })
 @login_required
 def modify_note(request, note_pk):
@@ -65,9 +72,11 @@ def modify_note(request, note_pk):
         form = NewNoteForm(request.POST, request.FILES, instance=note)
         if form.is_valid():
             note = form.save(commit=False)
-            note.user = request.User
+            note.user = request.user
             note.show = show
             note.save()
+            if 'photo' in request.FILES:
+                photos.make_renditions(note)
             return redirect('note_detail', note_pk=note.pk)
         else:
             form = NewNoteForm(instance=note)
@@ -83,21 +92,37 @@ def delete_note(request, note_pk):
         return HttpResponseForbidden() 
 
 def best_shows(request):
-    notes = Note.objects.all().order_by('-rating')
-    return render(request, 'lmn/best_shows/best_shows.html', { 'notes': notes })
+    # Ranking every show is an aggregate over all notes, so the count and each page are cached until a note changes
+    def ranked():
+        return Show.objects.ranked_by_notes(settings.BEST_SHOWS_PRIOR_WEIGHT)  # reads the site-wide average
+
+    count_key = versioned_key('best_shows', 'count', depends_on=['notes'])
+    count = cache.get(count_key)
+    if count is None:
+        count = ranked().count()
+        cache.set(count_key, count, settings.BEST_SHOWS_CACHE_SECONDS)
+
+    # A paginator over a range turns ?page= into a page that exists without counting the shows again,
+    # and that page number, never the raw parameter, goes in the cache key
+    page_object = Paginator(range(count), 25).get_page(request.GET.get('page'))
+    key = versioned_key('best_shows', page_object.number, depends_on=['notes'])
+    shows = cache.get(key)
+    if shows is None:
+        shows = list(ranked()[page_object.start_index() - 1:page_object.end_index()]) if count else []
+        cache.set(key, shows, settings.BEST_SHOWS_CACHE_SECONDS)
+
+    page_object.object_list = shows
+    return render(request, 'lmn/best_shows/best_shows.html', { 'shows': page_object })
 
 @login_required
 def user_notes(request):
     form = NoteSearchForm()
     search_name = request.GET.get('search_name')
     if search_name:
-        notes = Note.objects.filter(user=request.user, title__icontains=search_name).order_by('-posted_date') | \
-                Note.objects.filter(user=request.user, text__icontains=search_name).order_by('-posted_date')
+        notes = search(Note.objects.filter(user=request.user), search_name)
     else:
         notes = Note.objects.filter(user=request.user).order_by('-posted_date')
-    paginator = Paginator(notes, 25)
-    page_number = request.GET.get('page')
-    page_object = paginator.get_page(page_number)
+    page_object = paginate(request, notes.for_listing())
         
     return render(request, 'lmn/notes/note_list.html', {'notes': page_object, 'my_notes': True, 'form': form,
                                                         'search_term': search_name})
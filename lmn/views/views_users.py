@@ -8,11 +8,14 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login, logout
 
+from ..caching import cached_page
 
+
+@cached_page(lambda request, user_pk: [f'user:{user_pk}'])
 def user_profile(request, user_pk):
     # Get user profile for any user on the site
     user = User.objects.get(pk=user_pk)
-    usernotes = Note.objects.filter(user=user.pk).order_by('-posted_date')
+    usernotes = Note.objects.for_listing().filter(user=user.pk).order_by('-posted_date')
     return render(request, 'lmn/users/user_profile.html', { 'user_profile': user , 'notes': usernotes })
 
 
@@ -26,7 +29,7 @@ def my_user_profile(request):
             profile_form.save()
 
     user = request.user
-    usernotes = Note.objects.filter(user=user.pk).order_by('-posted_date')
+    usernotes = Note.objects.for_listing().filter(user=user.pk).order_by('-posted_date')
     form = ProfileForm(instance=user.profile) if hasattr(user, 'profile') else ProfileForm()
     data = {
         'user_profile': user,
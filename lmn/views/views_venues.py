@@ -7,35 +7,40 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login, logout
 
-from django.core.paginator import Paginator
+from ..caching import cached_page
+from ..pagination import paginate
+from ..search import search, similar
 
 
+@cached_page(lambda request: ['lmn_venue'])
 def venue_list(request):
     form = VenueSearchForm()
     search_name = request.GET.get('search_name')
+    similar_names = False
 
     if search_name:
         #search for this venue, display results
-        venues = Venue.objects.filter(name__icontains=search_name).order_by('name')
+        venues = search(Venue.objects.all(), search_name)
+        if not venues.exists():
+            # Nothing starts with those words, maybe they're misspelled
+            venues = similar(Venue.objects.all(), search_name)
+            similar_names = True
     else :
         venues = Venue.objects.all().order_by('name')
         
-    paginator = Paginator(venues, 25)
-    page_number = request.GET.get('page')
-    page_object = paginator.get_page(page_number)
+    page_object = paginate(request, venues)
 
-    return render(request, 'lmn/venues/venue_list.html', { 'venues': page_object, 'form': form, 'search_term': search_name })
+    return render(request, 'lmn/venues/venue_list.html', { 'venues': page_object, 'form': form, 'search_term': search_name, 'similar_names': similar_names })
 
 
+@cached_page(lambda request, venue_pk: [f'venue:{venue_pk}'])
 def artists_at_venue(request, venue_pk):   # pk = venue_pk
     """ Get all of the artists who have played a show at the venue with pk provided """
 
     shows = Show.objects.filter(venue=venue_pk).order_by('-show_date') 
     venue = Venue.objects.get(pk=venue_pk)
     
-    paginator = Paginator(shows, 25)
-    page_number = request.GET.get('page')
-    page_object = paginator.get_page(page_number)
+    page_object = paginate(request, shows)
 
     return render(request, 'lmn/artists/artist_list_for_venue.html', { 'venue': venue, 'shows': page_object })
 
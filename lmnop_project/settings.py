@@ -40,7 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'lmn'
+    'lmn.apps.LmnConfig'
 ]
 
 MIDDLEWARE = [
@@ -108,6 +108,33 @@ elif os.getenv('UPDATE_DB'): # set this env var while cloud_sql_proxy is running
         }
             
 
+# Cache
+# Cached pages and the versions that invalidate them (lmn/caching.py) must be shared by every process serving the
+# site. Local memory is per process, so it only suits a single process like runserver. Set CACHE_DIR for several
+# processes on one machine, or MEMCACHED_LOCATION (host:port) for several machines.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+if os.getenv('MEMCACHED_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': os.environ['MEMCACHED_LOCATION'],
+        }
+    }
+elif os.getenv('CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ['CACHE_DIR'],
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -166,3 +193,62 @@ else:
 # Where to send user after successful login, and logout, if no other page is provided.
 LOGIN_REDIRECT_URL = 'my_user_profile'
 LOGOUT_REDIRECT_URL = 'homepage'
+
+# List pages up to this one are numbered. Links further in use cursors, which cost the same however deep
+# they go but don't know the page number. None turns cursors off.
+PAGINATION_CURSOR_AFTER_PAGE = 10
+# Page counts ("Page X of N") of unfiltered lists of tables at least this big are the database's estimate on Postgres.
+# Other counts are exact, and cached until the table changes (see lmn/pagination.py).
+PAGINATION_EXACT_COUNT_BELOW = 10000
+PAGINATION_COUNT_CACHE_SECONDS = 10 * 60
+
+# Best shows are ranked by a Bayesian average: each show's ratings plus this many
+# imaginary notes at the site-wide average, so a single 5 star note can't top the list.
+BEST_SHOWS_PRIOR_WEIGHT = 5
+BEST_SHOWS_CACHE_SECONDS = 10 * 60  # also refreshed whenever a note changes
+
+# Whole pages of the busiest lists are cached this long, or until something on them changes (see lmn/caching.py).
+# 0 turns page caching off.
+PAGE_CACHE_SECONDS = 5 * 60
+# A rendered note card is cached under a key that changes with anything it shows (see lmn/note_cards.py),
+# so this only bounds how long unused cards take up room
+NOTE_CARD_CACHE_SECONDS = 24 * 60 * 60
+
+# Uploaded photos are also saved this many pixels wide, as WebP and JPEG, for pages to use instead of the
+# original (see lmn/photos.py). Note cards are 300 pixels wide.
+PHOTO_RENDITION_WIDTHS = [300, 600, 1200]
+PHOTO_RENDITION_QUALITY = 80
+
+# Replaced and deleted photos are queued and deleted from storage by the drain_photo_deletions command.
+# A failed delete is retried after this many seconds, doubling with each failure, up to a day.
+PHOTO_DELETION_RETRY_SECONDS = 60
+# How long a worker has to finish a batch before other workers may claim its photos
+PHOTO_DELETION_LEASE_SECONDS = 10 * 60
+
+# When a search finds no artist or venue names, names at least this similar to it are shown instead,
+# from 0 (anything) to 1 (the same words). 0.3 is pg_trgm's own default.
+NAME_SIMILARITY_THRESHOLD = 0.3
+
+# Ticketmaster Discovery API, used to fill in artists, venues and shows
+TICKETMASTER_KEY = os.environ.get('TICKETMASTER_KEY')
+TICKETMASTER_BASE_URL = os.environ.get('TICKETMASTER_BASE_URL', 'https://app.ticketmaster.com/discovery/v2/')
+TICKETMASTER_PAGE_SIZE = 200  # the largest page the API serves
+TICKETMASTER_MAX_WORKERS = 4
+TICKETMASTER_REQUESTS_PER_SECOND = 5  # default Discovery API quota
+TICKETMASTER_POOL_SIZE = 10  # kept-alive connections
+TICKETMASTER_CONNECT_TIMEOUT = 5  # seconds
+TICKETMASTER_READ_TIMEOUT = 30
+TICKETMASTER_MAX_RETRIES = 4  # for connection errors, timeouts, 429 and 5xx
+TICKETMASTER_STREAM_PAGES = True  # parse pages one item at a time rather than all at once
+
+# Each market is crawled separately, in its own worker process when there are several.
+# Events are searched by DMA, https://developer.ticketmaster.com/products-and-docs/apis/discovery-api/v2/#supported-dma
+TICKETMASTER_MARKETS = [
+    {'name': 'minneapolis', 'dmaId': '336', 'stateCode': 'MN'},
+]
+TICKETMASTER_SHARD_PROCESSES = 4
+
+# Responses are cached on disk and shared by every sync. Set the directory to None to turn caching off.
+TICKETMASTER_CACHE_DIR = os.environ.get('TICKETMASTER_CACHE_DIR', os.path.join(BASE_DIR, 'ticketmaster_cache'))
+TICKETMASTER_CACHE_TTL = 60 * 60  # seconds before an entry is revalidated upstream
+TICKETMASTER_CACHE_MAX_BYTES = 200 * 1024 * 1024